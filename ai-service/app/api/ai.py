@@ -3,33 +3,43 @@ AI API Endpoints
 FastAPI routes for AI features
 """
 
+import asyncio
 import uuid
 import structlog
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, File, UploadFile, Form
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, File, UploadFile, Form, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional
 import json
 import redis.asyncio as redis
 
 from app.config import get_settings
-from app.workers.chat import process_chat, process_chat_stream
-from app.workers.size_rec import recommend_size
-from app.workers.tryon import process_tryon
+from app.services.cache import get_redis
+from app.services.chat_store import ChatSessionStore, get_chat_store
+from app.services.jobs import save_job, load_job
+from app.services.product_images import invalidate_product_image
+from app.services.rabbitmq import enqueue_tryon, publish_product_updated
+from app.services.storage import get_object_bytes
+from app.services.streaming import coalesce_chunks
+from app.services.uploads import (
+    IngestedUpload,
+    UnsupportedUpload,
+    UploadTooLarge,
+    ingest_image_upload,
+    too_large_detail,
+)
+from app.workers.chat import process_chat, process_chat_stream, response_cache
+from app.workers.chat_history import build_history
+from app.workers.size_rec import chart_provider, recommend_size, recommend_sizes_batch
+from app.workers.size_tips import load_tips_status
+from app.workers.tryon import run_tryon_job, invalidate_garment_cache
 
 settings = get_settings()
 logger = structlog.get_logger()
 router = APIRouter()
 
-# Redis client for session management
-redis_client = None
-
-
-async def get_redis():
-    global redis_client
-    if redis_client is None:
-        redis_client = redis.from_url(settings.redis_url)
-    return redis_client
+# Detached cleanup of abandoned chat streams, kept referenced until done
+_background_tasks: set[asyncio.Task] = set()
 
 
 # ==================== Models ====================
@@ -59,6 +69,23 @@ class SizeRecommendRequest(BaseModel):
     fit_preference: str = Field("regular", pattern="^(slim|regular|loose)$")
 
 
+class BatchSizeProduct(BaseModel):
+    product_id: str
+    product_type: str = "ao_thun"
+
+
+class BatchSizeRecommendRequest(BaseModel):
+    products: list[BatchSizeProduct] = Field(..., min_length=1, max_length=100)
+    height: Optional[float] = Field(None, ge=100, le=250)
+    weight: Optional[float] = Field(None, ge=30, le=200)
+    chest: Optional[float] = Field(None, ge=60, le=150)
+    waist: Optional[float] = Field(None, ge=50, le=130)
+    hips: Optional[float] = Field(None, ge=60, le=150)
+    shoulder: Optional[float] = Field(None, ge=30, le=60)
+    fit_preference: str = Field("regular", pattern="^(slim|regular|loose)$")
+    include_tips: bool = False
+
+
 class SizeRecommendResponse(BaseModel):
     success: bool = True
     data: dict
@@ -79,7 +106,7 @@ class TryOnResponse(BaseModel):
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, r: redis.Redis = Depends(get_redis)):
+async def chat(request: ChatRequest, store: ChatSessionStore = Depends(get_chat_store)):
     """
     Send a message to Fashion AI chatbot.
     
@@ -90,35 +117,13 @@ async def chat(request: ChatRequest, r: redis.Redis = Depends(get_redis)):
     # Generate or validate session ID
     session_id = request.session_id or str(uuid.uuid4())
     
-    # Get conversation history from Redis
-    history = await get_chat_history(r, session_id)
+    # Recent history within the token budget, plus a summary of older turns
+    history, summary = await build_history(store, session_id)
     
     if request.stream:
         # Return streaming response
-        async def generate():
-            full_response = ""
-            async for chunk in process_chat_stream(
-                session_id=session_id,
-                message=request.message,
-                history=history,
-                context=request.context,
-            ):
-                if chunk.get("error"):
-                    yield f"data: {json.dumps({'error': chunk['error']})}\n\n"
-                    return
-                
-                if chunk.get("chunk"):
-                    full_response += chunk["chunk"]
-                    yield f"data: {json.dumps({'chunk': chunk['chunk'], 'done': chunk.get('done', False)})}\n\n"
-                
-                if chunk.get("done"):
-                    # Save to history
-                    await save_chat_message(r, session_id, "user", request.message)
-                    await save_chat_message(r, session_id, "model", full_response)
-                    yield f"data: {json.dumps({'done': True, 'session_id': session_id})}\n\n"
-        
         return StreamingResponse(
-            generate(),
+            _stream_chat(store, session_id, request, history, summary),
             media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
@@ -132,26 +137,98 @@ async def chat(request: ChatRequest, r: redis.Redis = Depends(get_redis)):
         message=request.message,
         history=history,
         context=request.context,
+        summary=summary,
     )
     
     if result.get("error") and "GEMINI_NOT_CONFIGURED" in str(result.get("error", "")):
         raise HTTPException(status_code=503, detail="AI service not available")
     
     # Save to history
-    await save_chat_message(r, session_id, "user", request.message)
-    await save_chat_message(r, session_id, "model", result.get("response", ""))
+    await store.append_turn(session_id, request.message, result.get("response", ""))
     
     return ChatResponse(data={
         "session_id": session_id,
         "response": result.get("response", ""),
         "tokens_used": result.get("tokens_used", 0),
+        "cached": result.get("cached", False),
     })
 
 
+async def _stream_chat(
+    store: ChatSessionStore,
+    session_id: str,
+    request: ChatRequest,
+    history: list[dict],
+    summary: str,
+):
+    """
+    Yield a chat answer as SSE events, coalescing small chunks.
+
+    Starlette cancels this generator when the client disconnects; the
+    cancellation reaches the Gemini stream through coalesce_chunks, and
+    whatever was already sent is still saved to the session history.
+    """
+    events = coalesce_chunks(
+        process_chat_stream(
+            session_id=session_id,
+            message=request.message,
+            history=history,
+            context=request.context,
+            summary=summary,
+        ),
+        max_chars=settings.chat_stream_coalesce_chars,
+        max_delay=settings.chat_stream_coalesce_delay,
+    )
+    full_response = ""
+    saved = False
+    try:
+        async for chunk in events:
+            if chunk.get("error"):
+                yield f"data: {json.dumps({'error': chunk['error']})}\n\n"
+                return
+            
+            if chunk.get("chunk"):
+                full_response += chunk["chunk"]
+                yield f"data: {json.dumps({'chunk': chunk['chunk'], 'done': chunk.get('done', False)})}\n\n"
+            
+            if chunk.get("done"):
+                # Save to history
+                await store.append_turn(session_id, request.message, full_response)
+                saved = True
+                yield f"data: {json.dumps({'done': True, 'session_id': session_id, 'cached': chunk.get('cached', False)})}\n\n"
+    finally:
+        if not saved:
+            # Awaiting here would be cancelled along with the response
+            task = asyncio.create_task(_finish_chat_stream(events, store, session_id, request.message, full_response))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+
+async def _finish_chat_stream(
+    events,
+    store: ChatSessionStore,
+    session_id: str,
+    message: str,
+    partial_response: str,
+):
+    """Close an abandoned chat stream and keep the partial answer."""
+    try:
+        await events.aclose()
+    except Exception as e:
+        logger.warning("Failed to close chat stream", session_id=session_id, error=str(e))
+    if not partial_response:
+        return
+    try:
+        await store.append_turn(session_id, message, partial_response)
+        logger.info("Saved partial chat answer", session_id=session_id, response_length=len(partial_response))
+    except Exception as e:
+        logger.warning("Failed to save partial chat answer", session_id=session_id, error=str(e))
+
+
 @router.get("/chat/sessions/{session_id}")
-async def get_session_history(session_id: str, r: redis.Redis = Depends(get_redis)):
+async def get_session_history(session_id: str, store: ChatSessionStore = Depends(get_chat_store)):
     """Get chat history for a session."""
-    history = await get_chat_history(r, session_id)
+    history = await store.load(session_id)
     return {
         "success": True,
         "data": {
@@ -162,16 +239,30 @@ async def get_session_history(session_id: str, r: redis.Redis = Depends(get_redi
 
 
 @router.delete("/chat/sessions/{session_id}")
-async def delete_session(session_id: str, r: redis.Redis = Depends(get_redis)):
+async def delete_session(session_id: str, store: ChatSessionStore = Depends(get_chat_store)):
     """Delete a chat session."""
-    key = f"chat:session:{session_id}"
-    await r.delete(key)
+    await store.delete(session_id)
     return {"success": True, "message": "Session deleted"}
 
 
+@router.delete("/chat/cache")
+async def invalidate_chat_cache(message: Optional[str] = Query(None, max_length=2000)):
+    """
+    Drop cached FAQ answers (admin).
+    
+    - message: drop only this question (matched after normalization)
+    - without message: drop every cached answer
+    """
+    removed = await response_cache.invalidate(message)
+    return {"success": True, "data": {"removed": removed}}
+
+
 # ==================== Size Recommendation Endpoints ====================
 
 
+TIPS_POLL_INTERVAL = 0.25  # seconds between tips status reads while streaming
+
+
 @router.post("/size-recommend", response_model=SizeRecommendResponse)
 async def size_recommendation(request: SizeRecommendRequest):
     """
@@ -196,6 +287,71 @@ async def size_recommendation(request: SizeRecommendRequest):
     return SizeRecommendResponse(data=result)
 
 
+@router.post("/size-recommend/batch", response_model=SizeRecommendResponse)
+async def size_recommendation_batch(request: BatchSizeRecommendRequest):
+    """
+    Size recommendations for many products from one set of measurements.
+
+    - For listing and cart pages: one request instead of one per product
+    - Each product type is scored once
+    - Tips are off by default; when requested, generated once per product type
+    """
+    measurements = request.model_dump(include={"height", "weight", "chest", "waist", "hips", "shoulder"})
+
+    recommendations = await recommend_sizes_batch(
+        products=[product.model_dump() for product in request.products],
+        measurements=measurements,
+        fit_preference=request.fit_preference,
+        include_tips=request.include_tips,
+    )
+
+    return SizeRecommendResponse(data={"recommendations": recommendations})
+
+
+@router.get("/size-recommend/tips/{tips_id}")
+async def get_size_tips(tips_id: str, stream: bool = False):
+    """
+    Get tips that were still being generated when a recommendation returned.
+    
+    - status: pending, completed or failed (failed carries fallback tips)
+    - stream=true: Server-Sent Events, one event when the tips are ready
+    """
+    if stream:
+        return StreamingResponse(
+            _stream_size_tips(tips_id),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+            }
+        )
+    
+    status = await load_tips_status(tips_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Tips not found")
+    
+    return {"success": True, "data": {"tips_id": tips_id, **status}}
+
+
+async def _stream_size_tips(tips_id: str):
+    """Poll the tips record and emit it once it is no longer pending."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.size_tips_stream_timeout
+    
+    while True:
+        status = await load_tips_status(tips_id)
+        if not status:
+            yield f"data: {json.dumps({'error': 'Tips not found'})}\n\n"
+            return
+        if status["status"] != "pending":
+            yield f"data: {json.dumps({'tips_id': tips_id, **status, 'done': True}, ensure_ascii=False)}\n\n"
+            return
+        if loop.time() >= deadline:
+            yield f"data: {json.dumps({'tips_id': tips_id, 'status': 'pending', 'done': True})}\n\n"
+            return
+        await asyncio.sleep(TIPS_POLL_INTERVAL)
+
+
 @router.get("/size-guide/{product_type}")
 async def get_size_guide(product_type: str):
     """Get size chart for a product type."""
@@ -223,6 +379,19 @@ async def get_size_guide(product_type: str):
     }
 
 
+@router.delete("/size-charts/{product_id}/cache")
+async def invalidate_size_chart(product_id: str):
+    """
+    Drop the cached size chart of a product.
+    
+    Called when a product's sizeGuide is edited; the update is broadcast
+    so every AI service instance reloads the chart.
+    """
+    evicted = chart_provider.invalidate(product_id)
+    broadcast = await publish_product_updated(product_id)
+    return {"success": True, "data": {"product_id": product_id, "evicted": evicted, "broadcast": broadcast}}
+
+
 # ==================== Virtual Try-on Endpoints ====================
 
 
@@ -236,12 +405,17 @@ async def virtual_tryon(
     product_type: str = Form("ao_thun"),
     product_sizes: str = Form("S,M,L,XL"),
     product_material: str = Form("cotton"),
+    session_id: Optional[str] = Form(None),
+    stream: bool = Form(False),
 ):
     """
     Virtual Try-on using Gemini Vision AI.
     
     Analyzes user's body from photo and predicts how the garment will fit.
     Returns detailed fit description and size recommendation.
+    
+    - Pass session_id to reuse the body analysis of a similar earlier photo
+    - stream=true returns Server-Sent Events as each stage completes
     """
     # Validate file type
     allowed_types = ["image/jpeg", "image/png", "image/webp"]
@@ -251,10 +425,16 @@ async def virtual_tryon(
             detail=f"Invalid file type. Allowed: {', '.join(allowed_types)}"
         )
     
-    # Check file size (5MB max)
-    contents = await user_image.read()
-    if len(contents) > 5 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Max 5MB")
+    # The body size was capped by UploadLimitMiddleware before form parsing
+    try:
+        upload = await ingest_image_upload(user_image)
+    except UploadTooLarge:
+        raise HTTPException(status_code=400, detail=too_large_detail())
+    except UnsupportedUpload:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed: {', '.join(allowed_types)}"
+        )
     
     # Generate job ID
     job_id = f"tryon_{uuid.uuid4().hex[:12]}"
@@ -264,9 +444,9 @@ async def virtual_tryon(
         "job_id": job_id,
         "status": "processing",
         "product_id": product_id,
+        "session_id": session_id,
         "created_at": str(uuid.uuid1().time),
     }
-    await r.setex(f"ai:job:{job_id}", 3600, json.dumps(job_data))
     
     # Product info
     product_info = {
@@ -277,23 +457,49 @@ async def virtual_tryon(
         "material": product_material,
     }
     
-    # For now, we need a product image. Using a placeholder.
-    # In production, you'd fetch this from the database
-    product_image_data = b""  # Placeholder - would come from database
+    if stream:
+        # The stream owns the upload buffer and releases it when done
+        return StreamingResponse(
+            _stream_tryon(upload, job_data, product_info),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+            }
+        )
+    
+    try:
+        return await _run_tryon(r, upload, job_data, product_info)
+    finally:
+        upload.close()
+
+
+async def _run_tryon(
+    r: redis.Redis,
+    upload: IngestedUpload,
+    job_data: dict,
+    product_info: dict,
+) -> TryOnResponse:
+    """Process the try-on job inline or enqueue it."""
+    job_id = job_data["job_id"]
+    await save_job(r, job_data)
+    
+    if settings.tryon_async:
+        # Hand the job to the RabbitMQ consumers and return immediately
+        job_data["status"] = "queued"
+        await save_job(r, job_data)
+        if await enqueue_tryon(job_data, bytes(upload.view), product_info):
+            return TryOnResponse(data={"job_id": job_id, "status": "queued"})
+        
+        logger.warning("Try-on queue unavailable, processing inline", job_id=job_id)
     
     try:
-        # Process try-on synchronously for now
-        result = await process_tryon(
-            job_id=job_id,
-            user_image_data=contents,
-            product_image_data=product_image_data,
+        job_data = await run_tryon_job(
+            job_data=job_data,
+            user_image_data=upload.view,
             product_info=product_info,
         )
-        
-        # Update job with result
-        job_data["status"] = result.get("status", "completed")
-        job_data["result"] = result
-        await r.setex(f"ai:job:{job_id}", 3600, json.dumps(job_data))
+        result = job_data["result"]
         
         return TryOnResponse(data={
             "job_id": job_id,
@@ -301,27 +507,118 @@ async def virtual_tryon(
             "body_analysis": result.get("body_analysis"),
             "fit_prediction": result.get("fit_prediction"),
             "garment_analysis": result.get("garment_analysis"),
+            "overlay_url": result.get("overlay_url"),
+            "overlay_urls": result.get("overlay_urls") or {},
         })
         
     except Exception as e:
         logger.error("Try-on failed", job_id=job_id, error=str(e))
-        job_data["status"] = "failed"
-        job_data["error"] = str(e)
-        await r.setex(f"ai:job:{job_id}", 3600, json.dumps(job_data))
-        
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _stream_tryon(upload: IngestedUpload, job_data: dict, product_info: dict):
+    """Yield try-on stage results as SSE events while the job runs."""
+    job_id = job_data["job_id"]
+    events: asyncio.Queue = asyncio.Queue()
+    
+    async def on_event(event: str, data: dict):
+        await events.put({"event": event, "data": data})
+    
+    async def run() -> dict:
+        try:
+            return await run_tryon_job(
+                job_data=job_data,
+                user_image_data=upload.view,
+                product_info=product_info,
+                on_event=on_event,
+            )
+        finally:
+            await events.put(None)
+    
+    task = asyncio.create_task(run())
+    try:
+        yield f"data: {json.dumps({'event': 'started', 'job_id': job_id})}\n\n"
+        
+        while (event := await events.get()) is not None:
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        
+        try:
+            result = (await task)["result"]
+        except Exception as e:
+            logger.error("Try-on stream failed", job_id=job_id, error=str(e))
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            return
+        
+        if result.get("status") == "failed":
+            yield f"data: {json.dumps({'error': result.get('error')}, ensure_ascii=False)}\n\n"
+            return
+        yield f"data: {json.dumps({'done': True, 'job_id': job_id, 'status': result.get('status')})}\n\n"
+    finally:
+        if not task.done():
+            task.cancel()
+        upload.close()
+
+
 @router.get("/try-on/{job_id}", response_model=TryOnResponse)
 async def get_tryon_result(job_id: str, r: redis.Redis = Depends(get_redis)):
     """Get the result of a try-on request."""
-    key = f"ai:job:{job_id}"
-    job_data = await r.get(key)
+    job_data = await load_job(r, job_id)
+    
+    if not job_data:
+        raise HTTPException(status_code=404, detail="Try-on job not found")
+    
+    return TryOnResponse(data=job_data)
+
+
+@router.get("/try-on/{job_id}/preview")
+async def get_tryon_preview(
+    job_id: str,
+    request: Request,
+    size: Optional[str] = Query(None, max_length=16),
+    variant: str = Query("full", pattern="^(full|thumb)$"),
+    r: redis.Redis = Depends(get_redis),
+):
+    """
+    Get the rendered overlay preview of a try-on.
     
+    - size: garment size to show (default: the recommended one); the
+      recommended size and its neighbours are rendered
+    - variant: full or thumb
+    - Strong ETag from the image content; If-None-Match returns 304
+    """
+    job_data = await load_job(r, job_id)
     if not job_data:
         raise HTTPException(status_code=404, detail="Try-on job not found")
     
-    return TryOnResponse(data=json.loads(job_data))
+    previews = (job_data.get("result") or {}).get("previews") or {}
+    preview = (previews.get("sizes", {}).get(size or previews.get("size")) or {}).get(variant)
+    if not preview:
+        raise HTTPException(status_code=404, detail="Preview not available")
+    
+    etag = f'"{preview["etag"]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={settings.preview_max_age}",
+    }
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    
+    data = await get_object_bytes(preview["object"])
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+
+@router.delete("/try-on/garments/{product_id}/cache")
+async def invalidate_garment_analysis(product_id: str):
+    """
+    Drop cached garment analyses of a product.
+    
+    Called when a product image is replaced.
+    """
+    removed = await invalidate_garment_cache(product_id)
+    invalidate_product_image(product_id)
+    return {"success": True, "data": {"product_id": product_id, "removed": removed}}
 
 
 # ==================== Job Status Endpoints ====================
@@ -334,40 +631,9 @@ async def get_job_status(job_id: str, r: redis.Redis = Depends(get_redis)):
     
     Used for async operations like virtual try-on.
     """
-    key = f"ai:job:{job_id}"
-    job_data = await r.get(key)
+    job_data = await load_job(r, job_id)
     
     if not job_data:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    return JobStatusResponse(data=json.loads(job_data))
-
-
-# ==================== Helper Functions ====================
-
-
-async def get_chat_history(r: redis.Redis, session_id: str) -> list[dict]:
-    """Get chat history from Redis."""
-    key = f"chat:session:{session_id}"
-    history_raw = await r.lrange(key, 0, -1)
-    
-    history = []
-    for item in history_raw:
-        try:
-            history.append(json.loads(item))
-        except json.JSONDecodeError:
-            continue
-    
-    return history[-settings.chat_max_history:]  # Limit history size
-
-
-async def save_chat_message(r: redis.Redis, session_id: str, role: str, content: str):
-    """Save a message to chat history."""
-    key = f"chat:session:{session_id}"
-    message = json.dumps({"role": role, "content": content})
-    
-    await r.rpush(key, message)
-    await r.expire(key, settings.chat_session_ttl)
-    
-    # Trim to max history
-    await r.ltrim(key, -(settings.chat_max_history * 2), -1)
+    return JobStatusResponse(data=job_data)
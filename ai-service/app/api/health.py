@@ -1,5 +1,7 @@
 from fastapi import APIRouter
 
+from app.services import llm
+
 router = APIRouter()
 
 
@@ -9,3 +11,12 @@ async def health_check():
         "status": "ok",
         "service": "ai-service",
     }
+
+
+@router.get("/health/llm")
+async def llm_health():
+    """Gemini call counters per model."""
+    return {
+        "status": "ok" if llm.client else "not_configured",
+        "models": llm.stats(),
+    }
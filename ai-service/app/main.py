@@ -6,7 +6,10 @@ from contextlib import asynccontextmanager
 
 from app.config import get_settings
 from app.api import health, ai
+from app.services.database import close_db_pool
 from app.services.rabbitmq import start_consumers, stop_consumers
+from app.services.uploads import UploadLimitMiddleware
+from app.workers.size_rec import load_size_tables
 
 settings = get_settings()
 
@@ -26,11 +29,13 @@ logger = structlog.get_logger()
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting AI Service", env=settings.env)
+    load_size_tables()
     await start_consumers()
     yield
     # Shutdown
     logger.info("Shutting down AI Service")
     await stop_consumers()
+    await close_db_pool()
 
 
 app = FastAPI(
@@ -40,7 +45,10 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-# CORS
+# Reject oversized uploads before the form is parsed and spooled
+app.add_middleware(UploadLimitMiddleware)
+
+# CORS (added last so it wraps every response)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
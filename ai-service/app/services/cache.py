@@ -0,0 +1,159 @@
+"""
+Caching Helpers
+Shared Redis client, token-owned Redis locks and a two-tier (memory + Redis) cache
+"""
+
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import redis.asyncio as redis
+import structlog
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+# Shared Redis client
+redis_client = None
+
+
+async def get_redis() -> redis.Redis:
+    """Get the shared Redis client."""
+    global redis_client
+    if redis_client is None:
+        redis_client = redis.from_url(settings.redis_url)
+    return redis_client
+
+
+# Delete a lock only while it still holds the caller's token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+async def release_lock(r: redis.Redis, key: str, token: str) -> bool:
+    """
+    Release a lock taken with SET key token NX.
+
+    A lock that expired and was taken by someone else is left alone.
+
+    Returns:
+        True if the lock was still ours and is now deleted
+    """
+    return bool(await r.eval(RELEASE_LOCK_SCRIPT, 1, key, token))
+
+
+class LRUCache:
+    """
+    In-process LRU cache bounded by the total size of its values.
+
+    Values are stored as encoded bytes so their size is known exactly.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._items: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            self.delete(key)
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        self.delete(key)
+        self._items[key] = (value, time.monotonic() + ttl)
+        self.current_bytes += len(value)
+        while self.current_bytes > self.max_bytes:
+            _, (evicted, _) = self._items.popitem(last=False)
+            self.current_bytes -= len(evicted)
+
+    def delete(self, key: str):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.current_bytes -= len(item[0])
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class TwoTierCache:
+    """
+    JSON cache with an in-process LRU in front of Redis.
+
+    Redis errors are logged and treated as misses so that caching never
+    breaks the request path.
+
+    Args:
+        prefix: Redis key prefix
+        ttl: Seconds entries live in both tiers
+        max_bytes: In-process tier budget; None disables that tier, so
+            every read goes to Redis and deletes apply to all instances
+            at once
+    """
+
+    def __init__(self, prefix: str, ttl: int, max_bytes: Optional[int]):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.local = LRUCache(max_bytes) if max_bytes is not None else None
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        full_key = self._key(key)
+
+        raw = self.local.get(full_key) if self.local is not None else None
+        if raw is None:
+            try:
+                r = await get_redis()
+                raw = await r.get(full_key)
+            except Exception as e:
+                logger.warning("Cache read failed", key=full_key, error=str(e))
+                return None
+            if raw is None:
+                return None
+            if self.local is not None:
+                self.local.set(full_key, raw, self.ttl)
+
+        return json.loads(raw)
+
+    async def set(self, key: str, value: Any):
+        full_key = self._key(key)
+        raw = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        if self.local is not None:
+            self.local.set(full_key, raw, self.ttl)
+
+        try:
+            r = await get_redis()
+            await r.setex(full_key, self.ttl, raw)
+        except Exception as e:
+            logger.warning("Cache write failed", key=full_key, error=str(e))
+
+    async def delete(self, *keys: str):
+        full_keys = [self._key(key) for key in keys]
+        if self.local is not None:
+            for full_key in full_keys:
+                self.local.delete(full_key)
+
+        if not full_keys:
+            return
+        try:
+            r = await get_redis()
+            await r.delete(*full_keys)
+        except Exception as e:
+            logger.warning("Cache delete failed", keys=full_keys, error=str(e))
@@ -0,0 +1,227 @@
+"""
+Chat Session Store
+Conversation history in a Redis list under chat:session:{session_id},
+with a rolling summary of older turns in chat:session:{session_id}:summary
+and the number of leading list entries it covers in chat:session:{session_id}:folded
+"""
+
+import json
+import uuid
+from typing import Optional
+
+import redis.asyncio as redis
+
+from app.config import get_settings
+from app.services.cache import get_redis, release_lock
+
+settings = get_settings()
+
+# Compact message encoding: "<role code>|<content>"
+ROLE_CODES = {"user": "u", "model": "m"}
+CODE_ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+# Append a turn, trim the list to its cap and shift the folded offset by the
+# entries trimmed off the front, so it keeps pointing at the same message.
+#
+# KEYS: list, summary, folded
+# ARGV: max stored, TTL, messages...
+APPEND_TURN_SCRIPT = """
+local length = redis.call('RPUSH', KEYS[1], unpack(ARGV, 3))
+local trimmed = length - tonumber(ARGV[1])
+if trimmed > 0 then
+    redis.call('LTRIM', KEYS[1], trimmed, -1)
+    local folded = tonumber(redis.call('GET', KEYS[3]) or 0)
+    if folded > 0 then
+        redis.call('SET', KEYS[3], math.max(folded - trimmed, 0))
+    end
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[2])
+end
+return length
+"""
+
+# Store a summary and move the folded offset past the messages it newly
+# covers, if the caller still holds the summary lock. Messages stay in the
+# list. They must still sit right after the current offset; when the offset
+# is 0, append_turn may have trimmed some of them off the front already, so
+# the list head is matched against every non-empty suffix of them. Anything
+# else means the session changed (or was replaced) and nothing is saved.
+#
+# KEYS: list, summary, folded, lock
+# ARGV: lock token, summary, TTL, newly folded messages...
+# Returns the new folded offset, -1 if the lock was lost, -2 if the messages
+# are no longer where they were loaded from
+SAVE_SUMMARY_SCRIPT = """
+if redis.call('GET', KEYS[4]) ~= ARGV[1] then
+    return -1
+end
+local count = #ARGV - 3
+local offset = tonumber(redis.call('GET', KEYS[3]) or 0)
+local head = redis.call('LRANGE', KEYS[1], offset, offset + count - 1)
+local last_gone = 0
+if offset == 0 then
+    last_gone = count - 1
+end
+for gone = 0, last_gone do
+    local match = true
+    for i = 1, count - gone do
+        if head[i] ~= ARGV[3 + gone + i] then
+            match = false
+            break
+        end
+    end
+    if match then
+        local folded = offset + count - gone
+        redis.call('SET', KEYS[3], folded, 'EX', ARGV[3])
+        redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+        return folded
+    end
+end
+return -2
+"""
+
+
+def encode_message(role: str, content: str) -> bytes:
+    return f"{ROLE_CODES[role]}|{content}".encode("utf-8")
+
+
+def decode_message(raw: bytes | str) -> Optional[dict]:
+    """Decode a stored message; also reads the legacy JSON encoding."""
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8")
+
+    role = CODE_ROLES.get(raw[:1]) if raw[1:2] == "|" else None
+    if role:
+        return {"role": role, "content": raw[2:]}
+
+    try:
+        message = json.loads(raw)
+    except json.JSONDecodeError:
+        return None
+    return message if isinstance(message, dict) and "role" in message else None
+
+
+class ChatSessionStore:
+    """
+    Chat history with one Redis round-trip per operation.
+
+    The list keeps the last 2 * max_history messages; appending a turn
+    pushes both messages, trims and refreshes the TTLs in one script.
+    Summarizing never removes messages: it advances the folded offset, and
+    only messages past it are sent to the model.
+    """
+
+    def __init__(self, r: redis.Redis, max_history: int | None = None, ttl: int | None = None):
+        self.r = r
+        self.max_history = max_history or settings.chat_max_history
+        self.max_stored = self.max_history * 2
+        self.ttl = ttl or settings.chat_session_ttl
+
+    @staticmethod
+    def key(session_id: str) -> str:
+        return f"chat:session:{session_id}"
+
+    @staticmethod
+    def summary_key(session_id: str) -> str:
+        return f"chat:session:{session_id}:summary"
+
+    @staticmethod
+    def folded_key(session_id: str) -> str:
+        return f"chat:session:{session_id}:folded"
+
+    @staticmethod
+    def summary_lock_key(session_id: str) -> str:
+        return f"chat:session:{session_id}:summary:lock"
+
+    async def load(self, session_id: str) -> list[dict]:
+        """The last max_history messages, oldest first, summarized or not."""
+        raw_messages = await self.r.lrange(self.key(session_id), -self.max_history, -1)
+        return [message for raw in raw_messages if (message := decode_message(raw))]
+
+    async def load_with_summary(self, session_id: str) -> tuple[list[dict], str]:
+        """The messages not covered by the summary yet, and the summary."""
+        raw_messages, summary = await self.load_raw_with_summary(session_id)
+        messages = [message for raw in raw_messages if (message := decode_message(raw))]
+        return messages, summary
+
+    async def load_raw_with_summary(self, session_id: str) -> tuple[list[bytes], str]:
+        """Like load_with_summary, with the messages still encoded."""
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.lrange(self.key(session_id), 0, -1)
+            pipe.get(self.summary_key(session_id))
+            pipe.get(self.folded_key(session_id))
+            raw_messages, summary, folded = await pipe.execute()
+        if isinstance(summary, bytes):
+            summary = summary.decode("utf-8")
+        return raw_messages[int(folded or 0):], summary or ""
+
+    async def save_summary(self, session_id: str, summary: str, folded: list[bytes], token: str) -> bool:
+        """
+        Store a new summary and mark the messages it covers as folded.
+
+        Atomic, and only while token still holds the summary lock. The
+        messages stay in the session history. Messages already trimmed by
+        append_turn are skipped; if the unfolded history no longer starts
+        with (the rest of) folded, nothing is changed.
+
+        Args:
+            session_id: Chat session
+            summary: Summary covering the folded messages
+            folded: Raw messages, as loaded, that the summary newly covers
+            token: Token returned by claim_summary
+
+        Returns:
+            True if the summary was stored
+        """
+        offset = await self.r.eval(
+            SAVE_SUMMARY_SCRIPT,
+            4,
+            self.key(session_id),
+            self.summary_key(session_id),
+            self.folded_key(session_id),
+            self.summary_lock_key(session_id),
+            token,
+            summary.encode("utf-8"),
+            self.ttl,
+            *folded,
+        )
+        return offset >= 0
+
+    async def claim_summary(self, session_id: str, ttl: int) -> Optional[str]:
+        """
+        Lock a session's summary regeneration across instances.
+
+        Returns:
+            Token to pass to save_summary and release_summary, or None if
+            another instance holds the lock
+        """
+        token = uuid.uuid4().hex
+        claimed = await self.r.set(self.summary_lock_key(session_id), token, nx=True, ex=ttl)
+        return token if claimed else None
+
+    async def release_summary(self, session_id: str, token: str):
+        """Release the summary lock if token still holds it."""
+        await release_lock(self.r, self.summary_lock_key(session_id), token)
+
+    async def append_turn(self, session_id: str, user_message: str, model_message: str):
+        """Store a user message and the model's reply."""
+        await self.r.eval(
+            APPEND_TURN_SCRIPT,
+            3,
+            self.key(session_id),
+            self.summary_key(session_id),
+            self.folded_key(session_id),
+            self.max_stored,
+            self.ttl,
+            encode_message("user", user_message),
+            encode_message("model", model_message),
+        )
+
+    async def delete(self, session_id: str):
+        await self.r.delete(self.key(session_id), self.summary_key(session_id), self.folded_key(session_id))
+
+
+async def get_chat_store() -> ChatSessionStore:
+    """Chat session store on the shared Redis client."""
+    return ChatSessionStore(await get_redis())
@@ -0,0 +1,37 @@
+"""
+Database Access
+Shared asyncpg pool for read-only queries against the backend's Postgres
+"""
+
+import asyncpg
+import structlog
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+# Shared connection pool, created on first use
+db_pool = None
+
+
+async def get_db_pool() -> asyncpg.Pool:
+    """Get the shared connection pool."""
+    global db_pool
+    if db_pool is None:
+        db_pool = await asyncpg.create_pool(
+            settings.database_url,
+            min_size=1,
+            max_size=settings.database_pool_size,
+        )
+        logger.info("Database pool created", max_size=settings.database_pool_size)
+    return db_pool
+
+
+async def close_db_pool():
+    """Close the shared connection pool."""
+    global db_pool
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
+        logger.info("Database pool closed")
@@ -0,0 +1,26 @@
+"""
+AI Job Records
+Job status stored in Redis under ai:job:{job_id}
+"""
+
+import json
+from typing import Optional
+
+import redis.asyncio as redis
+
+JOB_TTL = 3600  # seconds
+
+
+def job_key(job_id: str) -> str:
+    return f"ai:job:{job_id}"
+
+
+async def save_job(r: redis.Redis, job_data: dict):
+    """Create or overwrite a job record."""
+    await r.setex(job_key(job_data["job_id"]), JOB_TTL, json.dumps(job_data))
+
+
+async def load_job(r: redis.Redis, job_id: str) -> Optional[dict]:
+    """Load a job record, None if it does not exist or expired."""
+    job_data = await r.get(job_key(job_id))
+    return json.loads(job_data) if job_data else None
@@ -0,0 +1,374 @@
+"""
+LLM Gateway
+One Gemini client for all workers, with per-model concurrency limits,
+retries with jittered backoff, per-call timeouts, coalescing of identical
+in-flight requests and call metrics
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, TypeVar
+
+import requests
+import structlog
+from google import genai
+from google.genai import errors, types
+from pydantic import BaseModel
+
+from app.config import get_settings
+from app.services.singleflight import RedisSingleFlight, SingleFlight
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+T = TypeVar("T")
+
+# Initialize Gemini client
+client = None
+if settings.gemini_api_key:
+    client = genai.Client(
+        api_key=settings.gemini_api_key,
+        http_options=types.HttpOptions(timeout=int(settings.llm_timeout * 1000)),
+    )
+
+# Rate limiting, request timeout and transient server errors
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+# Identical concurrent generate() calls share one request
+_flight = SingleFlight()
+_redis_flight = RedisSingleFlight(
+    "ai:llm",
+    lock_ttl=settings.llm_coalesce_lock_ttl,
+    result_ttl=settings.llm_coalesce_result_ttl,
+)
+
+
+class LLMNotConfigured(Exception):
+    """No Gemini API key is set."""
+
+
+@dataclass
+class ModelStats:
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    in_flight: int = 0
+    waiting: int = 0  # Calls queued on the model's concurrency limit
+    coalesced: int = 0  # Calls that joined an identical in-flight request
+
+
+_semaphores: dict[str, asyncio.Semaphore] = {}
+_stats: dict[str, ModelStats] = {}
+
+
+def _limit(model: str) -> asyncio.Semaphore:
+    if model not in _semaphores:
+        limit = settings.llm_model_concurrency.get(model, settings.llm_max_concurrency)
+        _semaphores[model] = asyncio.Semaphore(limit)
+        _stats[model] = ModelStats()
+    return _semaphores[model]
+
+
+def _model_stats(model: str) -> ModelStats:
+    _limit(model)
+    return _stats[model]
+
+
+def stats() -> dict[str, dict]:
+    """Call counters per model."""
+    return {model: asdict(model_stats) for model, model_stats in _stats.items()}
+
+
+def request_key(model: str, contents: Any, config: types.GenerateContentConfig | None = None) -> str:
+    """
+    Canonical hash of a request.
+
+    Pydantic models are hashed by their set fields with dict keys sorted,
+    and inline image bytes are hashed as-is, so equal requests built
+    separately get the same key.
+    """
+    digest = hashlib.sha256()
+    _feed(digest, [model, contents, config])
+    return digest.hexdigest()
+
+
+def _feed(digest, value: Any):
+    if isinstance(value, BaseModel):
+        value = value.model_dump(exclude_none=True)
+    if isinstance(value, dict):
+        digest.update(b"{")
+        for key in sorted(value):
+            _feed(digest, key)
+            _feed(digest, value[key])
+        digest.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"[")
+        for item in value:
+            _feed(digest, item)
+        digest.update(b"]")
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        digest.update(b"b%d:" % len(value))
+        digest.update(value)
+    else:
+        text = repr(value).encode()
+        digest.update(b"%d:" % len(text))
+        digest.update(text)
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, requests.ConnectionError, requests.Timeout)):
+        return True
+    return isinstance(error, errors.APIError) and error.code in RETRYABLE_STATUS
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, base * 2^attempt], capped."""
+    return random.uniform(0, min(settings.llm_retry_max_delay, settings.llm_retry_base_delay * 2 ** attempt))
+
+
+async def _acquire(model: str) -> asyncio.Semaphore:
+    semaphore = _limit(model)
+    model_stats = _stats[model]
+    model_stats.waiting += 1
+    try:
+        await semaphore.acquire()
+    finally:
+        model_stats.waiting -= 1
+    model_stats.in_flight += 1
+    return semaphore
+
+
+def _release(model: str, semaphore: asyncio.Semaphore):
+    _stats[model].in_flight -= 1
+    semaphore.release()
+
+
+def _release_when_done(model: str, semaphore: asyncio.Semaphore, task: asyncio.Future):
+    """Release the slot once task has finished, even if nobody awaits it anymore."""
+    if task.done():
+        _release(model, semaphore)
+        return
+
+    def done(finished: asyncio.Future):
+        if not finished.cancelled():
+            finished.exception()  # Retrieved, so an abandoned failure is not logged as unhandled
+        _release(model, semaphore)
+
+    task.add_done_callback(done)
+
+
+async def _retry_or_raise(model: str, error: Exception, attempt: int, retries: int):
+    """Sleep before the next attempt, or re-raise if there is none."""
+    model_stats = _stats[model]
+    if isinstance(error, asyncio.TimeoutError):
+        model_stats.timeouts += 1
+    if attempt >= retries or not is_retryable(error):
+        model_stats.failures += 1
+        raise error
+
+    model_stats.retries += 1
+    delay = backoff_delay(attempt)
+    logger.warning("Retrying LLM call", model=model, attempt=attempt + 1, delay=round(delay, 2), error=str(error))
+    await asyncio.sleep(delay)
+
+
+async def generate(
+    model: str,
+    contents: Any,
+    config: types.GenerateContentConfig | None = None,
+    timeout: float | None = None,
+    retries: int | None = None,
+    coalesce: bool | None = None,
+) -> types.GenerateContentResponse:
+    """
+    Call Gemini generate_content through the gateway.
+
+    The model's concurrency slot is held only while a request is in
+    flight, not during backoff. Concurrent calls with an identical
+    request_key share one request and its response; with
+    settings.llm_coalesce_redis this also holds across processes.
+
+    Args:
+        model: Gemini model name
+        contents: Prompt text or Content list
+        config: Generation config
+        timeout: Seconds per attempt (default settings.llm_timeout)
+        retries: Extra attempts for retryable errors (default settings.llm_max_retries)
+        coalesce: Share identical in-flight requests (default settings.llm_coalesce)
+
+    Raises:
+        LLMNotConfigured: No API key is set
+    """
+    if not client:
+        raise LLMNotConfigured("Gemini client not configured")
+
+    def call():
+        return _generate(model, contents, config, timeout, retries)
+
+    if not (settings.llm_coalesce if coalesce is None else coalesce):
+        return await call()
+
+    key = request_key(model, contents, config)
+    if _flight.in_flight(key):
+        _model_stats(model).coalesced += 1
+    if settings.llm_coalesce_redis:
+        return await _flight.do(key, lambda: _redis_flight.do(key, call, _encode_response, _decode_response))
+    return await _flight.do(key, call)
+
+
+def _encode_response(response: types.GenerateContentResponse) -> bytes:
+    return response.model_dump_json(exclude_none=True).encode()
+
+
+def _decode_response(raw: bytes) -> types.GenerateContentResponse:
+    return types.GenerateContentResponse.model_validate_json(raw)
+
+
+async def _generate(
+    model: str,
+    contents: Any,
+    config: types.GenerateContentConfig | None,
+    timeout: float | None,
+    retries: int | None,
+) -> types.GenerateContentResponse:
+    return await call(
+        model,
+        lambda: client.aio.models.generate_content(model=model, contents=contents, config=config),
+        timeout,
+        retries,
+    )
+
+
+async def call(
+    model: str,
+    request: Callable[[], Awaitable[T]],
+    timeout: float | None = None,
+    retries: int | None = None,
+) -> T:
+    """
+    Run any Gemini API request for a model through the gateway.
+
+    Each attempt holds the model's concurrency slot and is bounded by
+    timeout; retryable errors are retried with backoff and every attempt
+    is counted in the model's stats. Used for generate and for other
+    per-model requests such as context cache creation.
+
+    The SDK sends requests from a worker thread that cancelling cannot
+    stop, so an attempt that times out is abandoned rather than cancelled
+    and keeps its slot until the request really ends. The client's
+    HttpOptions timeout (settings.llm_timeout) bounds how long that is.
+
+    Args:
+        model: Gemini model name the request counts against
+        request: Starts one attempt, e.g. lambda: client.aio.caches.create(...)
+        timeout: Seconds per attempt (default settings.llm_timeout)
+        retries: Extra attempts for retryable errors (default settings.llm_max_retries)
+
+    Raises:
+        LLMNotConfigured: No API key is set
+    """
+    if not client:
+        raise LLMNotConfigured("Gemini client not configured")
+
+    timeout = timeout or settings.llm_timeout
+    retries = settings.llm_max_retries if retries is None else retries
+
+    for attempt in range(retries + 1):
+        semaphore = await _acquire(model)
+        _stats[model].requests += 1
+        task = asyncio.ensure_future(request())
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except Exception as e:
+            error = e
+        else:
+            return result
+        finally:
+            _release_when_done(model, semaphore, task)
+
+        await _retry_or_raise(model, error, attempt, retries)
+
+
+async def generate_stream(
+    model: str,
+    contents: Any,
+    config: types.GenerateContentConfig | None = None,
+    timeout: float | None = None,
+    retries: int | None = None,
+) -> AsyncIterator[types.GenerateContentResponse]:
+    """
+    Stream Gemini generate_content chunks through the gateway.
+
+    The concurrency slot is held until the stream ends or is closed.
+    Retries happen only before the first chunk; timeout bounds the wait
+    for each chunk, the first one included.
+
+    Raises:
+        LLMNotConfigured: No API key is set
+    """
+    if not client:
+        raise LLMNotConfigured("Gemini client not configured")
+
+    timeout = timeout or settings.llm_timeout
+    retries = settings.llm_max_retries if retries is None else retries
+
+    for attempt in range(retries + 1):
+        semaphore = await _acquire(model)
+        _stats[model].requests += 1
+        stream = None
+        started = False
+        try:
+            stream = await client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    return
+                started = True
+                yield chunk
+        except Exception as e:
+            if started:
+                _stats[model].failures += 1
+                raise
+            error = e
+        finally:
+            _release(model, semaphore)
+            if stream is not None:
+                await stream.aclose()
+
+        await _retry_or_raise(model, error, attempt, retries)
+
+
+def extract_json(text: str | None) -> Any:
+    """
+    Parse JSON from model output.
+
+    Accepts bare JSON, JSON in a markdown code fence, or JSON surrounded by
+    prose (the outermost object or array is used).
+
+    Raises:
+        json.JSONDecodeError: No valid JSON found
+    """
+    text = (text or "").strip()
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+        if not starts:
+            raise
+        start = min(starts)
+        end = text.rfind("}" if text[start] == "{" else "]")
+        if end <= start:
+            raise
+        return json.loads(text[start:end + 1])
@@ -0,0 +1,94 @@
+"""
+Product Images
+Loads a product's main image (ProductImage.isMain) for try-on
+"""
+
+import asyncio
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpx
+import structlog
+
+from app.config import get_settings
+from app.services.cache import LRUCache
+from app.services.database import get_db_pool
+from app.services.storage import get_object_bytes
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+# Main image first, then the gallery order
+MAIN_IMAGE_QUERY = """
+SELECT url FROM product_images
+WHERE product_id = $1
+ORDER BY is_main DESC, sort_order ASC
+LIMIT 1
+"""
+
+# Recently used product images, keyed by product id
+_images = LRUCache(settings.product_image_cache_max_bytes)
+
+
+def _bucket_object(url: str) -> Optional[str]:
+    """Object name if url points into our MinIO bucket, else None."""
+    parsed = urlparse(url)
+    if parsed.scheme and parsed.netloc != settings.minio_endpoint:
+        return None
+    path = parsed.path.lstrip("/")
+    bucket_prefix = f"{settings.minio_bucket}/"
+    if path.startswith(bucket_prefix):
+        return path[len(bucket_prefix):]
+    # A bare object name (no scheme) is a key in the bucket
+    return None if parsed.scheme else path
+
+
+async def _fetch(url: str) -> bytes:
+    object_name = _bucket_object(url)
+    if object_name is not None:
+        return await get_object_bytes(object_name)
+
+    async with httpx.AsyncClient(timeout=settings.product_image_timeout, follow_redirects=True) as client:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            data = bytearray()
+            async for chunk in response.aiter_bytes():
+                data += chunk
+                if len(data) > settings.upload_max_bytes:
+                    raise ValueError("Product image too large")
+            return bytes(data)
+
+
+async def load_product_image(product_id: str | None) -> bytes:
+    """
+    Main image bytes of a product.
+
+    Images in our MinIO bucket are read directly, other URLs over HTTP.
+    Failures are logged and return b"", so try-on still runs without the
+    product-image stages.
+    """
+    if not product_id:
+        return b""
+
+    cached = _images.get(product_id)
+    if cached is not None:
+        return cached
+
+    try:
+        pool = await get_db_pool()
+        url = await pool.fetchval(MAIN_IMAGE_QUERY, product_id, timeout=settings.product_image_timeout)
+        if not url:
+            logger.info("Product has no image", product_id=product_id)
+            return b""
+        data = await asyncio.wait_for(_fetch(url), settings.product_image_timeout)
+    except Exception as e:
+        logger.warning("Failed to load product image", product_id=product_id, error=str(e))
+        return b""
+
+    _images.set(product_id, data, settings.product_image_cache_ttl)
+    return data
+
+
+def invalidate_product_image(product_id: str):
+    """Forget a product's cached image, e.g. after its images were edited."""
+    _images.delete(product_id)
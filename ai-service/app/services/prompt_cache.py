@@ -0,0 +1,244 @@
+"""
+Prompt Prefix Caching
+Registers static prompt prefixes as provider-side cached content
+"""
+
+import abc
+import asyncio
+import hashlib
+import itertools
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import structlog
+from google.genai import errors, types
+
+from app.config import get_settings
+from app.services import llm
+from app.services.singleflight import SingleFlight
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+
+@dataclass
+class CacheHandle:
+    """A cached prompt prefix registered with a provider."""
+
+    name: str
+    expires_at: float  # time.monotonic()
+    server_side: bool = True  # False: the prefix must still be sent with each request
+    model: str = ""
+
+
+def is_cache_rejection(error: BaseException) -> bool:
+    """
+    Whether a generate call failed because of its cached content.
+
+    True for a missing cache (404) and for an invalid-argument or
+    permission error that names the cached content. Rate limits, timeouts
+    and other failures are not fixed by resending the prompt inline.
+    """
+    if not isinstance(error, errors.APIError):
+        return False
+    if error.code == 404:
+        return True
+    # e.g. "CachedContent not found (or permission denied)", "invalid cached_content"
+    message = re.sub(r"[\s_]", "", (error.message or "").lower())
+    return error.code in (400, 403) and "cachedcontent" in message
+
+
+class PromptCacheProvider(abc.ABC):
+    """Backend that stores prompt prefixes."""
+
+    @abc.abstractmethod
+    async def create(
+        self,
+        model: str,
+        system_instruction: str,
+        contents: list[types.Content],
+        ttl: int,
+    ) -> CacheHandle:
+        """Register a prefix and return its handle."""
+
+    @abc.abstractmethod
+    async def refresh(self, handle: CacheHandle, ttl: int) -> CacheHandle:
+        """Extend a handle's expiry."""
+
+
+class GeminiCacheProvider(PromptCacheProvider):
+    """
+    Gemini context caching (client.caches).
+
+    Requests go through the LLM gateway, so they share the model's
+    concurrency limit, retries and stats with generate calls.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, model, system_instruction, contents, ttl):
+        config = types.CreateCachedContentConfig(
+            system_instruction=system_instruction,
+            contents=contents or None,
+            ttl=f"{ttl}s",
+            display_name="fashion-ai-prompt",
+        )
+        cached = await llm.call(model, lambda: self.client.aio.caches.create(model=model, config=config))
+        return CacheHandle(name=cached.name, expires_at=time.monotonic() + ttl, model=model)
+
+    async def refresh(self, handle, ttl):
+        config = types.UpdateCachedContentConfig(ttl=f"{ttl}s")
+        await llm.call(handle.model, lambda: self.client.aio.caches.update(name=handle.name, config=config))
+        return CacheHandle(name=handle.name, expires_at=time.monotonic() + ttl, model=handle.model)
+
+
+class LocalCacheProvider(PromptCacheProvider):
+    """
+    In-process stand-in that mimics handle creation, expiry and refresh.
+
+    Handles are not server-side, so requests keep sending the full prompt;
+    use it to exercise the caching layer without a provider.
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.created: list[str] = []
+        self.refreshed: list[str] = []
+
+    async def create(self, model, system_instruction, contents, ttl):
+        name = f"local/cachedContents/{next(self._ids)}"
+        self.created.append(name)
+        return CacheHandle(name=name, expires_at=time.monotonic() + ttl, server_side=False, model=model)
+
+    async def refresh(self, handle, ttl):
+        self.refreshed.append(handle.name)
+        return CacheHandle(name=handle.name, expires_at=time.monotonic() + ttl, server_side=False, model=handle.model)
+
+
+@dataclass
+class PromptCacheStats:
+    hits: int = 0
+    creates: int = 0
+    refreshes: int = 0
+    failures: int = 0
+    bypassed: int = 0
+
+
+@dataclass
+class _Prefix:
+    handle: Optional[CacheHandle] = None
+    retry_after: float = 0.0  # time.monotonic() before which creation is not retried
+    refreshing: bool = False
+
+
+class PromptCache:
+    """
+    Handles for static prompt prefixes, created on first use.
+
+    A handle within refresh_margin of expiry is still returned while its
+    TTL is extended in the background; an expired one is recreated before
+    use. When the provider fails (e.g. the prefix is below its minimum
+    cacheable size), callers get None and send the prompt inline, and
+    creation is retried after retry_after seconds.
+    """
+
+    def __init__(
+        self,
+        provider: Optional[PromptCacheProvider],
+        ttl: int | None = None,
+        refresh_margin: int | None = None,
+        retry_after: int | None = None,
+    ):
+        self.provider = provider
+        self.ttl = ttl or settings.chat_prompt_cache_ttl
+        self.refresh_margin = refresh_margin if refresh_margin is not None else settings.chat_prompt_cache_refresh_margin
+        self.retry_after = retry_after if retry_after is not None else settings.chat_prompt_cache_retry_after
+        self.stats = PromptCacheStats()
+        self._prefixes: dict[str, _Prefix] = {}
+        self._flight = SingleFlight()
+        self._background: set[asyncio.Task] = set()
+
+    @staticmethod
+    def prefix_key(model: str, system_instruction: str, contents: list[types.Content] | None = None) -> str:
+        digest = hashlib.sha256(model.encode())
+        digest.update(system_instruction.encode())
+        for content in contents or []:
+            digest.update(content.model_dump_json().encode())
+        return digest.hexdigest()[:32]
+
+    async def get(
+        self,
+        model: str,
+        system_instruction: str,
+        contents: list[types.Content] | None = None,
+    ) -> Optional[CacheHandle]:
+        """Handle for the prefix, or None to send the prompt inline."""
+        if self.provider is None:
+            self.stats.bypassed += 1
+            return None
+
+        key = self.prefix_key(model, system_instruction, contents)
+        prefix = self._prefixes.setdefault(key, _Prefix())
+        now = time.monotonic()
+
+        handle = prefix.handle
+        if handle is not None and handle.expires_at > now:
+            self.stats.hits += 1
+            if handle.expires_at - now < self.refresh_margin and not prefix.refreshing:
+                prefix.refreshing = True
+                task = asyncio.create_task(self._refresh(prefix))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+            return handle
+
+        if now < prefix.retry_after:
+            self.stats.bypassed += 1
+            return None
+
+        return await self._flight.do(key, lambda: self._create(prefix, model, system_instruction, contents or []))
+
+    def invalidate(self, handle: CacheHandle):
+        """Forget a handle the provider rejected; the next call recreates it."""
+        for prefix in self._prefixes.values():
+            if prefix.handle is not None and prefix.handle.name == handle.name:
+                prefix.handle = None
+
+    async def _create(self, prefix: _Prefix, model, system_instruction, contents) -> Optional[CacheHandle]:
+        try:
+            prefix.handle = await self.provider.create(model, system_instruction, contents, self.ttl)
+        except Exception as e:
+            self.stats.failures += 1
+            prefix.handle = None
+            prefix.retry_after = time.monotonic() + self.retry_after
+            logger.warning("Prompt cache unavailable, sending prompt inline", model=model, error=str(e))
+            return None
+
+        self.stats.creates += 1
+        logger.info("Prompt cache created", model=model, name=prefix.handle.name, ttl=self.ttl)
+        return prefix.handle
+
+    async def _refresh(self, prefix: _Prefix):
+        handle = prefix.handle
+        try:
+            refreshed = await self.provider.refresh(handle, self.ttl)
+            if prefix.handle is handle:  # not invalidated meanwhile
+                prefix.handle = refreshed
+            self.stats.refreshes += 1
+        except Exception as e:
+            # The handle stays usable until it expires, then it is recreated
+            self.stats.failures += 1
+            logger.warning("Prompt cache refresh failed", name=handle.name, error=str(e))
+        finally:
+            prefix.refreshing = False
+
+
+def create_prompt_cache(client) -> PromptCache:
+    """Prompt cache for settings.chat_prompt_cache (gemini, local or none)."""
+    if settings.chat_prompt_cache == "gemini" and client:
+        return PromptCache(GeminiCacheProvider(client))
+    if settings.chat_prompt_cache == "local":
+        return PromptCache(LocalCacheProvider())
+    return PromptCache(None)
@@ -1,19 +1,36 @@
+import json
+from datetime import datetime
+
 import structlog
 import aio_pika
 import asyncio
 from aio_pika import connect_robust
 
 from app.config import get_settings
+from app.services.cache import get_redis
+from app.services.jobs import load_job, save_job
+from app.services.product_images import invalidate_product_image
+from app.workers.size_rec import chart_provider
+from app.workers.tryon import run_tryon_job
 
 settings = get_settings()
 logger = structlog.get_logger()
 
 connection = None
 channel = None
+tryon_channel = None
+tryon_semaphore = None
 
 MAX_RETRIES = 5
 RETRY_DELAY = 5  # seconds
 
+TRYON_QUEUE = "ai.tryon.requests"
+RESULTS_QUEUE = "ai.results"
+
+# Fanout exchange the backend publishes product updates to; every AI
+# service instance binds its own queue so all in-process caches see them
+PRODUCT_EVENTS_EXCHANGE = "product.events"
+
 
 async def start_consumers():
     """Start RabbitMQ consumers for AI tasks."""
@@ -26,16 +43,16 @@ async def start_consumers():
             channel = await connection.channel()
 
             # Declare queues
-            await channel.declare_queue("ai.tryon.requests", durable=True)
+            await channel.declare_queue(TRYON_QUEUE, durable=True)
             await channel.declare_queue("ai.size.requests", durable=True)
             await channel.declare_queue("ai.chat.requests", durable=True)
-            await channel.declare_queue("ai.results", durable=True)
+            await channel.declare_queue(RESULTS_QUEUE, durable=True)
 
-            logger.info("RabbitMQ consumers started successfully")
+            if settings.tryon_consumers_enabled:
+                await start_tryon_consumer()
+            await start_product_events_consumer()
 
-            # TODO: Start consuming messages
-            # tryon_queue = await channel.get_queue("ai.tryon.requests")
-            # await tryon_queue.consume(process_tryon)
+            logger.info("RabbitMQ consumers started successfully")
             return  # Connection succeeded, exit the retry loop
 
         except Exception as e:
@@ -48,6 +65,177 @@ async def start_consumers():
                 raise
 
 
+async def start_tryon_consumer():
+    """
+    Consume try-on jobs on a dedicated channel.
+
+    The broker delivers up to tryon_worker_prefetch unacked messages;
+    at most tryon_worker_concurrency of them are processed at once.
+    """
+    global tryon_channel, tryon_semaphore
+
+    tryon_semaphore = asyncio.Semaphore(settings.tryon_worker_concurrency)
+    tryon_channel = await connection.channel()
+    await tryon_channel.set_qos(prefetch_count=settings.tryon_worker_prefetch)
+
+    queue = await tryon_channel.declare_queue(TRYON_QUEUE, durable=True)
+    await queue.consume(handle_tryon_message)
+
+    logger.info(
+        "Try-on consumer started",
+        prefetch=settings.tryon_worker_prefetch,
+        concurrency=settings.tryon_worker_concurrency,
+    )
+
+
+def _parse_tryon_message(message: aio_pika.abc.AbstractIncomingMessage) -> tuple[dict, dict]:
+    """
+    Job record and product info of a try-on message.
+
+    Raises:
+        ValueError: Headers are missing or not JSON, or there is no image
+    """
+    headers = message.headers or {}
+    try:
+        job_data = json.loads(headers["job"])
+        product_info = json.loads(headers["product_info"])
+        job_data["job_id"]
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid try-on headers: {e}") from e
+    if not message.body:
+        raise ValueError("Try-on message has no image")
+    return job_data, product_info
+
+
+def _message_job_id(message: aio_pika.abc.AbstractIncomingMessage) -> str | None:
+    """Job id of a message whose other parts may be malformed."""
+    try:
+        return json.loads((message.headers or {})["job"])["job_id"]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+async def _fail_job(job_id: str, error: str):
+    """Mark a queued job failed so pollers stop waiting for it."""
+    try:
+        r = await get_redis()
+        job_data = await load_job(r, job_id) or {"job_id": job_id}
+        job_data["status"] = "failed"
+        job_data["error"] = error
+        await save_job(r, job_data)
+    except Exception as e:
+        logger.warning("Failed to update try-on job", job_id=job_id, error=str(e))
+    await publish_result(job_id, {"status": "failed", "error": error})
+
+
+async def handle_tryon_message(message: aio_pika.abc.AbstractIncomingMessage):
+    """Process one try-on job from the queue and publish its result."""
+    async with message.process(requeue=False):
+        try:
+            job_data, product_info = _parse_tryon_message(message)
+        except ValueError as e:
+            # Still rejected below, but the job no longer looks queued forever
+            job_id = _message_job_id(message)
+            logger.error("Invalid try-on message", job_id=job_id, error=str(e))
+            if job_id:
+                await _fail_job(job_id, str(e))
+            raise
+        job_id = job_data["job_id"]
+
+        async with tryon_semaphore:
+            logger.info("Try-on job received", job_id=job_id)
+            try:
+                job_data = await run_tryon_job(
+                    job_data=job_data,
+                    user_image_data=message.body,
+                    product_info=product_info,
+                )
+            except Exception as e:
+                logger.error("Try-on job failed", job_id=job_id, error=str(e))
+                await publish_result(job_id, {"status": "failed", "error": str(e)})
+                return
+
+        await publish_result(job_id, job_data["result"])
+
+
+async def start_product_events_consumer():
+    """Consume product-update events on an exclusive per-instance queue."""
+    exchange = await channel.declare_exchange(
+        PRODUCT_EVENTS_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True
+    )
+    queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+    await queue.bind(exchange)
+    await queue.consume(handle_product_event)
+
+    logger.info("Product events consumer started", queue=queue.name)
+
+
+async def handle_product_event(message: aio_pika.abc.AbstractIncomingMessage):
+    """
+    Evict cached data of an updated product.
+
+    Body: {"productId": "...", "updatedAt": "2026-01-30T10:00:00.000Z"}
+    """
+    async with message.process(requeue=False):
+        try:
+            event = json.loads(message.body)
+            product_id = event.get("productId") or event["product_id"]
+            updated_at = event.get("updatedAt") or event.get("updated_at")
+            version = datetime.fromisoformat(updated_at) if updated_at else None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Invalid product event", error=str(e))
+            return
+
+        evicted = chart_provider.invalidate(product_id, version)
+        invalidate_product_image(product_id)
+        logger.info("Product event handled", product_id=product_id, size_chart_evicted=evicted)
+
+
+async def publish_product_updated(product_id: str) -> bool:
+    """
+    Broadcast a product update to every AI service instance.
+
+    Returns:
+        False if RabbitMQ is not connected
+    """
+    if not channel:
+        return False
+
+    exchange = await channel.get_exchange(PRODUCT_EVENTS_EXCHANGE)
+    await exchange.publish(
+        aio_pika.Message(
+            body=json.dumps({"productId": product_id}).encode(),
+            content_type="application/json",
+        ),
+        routing_key="",
+    )
+    return True
+
+
+async def enqueue_tryon(job_data: dict, user_image_data: bytes, product_info: dict) -> bool:
+    """
+    Publish a try-on job to the requests queue.
+
+    Returns:
+        False if RabbitMQ is not connected
+    """
+    if not channel:
+        return False
+
+    await channel.default_exchange.publish(
+        aio_pika.Message(
+            body=user_image_data,
+            headers={
+                "job": json.dumps(job_data),
+                "product_info": json.dumps(product_info, ensure_ascii=False),
+            },
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        ),
+        routing_key=TRYON_QUEUE,
+    )
+    return True
+
+
 async def stop_consumers():
     """Stop RabbitMQ consumers."""
     global connection
@@ -64,7 +252,8 @@ async def publish_result(job_id: str, result: dict):
     if channel:
         await channel.default_exchange.publish(
             aio_pika.Message(
-                body=str({"job_id": job_id, **result}).encode(),
+                body=json.dumps({"job_id": job_id, **result}, ensure_ascii=False).encode(),
+                content_type="application/json",
             ),
-            routing_key="ai.results",
+            routing_key=RESULTS_QUEUE,
         )
@@ -0,0 +1,153 @@
+"""
+Request Coalescing
+Concurrent calls with the same key share one execution
+"""
+
+import asyncio
+import time
+import uuid
+from typing import Awaitable, Callable, TypeVar
+
+import structlog
+
+from app.services.cache import get_redis, release_lock
+
+logger = structlog.get_logger()
+
+T = TypeVar("T")
+
+# Store the leader's result under its token and release the lock if the
+# leader still holds it, in one step
+#
+# KEYS: result, lock
+# ARGV: encoded result, result TTL, leader token
+PUBLISH_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+if redis.call('GET', KEYS[2]) == ARGV[3] then
+    redis.call('DEL', KEYS[2])
+end
+return 1
+"""
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; concurrent callers of the
+    same key await the in-flight call and get its result (or exception).
+
+    The shared call is shielded, so a cancelled caller does not cancel it
+    for the others.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception retrieved when every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+
+class RedisSingleFlight:
+    """
+    Cross-process variant of SingleFlight.
+
+    The first caller of a key takes a Redis lock holding a random token,
+    runs the call and publishes the encoded result under that token for
+    result_ttl seconds; callers in other processes wait for the result of
+    whichever leader currently holds the lock instead of repeating the
+    call. The lock is only ever deleted by its own leader. If the leader
+    fails (or Redis is unavailable) callers run the call themselves, so
+    coalescing never turns into an error.
+
+    Wrap it in a SingleFlight so each process sends one waiter per key.
+    """
+
+    def __init__(self, prefix: str, lock_ttl: int, result_ttl: int, poll_interval: float = 0.1):
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+
+    async def do(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[T]],
+        encode: Callable[[T], bytes],
+        decode: Callable[[bytes], T],
+    ) -> T:
+        lock_key = f"{self.prefix}:lock:{key}"
+        token = uuid.uuid4().hex
+
+        try:
+            r = await get_redis()
+            leader = await r.set(lock_key, token, nx=True, ex=self.lock_ttl)
+        except Exception as e:
+            logger.warning("Coalescing lock unavailable", key=key, error=str(e))
+            return await func()
+
+        if leader:
+            try:
+                result = await func()
+            except BaseException:
+                await self._release(r, lock_key, token)
+                raise
+            try:
+                await r.eval(
+                    PUBLISH_SCRIPT, 2, self._result_key(key, token), lock_key, encode(result), self.result_ttl, token
+                )
+            except Exception as e:
+                logger.warning("Failed to publish coalesced result", key=key, error=str(e))
+                await self._release(r, lock_key, token)
+            return result
+
+        # Follow the lock: if it expires and another caller takes over,
+        # wait for that leader's result instead
+        leader_token = None
+        deadline = time.monotonic() + self.lock_ttl
+        while time.monotonic() < deadline:
+            try:
+                async with r.pipeline(transaction=False) as pipe:
+                    pipe.get(lock_key)
+                    if leader_token:
+                        pipe.get(self._result_key(key, leader_token))
+                    holder, *raw = await pipe.execute()
+            except Exception as e:
+                logger.warning("Failed to read coalesced result", key=key, error=str(e))
+                break
+            if raw and raw[0] is not None:
+                return decode(raw[0])
+            if holder is None:
+                # The leader failed, or finished before we learned its token
+                break
+            holder = holder.decode() if isinstance(holder, bytes) else holder
+            if holder != leader_token:
+                leader_token = holder
+                continue
+            await asyncio.sleep(self.poll_interval)
+
+        return await func()
+
+    def _result_key(self, key: str, token: str) -> str:
+        return f"{self.prefix}:result:{key}:{token}"
+
+    @staticmethod
+    async def _release(r, lock_key: str, token: str):
+        """Drop the lock if it is still ours."""
+        try:
+            await release_lock(r, lock_key, token)
+        except Exception:
+            pass  # The lock expires on its own
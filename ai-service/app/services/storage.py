@@ -1,3 +1,5 @@
+import asyncio
+import io
 import structlog
 from minio import Minio
 from app.config import get_settings
@@ -47,3 +49,40 @@ async def download_file(object_name: str, file_path: str):
     )
 
     logger.info("File downloaded", object_name=object_name, file_path=file_path)
+
+
+def _ensure_bucket(client: Minio):
+    if not client.bucket_exists(settings.minio_bucket):
+        client.make_bucket(settings.minio_bucket)
+
+
+async def put_object_bytes(object_name: str, data: bytes, content_type: str):
+    """Upload in-memory bytes to MinIO/S3."""
+
+    def put():
+        client = get_minio_client()
+        _ensure_bucket(client)
+        client.put_object(
+            settings.minio_bucket,
+            object_name,
+            io.BytesIO(data),
+            length=len(data),
+            content_type=content_type,
+        )
+
+    await asyncio.to_thread(put)
+    logger.info("Object uploaded", object_name=object_name, size=len(data))
+
+
+async def get_object_bytes(object_name: str) -> bytes:
+    """Download an object from MinIO/S3 into memory."""
+
+    def get() -> bytes:
+        response = get_minio_client().get_object(settings.minio_bucket, object_name)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    return await asyncio.to_thread(get)
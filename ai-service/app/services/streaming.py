@@ -0,0 +1,79 @@
+"""
+Stream Helpers
+Shared utilities for SSE responses
+"""
+
+import asyncio
+from typing import AsyncGenerator, AsyncIterator
+
+
+async def coalesce_chunks(
+    events: AsyncGenerator[dict, None],
+    max_chars: int,
+    max_delay: float,
+) -> AsyncIterator[dict]:
+    """
+    Merge consecutive {"chunk": text, "done": False} events.
+
+    Buffered text is flushed once it reaches max_chars, max_delay seconds
+    after its first piece arrived, or just before any other event, so
+    ordering is preserved and added latency is bounded by max_delay.
+
+    Each upstream item is awaited in its own task: if the consumer is
+    cancelled (e.g. the client disconnected) that task is cancelled too,
+    which stops the upstream generator instead of leaving it running.
+
+    Args:
+        events: Upstream event stream
+        max_chars: Flush when this much text is buffered
+        max_delay: Max seconds text may wait in the buffer
+    """
+    loop = asyncio.get_running_loop()
+    iterator = events.__aiter__()
+    buffer: list[str] = []
+    buffered = 0
+    deadline = None
+    pending = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield {"chunk": "".join(buffer), "done": False}
+                buffer, buffered, deadline = [], 0, None
+                continue
+
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+
+            text = event.get("chunk")
+            if text and event.keys() <= {"chunk", "done"} and not event.get("done"):
+                buffer.append(text)
+                buffered += len(text)
+                if deadline is None:
+                    deadline = loop.time() + max_delay
+                if buffered >= max_chars:
+                    yield {"chunk": "".join(buffer), "done": False}
+                    buffer, buffered, deadline = [], 0, None
+                continue
+
+            if buffer:
+                yield {"chunk": "".join(buffer), "done": False}
+                buffer, buffered, deadline = [], 0, None
+            yield event
+
+        if buffer:
+            yield {"chunk": "".join(buffer), "done": False}
+    finally:
+        if pending is not None and not pending.done():
+            # The upstream generator ends with the cancelled task
+            pending.cancel()
+        else:
+            await iterator.aclose()
@@ -0,0 +1,172 @@
+"""
+Upload Ingestion
+Rejects oversized request bodies before form parsing and exposes uploads
+without copying them again
+"""
+
+import asyncio
+import mmap
+import os
+from typing import Optional
+
+import structlog
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import get_settings
+from app.workers.preprocess import sniff_image_mime
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+# Boundaries, part headers and the text fields sent next to the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# Enough leading bytes to recognize every supported format
+SNIFF_BYTES = 16
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeded the size limit."""
+
+
+class UnsupportedUpload(Exception):
+    """The upload is not an image format we accept."""
+
+
+def too_large_detail(max_bytes: int | None = None) -> str:
+    max_mb = (max_bytes or settings.upload_max_bytes) // (1024 * 1024)
+    return f"File too large. Max {max_mb}MB"
+
+
+class UploadLimitMiddleware:
+    """
+    Cap the size of multipart request bodies.
+
+    Starlette reads and spools the whole body while parsing the form,
+    before any endpoint code runs, so the limit has to be enforced here.
+    Requests whose Content-Length is over the limit are answered without
+    reading the body; bodies without one (chunked) are counted as they
+    arrive and the request fails as soon as the limit is crossed.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int | None = None):
+        self.app = app
+        self.max_bytes = max_bytes or settings.upload_max_bytes + MULTIPART_OVERHEAD_BYTES
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if not headers.get("content-type", "").startswith("multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse({"detail": too_large_detail()}, status_code=400)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=400, detail=too_large_detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class IngestedUpload:
+    """
+    Upload contents exposed as a read-only memoryview.
+
+    Starlette has already spooled the file (in memory up to 1 MB, then to
+    a temporary file). Small uploads are read from that spool; larger ones
+    memory-map Starlette's temporary file, so the bytes are neither copied
+    to another file nor into the Python heap. The view outlives the form,
+    which FastAPI closes when the endpoint returns. Call close() once
+    downstream stages are done.
+    """
+
+    def __init__(self, data: bytes | mmap.mmap, size: int, mime_type: Optional[str]):
+        self.size = size
+        self.mime_type = mime_type
+        self._data: Optional[bytes] = data if isinstance(data, bytes) else None
+        self._mmap: Optional[mmap.mmap] = data if isinstance(data, mmap.mmap) else None
+        self._view: Optional[memoryview] = memoryview(data).toreadonly()
+
+    @property
+    def view(self) -> memoryview:
+        return self._view
+
+    def close(self):
+        try:
+            if self._view is not None:
+                self._view.release()
+                self._view = None
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+        except BufferError:
+            # A stage still holds a slice; the buffers are freed with it
+            logger.warning("Upload buffer still in use, deferring release")
+            return
+        self._data = None
+
+
+def _upload_size(upload: UploadFile) -> int:
+    if upload.size is not None:
+        return upload.size
+    upload.file.seek(0, os.SEEK_END)
+    return upload.file.tell()
+
+
+def _map_upload(upload: UploadFile, size: int, spool_threshold: int) -> bytes | mmap.mmap:
+    if size > spool_threshold:
+        # fileno() keeps an already rolled-over spool file as it is
+        return mmap.mmap(upload.file.fileno(), 0, access=mmap.ACCESS_READ)
+    upload.file.seek(0)
+    return upload.file.read()
+
+
+async def ingest_image_upload(
+    upload: UploadFile,
+    max_bytes: int | None = None,
+    spool_threshold: int | None = None,
+) -> IngestedUpload:
+    """
+    Check an image upload and expose its spooled bytes.
+
+    The request body was already capped by UploadLimitMiddleware; this
+    checks the file itself against max_bytes and its magic bytes against
+    the supported formats.
+
+    Raises:
+        UploadTooLarge: Upload is bigger than max_bytes
+        UnsupportedUpload: Magic bytes are not JPEG, PNG or WebP
+    """
+    max_bytes = max_bytes or settings.upload_max_bytes
+    spool_threshold = spool_threshold or settings.upload_spool_threshold
+
+    size = await asyncio.to_thread(_upload_size, upload)
+    if size > max_bytes:
+        raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+    if size == 0:
+        raise UnsupportedUpload("Empty upload")
+
+    await upload.seek(0)
+    mime_type = sniff_image_mime(await upload.read(SNIFF_BYTES))
+    if mime_type is None:
+        raise UnsupportedUpload("Unrecognized image format")
+
+    data = await asyncio.to_thread(_map_upload, upload, size, spool_threshold)
+    return IngestedUpload(data, size, mime_type)
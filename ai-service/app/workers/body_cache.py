@@ -0,0 +1,99 @@
+"""
+Body Analysis Deduplication
+Reuses body analyses for near-identical photos within a user session
+"""
+
+import asyncio
+import io
+import json
+
+import numpy as np
+import structlog
+from PIL import Image
+
+from app.config import get_settings
+from app.services.cache import get_redis
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+HASH_SIZE = 8  # 8x8 gradient bits = 64-bit hash
+
+
+def compute_dhash(image_data: bytes) -> int:
+    """
+    Compute the 64-bit difference hash of an image.
+
+    Each bit tells whether a pixel is brighter than its right neighbour
+    on a (HASH_SIZE + 1) x HASH_SIZE grayscale thumbnail, which survives
+    re-encoding, resizing and small crops.
+    """
+    img = Image.open(io.BytesIO(image_data))
+    if img.format == "JPEG":
+        img.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+    img = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR)
+
+    pixels = np.asarray(img, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _scope_key(scope: str) -> str:
+    return f"ai:body:{scope}"
+
+
+async def find_body_analysis(scope: str, image_hash: int) -> dict | None:
+    """
+    Find a stored body analysis whose photo hash is close to image_hash.
+
+    Args:
+        scope: User or session identifier the analyses belong to
+        image_hash: dHash of the new photo
+
+    Returns:
+        The closest analysis within body_phash_max_distance, else None
+    """
+    try:
+        r = await get_redis()
+        entries = await r.hgetall(_scope_key(scope))
+    except Exception as e:
+        logger.warning("Body cache lookup failed", scope=scope, error=str(e))
+        return None
+
+    best, best_distance = None, settings.body_phash_max_distance + 1
+    for stored_hash, analysis in entries.items():
+        distance = hamming_distance(image_hash, int(stored_hash, 16))
+        if distance < best_distance:
+            best, best_distance = analysis, distance
+
+    if best is None:
+        return None
+
+    logger.info("Body analysis reused", scope=scope, distance=best_distance)
+    return json.loads(best)
+
+
+async def store_body_analysis(scope: str, image_hash: int, analysis: dict):
+    """Remember a body analysis for later photos of the same session."""
+    key = _scope_key(scope)
+    try:
+        r = await get_redis()
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.hset(key, f"{image_hash:016x}", json.dumps(analysis, ensure_ascii=False))
+            pipe.expire(key, settings.body_cache_ttl)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning("Body cache write failed", scope=scope, error=str(e))
+
+
+async def hash_image(image_data: bytes) -> int | None:
+    """Compute the dHash off the event loop, None if the image is unreadable."""
+    try:
+        return await asyncio.to_thread(compute_dhash, image_data)
+    except Exception as e:
+        logger.warning("Perceptual hash failed", error=str(e))
+        return None
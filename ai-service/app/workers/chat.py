@@ -3,19 +3,18 @@ Fashion AI Chat Service
 Uses Gemini 2.5-flash for conversational AI
 """
 
+import hashlib
+
 import structlog
-from google import genai
 from google.genai import types
 from app.config import get_settings
+from app.services import llm
+from app.services.prompt_cache import CacheHandle, create_prompt_cache, is_cache_rejection
+from app.workers.chat_cache import ChatResponseCache, replay_chunks
 
 settings = get_settings()
 logger = structlog.get_logger()
 
-# Initialize Gemini client
-client = None
-if settings.gemini_api_key:
-    client = genai.Client(api_key=settings.gemini_api_key)
-
 # System prompt for Fashion AI assistant
 SYSTEM_PROMPT = """Bạn là Fashion AI - trợ lý mua sắm thời trang thông minh. 
 
@@ -38,12 +37,19 @@ SYSTEM_PROMPT = """Bạn là Fashion AI - trợ lý mua sắm thời trang thôn
 - Luôn kết thúc bằng câu hỏi mở để tiếp tục cuộc trò chuyện
 """
 
+# Answers to first-turn FAQ questions; a prompt change starts a fresh cache
+response_cache = ChatResponseCache(prompt_version=hashlib.sha256(SYSTEM_PROMPT.encode()).hexdigest()[:8])
+
+# SYSTEM_PROMPT registered once as provider-side cached content
+prompt_cache = create_prompt_cache(llm.client)
+
 
 async def process_chat(
     session_id: str,
     message: str,
     history: list[dict] | None = None,
     context: dict | None = None,
+    summary: str = "",
 ) -> dict:
     """
     Process a chat message using Gemini 2.5-flash.
@@ -53,65 +59,58 @@ async def process_chat(
         message: User's message
         history: Previous messages [{"role": "user/model", "content": "..."}]
         context: Additional context (user profile, cart items, etc.)
+        summary: Summary of turns older than history
 
     Returns:
         dict with response and metadata
     """
     logger.info("Processing chat", session_id=session_id, message_length=len(message))
 
-    if not client:
+    if not llm.client:
         logger.error("Gemini client not initialized")
         return {
             "response": "Xin lỗi, dịch vụ AI đang bảo trì. Vui lòng thử lại sau.",
             "error": "GEMINI_NOT_CONFIGURED",
         }
 
+    cacheable = not summary and response_cache.cacheable(message, history, context)
+    if cacheable:
+        cached = await response_cache.get(message)
+        if cached:
+            logger.info("Chat cache hit", session_id=session_id)
+            return {
+                "response": cached,
+                "session_id": session_id,
+                "tokens_used": 0,
+                "cached": True,
+            }
+
     try:
-        # Build conversation history for Gemini
-        contents = []
-        
-        # Add system prompt as first user message (Gemini workaround)
-        system_content = SYSTEM_PROMPT
-        if context:
-            system_content += f"\n\n## Thông tin người dùng:\n{_format_context(context)}"
-        
-        # Add history
-        if history:
-            for msg in history[-settings.chat_max_history:]:
-                role = "user" if msg.get("role") == "user" else "model"
-                contents.append(
-                    types.Content(
-                        role=role,
-                        parts=[types.Part(text=msg.get("content", ""))]
-                    )
-                )
-        
-        # Add current message
-        contents.append(
-            types.Content(
-                role="user",
-                parts=[types.Part(text=message)]
-            )
-        )
+        handle = await prompt_cache.get(settings.gemini_model, SYSTEM_PROMPT)
+        params = {"temperature": 0.7, "max_output_tokens": 1024, "top_p": 0.9}
+        contents, config = _build_request(message, history, context, summary, handle, **params)
 
         # Call Gemini
-        response = await client.aio.models.generate_content(
-            model=settings.gemini_model,
-            contents=contents,
-            config=types.GenerateContentConfig(
-                system_instruction=system_content,
-                temperature=0.7,
-                max_output_tokens=1024,
-                top_p=0.9,
-            ),
-        )
+        try:
+            response = await llm.generate(settings.gemini_model, contents, config)
+        except Exception as e:
+            if not _cache_rejected(handle, e):
+                raise
+            # The cached prompt may have been evicted; send it inline this time
+            logger.warning("Cached prompt rejected, retrying inline", session_id=session_id, error=str(e))
+            prompt_cache.invalidate(handle)
+            contents, config = _build_request(message, history, context, summary, None, **params)
+            response = await llm.generate(settings.gemini_model, contents, config)
 
         response_text = response.text if response.text else ""
+        if cacheable:
+            await response_cache.set(message, response_text)
         
         logger.info(
             "Chat completed",
             session_id=session_id,
             response_length=len(response_text),
+            cached_tokens=_cached_tokens(response),
         )
 
         return {
@@ -133,6 +132,7 @@ async def process_chat_stream(
     message: str,
     history: list[dict] | None = None,
     context: dict | None = None,
+    summary: str = "",
 ):
     """
     Process chat with streaming response.
@@ -142,47 +142,57 @@ async def process_chat_stream(
     """
     logger.info("Processing chat stream", session_id=session_id)
 
-    if not client:
+    if not llm.client:
         yield {"error": "GEMINI_NOT_CONFIGURED"}
         return
 
-    try:
-        # Build contents
-        contents = []
-        system_content = SYSTEM_PROMPT
-        if context:
-            system_content += f"\n\n## Thông tin người dùng:\n{_format_context(context)}"
-
-        if history:
-            for msg in history[-settings.chat_max_history:]:
-                role = "user" if msg.get("role") == "user" else "model"
-                contents.append(
-                    types.Content(
-                        role=role,
-                        parts=[types.Part(text=msg.get("content", ""))]
-                    )
-                )
+    cacheable = not summary and response_cache.cacheable(message, history, context)
+    if cacheable:
+        cached = await response_cache.get(message)
+        if cached:
+            logger.info("Chat cache hit", session_id=session_id, stream=True)
+            for text in replay_chunks(cached):
+                yield {"chunk": text, "done": False}
+            yield {"chunk": "", "done": True, "session_id": session_id, "cached": True}
+            return
 
-        contents.append(
-            types.Content(
-                role="user",
-                parts=[types.Part(text=message)]
-            )
-        )
+    try:
+        handle = await prompt_cache.get(settings.gemini_model, SYSTEM_PROMPT)
+        params = {"temperature": 0.7, "max_output_tokens": 1024}
 
         # Stream response
-        async for chunk in client.aio.models.generate_content_stream(
-            model=settings.gemini_model,
-            contents=contents,
-            config=types.GenerateContentConfig(
-                system_instruction=system_content,
-                temperature=0.7,
-                max_output_tokens=1024,
-            ),
-        ):
-            if chunk.text:
-                yield {"chunk": chunk.text, "done": False}
+        full_response = ""
+        last_chunk = None
+        while True:
+            contents, config = _build_request(message, history, context, summary, handle, **params)
+            try:
+                stream = llm.generate_stream(settings.gemini_model, contents, config)
+                try:
+                    async for chunk in stream:
+                        last_chunk = chunk
+                        if chunk.text:
+                            full_response += chunk.text
+                            yield {"chunk": chunk.text, "done": False}
+                finally:
+                    # Also on cancellation: stop Gemini generating for a gone client
+                    await stream.aclose()
+                break
+            except Exception as e:
+                # Retry inline only if the cached prompt failed before any output
+                if full_response or not _cache_rejected(handle, e):
+                    raise
+                logger.warning("Cached prompt rejected, retrying inline", session_id=session_id, error=str(e))
+                prompt_cache.invalidate(handle)
+                handle = None
 
+        logger.info(
+            "Chat stream completed",
+            session_id=session_id,
+            response_length=len(full_response),
+            cached_tokens=_cached_tokens(last_chunk),
+        )
+        if cacheable:
+            await response_cache.set(message, full_response)
         yield {"chunk": "", "done": True, "session_id": session_id}
 
     except Exception as e:
@@ -190,6 +200,75 @@ async def process_chat_stream(
         yield {"error": str(e)}
 
 
+def _server_cached(handle: CacheHandle | None) -> bool:
+    return handle is not None and handle.server_side
+
+
+def _cache_rejected(handle: CacheHandle | None, error: Exception) -> bool:
+    """Whether error came from the cached prompt, so an inline retry can help."""
+    return _server_cached(handle) and is_cache_rejection(error)
+
+
+def _build_request(
+    message: str,
+    history: list[dict] | None,
+    context: dict | None,
+    summary: str,
+    handle: CacheHandle | None,
+    **params,
+) -> tuple[list[types.Content], types.GenerateContentConfig]:
+    """
+    Build Gemini contents and config for a chat turn.
+
+    With a server-side cached prompt the request references the cache
+    instead of resending SYSTEM_PROMPT, and the per-session context and
+    summary, which cannot be part of the shared prefix, become the first
+    user turn.
+    """
+    contents = []
+
+    session_content = ""
+    if context:
+        session_content += f"\n\n## Thông tin người dùng:\n{_format_context(context)}"
+    if summary:
+        session_content += f"\n\n## Tóm tắt cuộc trò chuyện trước đó:\n{summary}"
+
+    if _server_cached(handle):
+        if session_content:
+            contents.append(
+                types.Content(
+                    role="user",
+                    parts=[types.Part(text=session_content.strip())]
+                )
+            )
+        config = types.GenerateContentConfig(cached_content=handle.name, **params)
+    else:
+        config = types.GenerateContentConfig(system_instruction=SYSTEM_PROMPT + session_content, **params)
+
+    if history:
+        for msg in history:
+            role = "user" if msg.get("role") == "user" else "model"
+            contents.append(
+                types.Content(
+                    role=role,
+                    parts=[types.Part(text=msg.get("content", ""))]
+                )
+            )
+
+    contents.append(
+        types.Content(
+            role="user",
+            parts=[types.Part(text=message)]
+        )
+    )
+    return contents, config
+
+
+def _cached_tokens(response) -> int:
+    usage = getattr(response, "usage_metadata", None)
+    return (usage.cached_content_token_count or 0) if usage else 0
+
+
 def _format_context(context: dict) -> str:
     """Format user context for system prompt."""
     parts = []
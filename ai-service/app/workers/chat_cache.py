@@ -0,0 +1,122 @@
+"""
+Chat Response Cache
+Answers to FAQ-style first-turn questions, keyed on the normalized question
+"""
+
+import hashlib
+import re
+import unicodedata
+from typing import Optional
+
+import structlog
+
+from app.config import get_settings
+from app.services.cache import TwoTierCache, get_redis
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+CACHE_PREFIX = "ai:chat:faq"
+INDEX_KEY = f"{CACHE_PREFIX}:index"
+
+# Cached answers are replayed over SSE in chunks of about this many characters
+REPLAY_CHUNK_CHARS = 48
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+_WORDS = re.compile(r"\S+\s*")
+
+
+def normalize_question(message: str) -> str:
+    """
+    Normalize a question for cache lookups.
+
+    Lowercases, strips Vietnamese diacritics (đ -> d), drops punctuation and
+    collapses whitespace: "Chính sách  ĐỔI TRẢ?" -> "chinh sach doi tra".
+    """
+    text = unicodedata.normalize("NFD", message.lower().replace("đ", "d"))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def replay_chunks(text: str) -> list[str]:
+    """Split a cached answer into word-aligned chunks for streaming."""
+    chunks, current = [], ""
+    for word in _WORDS.findall(text):
+        current += word
+        if len(current) >= REPLAY_CHUNK_CHARS:
+            chunks.append(current)
+            current = ""
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ChatResponseCache:
+    """
+    Redis cache of chat answers.
+
+    Only first-turn messages without history or context are cacheable.
+    Keys include the model and a prompt version, so changing either starts
+    a fresh cache. There is no in-process tier, so admin invalidation takes
+    effect on every instance at once.
+    """
+
+    def __init__(self, prompt_version: str):
+        self.prompt_version = prompt_version
+        self.cache = TwoTierCache(CACHE_PREFIX, ttl=settings.chat_cache_ttl, max_bytes=None)
+
+    def cacheable(self, message: str, history: list[dict] | None, context: dict | None) -> bool:
+        return (
+            settings.chat_cache_enabled
+            and not history
+            and not context
+            and len(message) <= settings.chat_cache_max_chars
+            and bool(normalize_question(message))
+        )
+
+    def key(self, message: str) -> str:
+        digest = hashlib.sha256(normalize_question(message).encode()).hexdigest()[:32]
+        return f"{settings.gemini_model}:{self.prompt_version}:{digest}"
+
+    async def get(self, message: str) -> Optional[str]:
+        cached = await self.cache.get(self.key(message))
+        return cached.get("response") if cached else None
+
+    async def set(self, message: str, response: str):
+        if not response:
+            return
+        key = self.key(message)
+        await self.cache.set(key, {"question": normalize_question(message), "response": response})
+        try:
+            r = await get_redis()
+            async with r.pipeline(transaction=False) as pipe:
+                pipe.sadd(INDEX_KEY, key)
+                pipe.expire(INDEX_KEY, settings.chat_cache_ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Failed to index chat cache entry", error=str(e))
+
+    async def invalidate(self, message: str | None = None) -> int:
+        """
+        Drop the cached answer of one question, or every cached answer.
+
+        Returns:
+            Number of entries removed
+        """
+        r = await get_redis()
+        if message is not None:
+            key = self.key(message)
+            full_key = f"{CACHE_PREFIX}:{key}"
+            async with r.pipeline(transaction=False) as pipe:
+                pipe.delete(full_key)
+                pipe.srem(INDEX_KEY, key)
+                removed, _ = await pipe.execute()
+            return removed
+
+        keys = [k.decode() if isinstance(k, bytes) else k for k in await r.smembers(INDEX_KEY)]
+        removed = await r.delete(*[f"{CACHE_PREFIX}:{k}" for k in keys]) if keys else 0
+        await r.delete(INDEX_KEY)
+        logger.info("Chat cache cleared", removed=removed)
+        return removed
@@ -0,0 +1,174 @@
+"""
+Chat History Builder
+Token-budgeted history window with a rolling summary of older turns
+"""
+
+import asyncio
+import math
+
+import structlog
+from google.genai import types
+
+from app.config import get_settings
+from app.services import llm
+from app.services.chat_store import ChatSessionStore, decode_message
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+# Vietnamese text runs at roughly 3 characters per token; err on the high side
+CHARS_PER_TOKEN = 3
+# Role and turn framing per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Redis round-trips and waiting for the model's concurrency slot
+SUMMARY_LOCK_MARGIN = 10
+
+SUMMARY_PROMPT = """Tóm tắt cuộc trò chuyện giữa khách hàng và trợ lý thời trang dưới đây.
+
+Giữ lại: thông tin cá nhân khách đã chia sẻ (số đo, size, phong cách, ngân sách),
+sản phẩm đã nhắc đến, câu hỏi chưa được giải quyết và các quyết định đã đưa ra.
+Viết bằng tiếng Việt, dạng gạch đầu dòng ngắn gọn, tối đa 10 dòng.
+
+## Tóm tắt trước đó:
+{summary}
+
+## Tin nhắn mới:
+{messages}"""
+
+# Summaries being regenerated, kept referenced until done
+_background_tasks: set[asyncio.Task] = set()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of one stored message."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+
+
+def summary_lock_ttl() -> int:
+    """
+    Seconds one summary regeneration may hold the session lock.
+
+    Covers a summarize call whose every attempt times out, with the
+    longest backoff between attempts.
+    """
+    attempts = settings.llm_max_retries + 1
+    worst_case = settings.llm_timeout * attempts + settings.llm_retry_max_delay * settings.llm_max_retries
+    return math.ceil(worst_case) + SUMMARY_LOCK_MARGIN
+
+
+def _turn_start(messages: list[dict], start: int) -> int:
+    """First user message at or after start, so Gemini sees whole turns."""
+    while start < len(messages) and messages[start].get("role") != "user":
+        start += 1
+    return start
+
+
+def split_history(messages: list[dict], budget: int) -> tuple[list[dict], list[dict]]:
+    """
+    Split history into messages to summarize and the recent window.
+
+    The window is the longest suffix that fits the token budget, starting
+    on a user message.
+
+    Returns:
+        (older, window)
+    """
+    used = 0
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        used += estimate_tokens(messages[index].get("content", ""))
+        if used > budget:
+            break
+        start = index
+
+    start = _turn_start(messages, start)
+    return messages[:start], messages[start:]
+
+
+async def build_history(store: ChatSessionStore, session_id: str) -> tuple[list[dict], str]:
+    """
+    History to send with the next chat turn.
+
+    Loads the messages the summary does not cover yet in one round-trip.
+    Once chat_summary_min_messages of them fall outside
+    settings.chat_history_token_budget, the summary is regenerated in the
+    background. Messages leave the history only when a stored summary
+    covers them, so until then the history may run over the budget, up to
+    the last chat_max_history messages.
+
+    Returns:
+        (recent messages, summary of older ones or "")
+    """
+    messages, summary = await store.load_with_summary(session_id)
+    older, _ = split_history(messages, settings.chat_history_token_budget)
+
+    if len(older) >= settings.chat_summary_min_messages and llm.client:
+        task = asyncio.create_task(refresh_summary(store, session_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    start = _turn_start(messages, max(len(messages) - settings.chat_max_history, 0))
+    return messages[start:], summary
+
+
+async def refresh_summary(store: ChatSessionStore, session_id: str) -> bool:
+    """
+    Fold the messages outside the budget window into the session summary.
+
+    Returns:
+        True if a new summary was stored
+    """
+    try:
+        token = await store.claim_summary(session_id, summary_lock_ttl())
+    except Exception as e:
+        logger.warning("Failed to lock chat summary", session_id=session_id, error=str(e))
+        return False
+    if token is None:
+        return False
+
+    try:
+        # Reload under the lock: another instance may have just folded these
+        raw_messages, summary = await store.load_raw_with_summary(session_id)
+        decoded = [(index, message) for index, raw in enumerate(raw_messages) if (message := decode_message(raw))]
+        older, _ = split_history([message for _, message in decoded], settings.chat_history_token_budget)
+        if len(older) < settings.chat_summary_min_messages:
+            return False
+
+        new_summary = await summarize(summary, older)
+        if not new_summary:
+            return False
+
+        # Raw entries up to the last summarized message, undecodable ones included
+        folded = raw_messages[:decoded[len(older) - 1][0] + 1]
+        if not await store.save_summary(session_id, new_summary, folded, token):
+            logger.info("Chat changed while summarizing, summary dropped", session_id=session_id)
+            return False
+        logger.info("Chat summary updated", session_id=session_id, folded=len(folded))
+        return True
+
+    except Exception as e:
+        logger.warning("Chat summary failed", session_id=session_id, error=str(e))
+        return False
+    finally:
+        try:
+            await store.release_summary(session_id, token)
+        except Exception:
+            pass  # The lock expires on its own
+
+
+async def summarize(summary: str, messages: list[dict]) -> str:
+    """Ask Gemini to merge messages into the previous summary."""
+    transcript = "\n".join(
+        f"{'Khách' if msg.get('role') == 'user' else 'Trợ lý'}: {msg.get('content', '')}"
+        for msg in messages
+    )
+    response = await llm.generate(
+        settings.gemini_model,
+        SUMMARY_PROMPT.format(summary=summary or "Chưa có", messages=transcript),
+        types.GenerateContentConfig(
+            temperature=0.2,
+            max_output_tokens=settings.chat_summary_max_tokens,
+        ),
+    )
+    return (response.text or "").strip()
@@ -0,0 +1,245 @@
+"""
+Local Fit Prediction Engine
+Predicts try-on fit from a categorical body analysis without calling the LLM
+"""
+
+import math
+
+from app.workers.size_rec import SIZE_CHARTS, calculate_size_scores
+
+# Mean height (cm) per estimated_height_range category
+HEIGHT_MEANS = {
+    "short": 155.0,
+    "average": 168.0,
+    "tall": 181.0,
+}
+
+# Girths (cm) per body_type at the reference height
+BODY_TYPE_GIRTHS = {
+    "slim": {"chest": 86.0, "waist": 71.0, "hips": 88.0},
+    "average": {"chest": 94.0, "waist": 80.0, "hips": 95.0},
+    "athletic": {"chest": 100.0, "waist": 80.0, "hips": 96.0},
+    "curvy": {"chest": 95.0, "waist": 77.0, "hips": 103.0},
+    "plus_size": {"chest": 110.0, "waist": 98.0, "hips": 112.0},
+}
+REFERENCE_HEIGHT = 168.0
+
+SHOULDER_MEANS = {
+    "narrow": 42.0,
+    "medium": 45.0,
+    "broad": 48.5,
+}
+
+WAIST_DEFINITION_OFFSETS = {
+    "defined": -2.0,
+    "moderate": 0.0,
+    "straight": 2.0,
+}
+
+# Standard deviation (cm) of each estimate; photo-based categories are coarse
+METRIC_STDDEVS = {
+    "height": 4.0,
+    "chest": 4.0,
+    "waist": 4.0,
+    "hips": 4.0,
+    "shoulder": 1.5,
+}
+
+# Weight of the mean point when integrating scores over the distribution
+SIGMA_CENTER_WEIGHT = 1 / 3
+
+# Areas scored against the chart's range of the same metric, in description order
+AREA_LABELS = {
+    "shoulder": "vai",
+    "chest": "ngực",
+    "waist": "eo",
+    "hips": "hông",
+}
+# Always present in fit_areas (the LLM schema); "vừa" when the chart has no range
+REQUIRED_AREAS = ("shoulder", "chest")
+
+BODY_TYPE_LABELS = {
+    "slim": "mảnh khảnh",
+    "average": "cân đối",
+    "athletic": "thể thao",
+    "curvy": "đầy đặn đường cong",
+    "plus_size": "đầy đặn",
+}
+
+HEIGHT_LABELS = {
+    "short": "nhỏ nhắn",
+    "average": "trung bình",
+    "tall": "cao",
+}
+
+STYLING_TIPS = {
+    "slim": [
+        "Chọn áo có họa tiết ngang hoặc layer để tạo cảm giác đầy đặn hơn",
+        "Phối với quần ống đứng để cân đối tổng thể",
+    ],
+    "average": [
+        "Dáng người cân đối, dễ phối với hầu hết kiểu quần",
+        "Sơ vin nhẹ để outfit gọn gàng hơn",
+    ],
+    "athletic": [
+        "Chọn chất liệu co giãn để thoải mái ở vai và ngực",
+        "Phối với quần slim fit để tôn dáng",
+    ],
+    "curvy": [
+        "Sơ vin hoặc thắt đai để nhấn eo",
+        "Chọn quần cạp cao để tôn đường cong",
+    ],
+    "plus_size": [
+        "Ưu tiên màu trơn, tông tối để tổng thể gọn gàng",
+        "Chọn chất liệu rủ, tránh vải quá dày",
+    ],
+}
+
+
+def _category(value, options, default: str) -> str:
+    """Match a free-form category string such as 'average (160-175cm)'."""
+    if isinstance(value, str) and value:
+        value = value.lower()
+        for option in options:
+            if value.startswith(option):
+                return option
+    return default
+
+
+def body_measurement_distribution(body_analysis: dict) -> dict[str, tuple[float, float]]:
+    """
+    Convert a categorical body analysis into per-metric (mean, stddev) in cm.
+    """
+    height_cat = _category(body_analysis.get("estimated_height_range"), HEIGHT_MEANS, "average")
+    body_type = _category(body_analysis.get("body_type"), BODY_TYPE_GIRTHS, "average")
+    shoulder_cat = _category(body_analysis.get("shoulder_width"), SHOULDER_MEANS, "medium")
+    proportions = body_analysis.get("body_proportions") or {}
+    waist_def = _category(proportions.get("waist_definition"), WAIST_DEFINITION_OFFSETS, "moderate")
+
+    height = HEIGHT_MEANS[height_cat]
+    scale = height / REFERENCE_HEIGHT
+    girths = BODY_TYPE_GIRTHS[body_type]
+
+    means = {
+        "height": height,
+        "chest": girths["chest"] * scale + (2.0 if shoulder_cat == "broad" else 0.0),
+        "waist": girths["waist"] * scale + WAIST_DEFINITION_OFFSETS[waist_def],
+        "hips": girths["hips"] * scale,
+        "shoulder": SHOULDER_MEANS[shoulder_cat] * scale,
+    }
+    return {metric: (mean, METRIC_STDDEVS[metric]) for metric, mean in means.items()}
+
+
+def expected_size_scores(size_chart: dict, distribution: dict[str, tuple[float, float]]) -> dict:
+    """
+    Expected calculate_size_scores over the measurement distribution.
+
+    Uses unscented-transform sigma points: the mean, plus mean ± c·σ along
+    each metric the chart uses, weighted so that every metric's mean and
+    variance are reproduced. Costs 2k + 1 scorer calls for k metrics.
+    """
+    means = {metric: mean for metric, (mean, _) in distribution.items()}
+    metrics = [metric for metric in distribution if any(metric in r for r in size_chart.values())]
+    if not metrics:
+        return calculate_size_scores(size_chart, means)
+
+    center_weight = SIGMA_CENTER_WEIGHT
+    side_weight = (1 - center_weight) / (2 * len(metrics))
+    spread = math.sqrt(len(metrics) / (1 - center_weight))
+
+    totals = {size: center_weight * score for size, score in calculate_size_scores(size_chart, means).items()}
+    for metric in metrics:
+        _, stddev = distribution[metric]
+        for sign in (-1, 1):
+            point = dict(means)
+            point[metric] += sign * spread * stddev
+            for size, score in calculate_size_scores(size_chart, point).items():
+                totals[size] += side_weight * score
+
+    return totals
+
+
+def _range_fit(value: float, min_val: float, max_val: float, small: str, large: str) -> str:
+    if value < min_val:
+        return large
+    if value > max_val:
+        return small
+    return "vừa"
+
+
+def predict_fit_local(body_analysis: dict, product_info: dict, size_chart: dict | None = None) -> dict:
+    """
+    Predict the fit_prediction result locally from a body analysis.
+
+    Args:
+        body_analysis: Categorical body analysis
+        product_info: Product type and available sizes
+        size_chart: {size: {metric: (min, max)}} chart, e.g. a parsed
+            sizeGuide; defaults to the chart of the product type. Any
+            subset of metrics may be present.
+
+    Returns the same schema as tryon.predict_fit.
+    """
+    if not size_chart:
+        product_type = product_info.get("type", "ao_thun")
+        size_chart = SIZE_CHARTS.get(product_type, SIZE_CHARTS["ao_thun"])
+    available = [s for s in product_info.get("sizes", []) if s in size_chart] or list(size_chart)
+
+    distribution = body_measurement_distribution(body_analysis)
+    means = {metric: mean for metric, (mean, _) in distribution.items()}
+    scores = expected_size_scores(size_chart, distribution)
+
+    best_overall = max(scores, key=scores.get)
+    recommended = max(available, key=lambda size: scores[size])
+    confidence = min(scores[recommended] / 100, 0.95)
+
+    ranges = size_chart[recommended]
+    # Only metrics the chart measures are scored, e.g. waist and hips for quan
+    measured = [area for area in AREA_LABELS if area in ranges]
+    fit_areas = {area: "vừa" for area in REQUIRED_AREAS}
+    for area in measured:
+        fit_areas[area] = _range_fit(means[area], *ranges[area], "hơi chật", "hơi rộng")
+    fit_areas["length"] = (
+        _range_fit(means["height"], *ranges["height"], "hơi ngắn", "hơi dài") if "height" in ranges else "vừa"
+    )
+
+    # How loose the garment sits, from the first girth the chart measures
+    girth_metric = next((metric for metric in ("chest", "waist", "hips") if metric in ranges), None)
+    fit_style = "vừa vặn"
+    if girth_metric:
+        girth_min, girth_max = ranges[girth_metric]
+        position = (means[girth_metric] - girth_min) / (girth_max - girth_min)
+        if position > 0.75:
+            fit_style = "ôm body"
+        elif position < 0.25:
+            fit_style = "rộng rãi"
+
+    body_type = _category(body_analysis.get("body_type"), BODY_TYPE_GIRTHS, "average")
+    height_cat = _category(body_analysis.get("estimated_height_range"), HEIGHT_MEANS, "average")
+    area_text = ", ".join(f"phần {AREA_LABELS[area]} {fit_areas[area]}" for area in measured)
+    area_text = f"{area_text} và độ dài {fit_areas['length']}" if area_text else f"độ dài {fit_areas['length']}"
+    description = (
+        f"Với vóc dáng {BODY_TYPE_LABELS[body_type]} và chiều cao {HEIGHT_LABELS[height_cat]}, "
+        f"size {recommended} sẽ {fit_style} trên bạn. "
+        f"{area_text[0].upper()}{area_text[1:]}."
+    )
+
+    warnings = []
+    if best_overall != recommended:
+        warnings.append(f"Size phù hợp nhất ({best_overall}) hiện không có sẵn, {recommended} là size gần nhất")
+    tight = [AREA_LABELS[area] for area in measured if fit_areas[area] == "hơi chật"]
+    if tight:
+        warnings.append(
+            f"Phần {' và '.join(tight)} có thể hơi chật, cân nhắc lên 1 size nếu thích mặc thoải mái"
+        )
+
+    return {
+        "recommended_size": recommended,
+        "fit_confidence": round(confidence, 2),
+        "fit_style": fit_style,
+        "description": description,
+        "fit_areas": fit_areas,
+        "styling_tips": STYLING_TIPS[body_type],
+        "warnings": warnings,
+        "engine": "local",
+    }
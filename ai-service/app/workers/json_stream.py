@@ -0,0 +1,114 @@
+"""
+Incremental JSON Parsing
+Extracts a string field from JSON text while it is still being generated
+"""
+
+import json
+
+_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class JsonStringFieldStream:
+    """
+    Streams the value of one top-level string field of a JSON object.
+
+    Feed the model output chunk by chunk; each call returns the newly
+    decoded characters of the field value (possibly empty). Markdown code
+    fences and other text around the object are ignored.
+
+    Example:
+        parser = JsonStringFieldStream("description")
+        parser.feed('{"size": "M", "descri')   # -> ""
+        parser.feed('ption": "Vừa v')           # -> "Vừa v"
+        parser.feed('ặn"}')                     # -> "ặn"
+    """
+
+    def __init__(self, field: str):
+        self.key = f'"{field}"'
+        self.buffer = ""
+        self.pos = 0
+        self.state = "key"  # key -> colon -> string -> done
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        out = []
+
+        while True:
+            if self.state == "key":
+                idx = self.buffer.find(self.key, self.pos)
+                if idx < 0:
+                    # Keep a tail in case the key is split across chunks
+                    self.pos = max(self.pos, len(self.buffer) - len(self.key))
+                    break
+                self.pos = idx + len(self.key)
+                self.state = "colon"
+
+            if self.state == "colon":
+                rest = self.buffer[self.pos:].lstrip()
+                if not rest:
+                    break
+                if rest[0] != ":":
+                    self.state = "key"
+                    continue
+                value = rest[1:].lstrip()
+                if not value:
+                    break
+                if value[0] != '"':
+                    # Not a string value
+                    self.state = "key"
+                    continue
+                self.pos = len(self.buffer) - len(value) + 1
+                self.state = "string"
+
+            if self.state == "string":
+                if not self._read_string(out):
+                    break
+                self.state = "done"
+
+            break
+
+        return "".join(out)
+
+    def _read_string(self, out: list[str]) -> bool:
+        """Decode available string characters; True once the closing quote is read."""
+        buffer = self.buffer
+        while self.pos < len(buffer):
+            char = buffer[self.pos]
+            if char == '"':
+                self.pos += 1
+                return True
+            if char != "\\":
+                out.append(char)
+                self.pos += 1
+                continue
+
+            if self.pos + 1 >= len(buffer):
+                return False
+            escape = buffer[self.pos + 1]
+            if escape == "u":
+                if self.pos + 6 > len(buffer):
+                    return False
+                # A high surrogate (emoji etc.) must be decoded with its pair
+                is_high_surrogate = 0xD800 <= int(buffer[self.pos + 2:self.pos + 6], 16) <= 0xDBFF
+                length = 12 if is_high_surrogate else 6
+                if self.pos + length > len(buffer):
+                    return False
+                out.append(json.loads(f'"{buffer[self.pos:self.pos + length]}"'))
+                self.pos += length
+            else:
+                out.append(_ESCAPES.get(escape, escape))
+                self.pos += 2
+        return False
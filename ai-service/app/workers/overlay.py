@@ -0,0 +1,228 @@
+"""
+Overlay Renderer
+NumPy compositor for simple product-on-user preview images
+"""
+
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import structlog
+from PIL import Image, ImageOps
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+OVERLAY_OPACITY = 0.7
+OVERLAY_WIDTH_RATIO = 0.4  # Product width relative to the user photo
+OVERLAY_TOP_RATIO = 0.2  # Product top edge relative to the user photo height
+SIZE_STEP_RATIO = 0.03  # Extra product width per size above the recommended one
+
+# alpha -> alpha * opacity, same truncation as the old point(lambda x: int(x * 0.7))
+ALPHA_LUT = np.array([int(x * OVERLAY_OPACITY) for x in range(256)], dtype=np.uint8)
+
+
+class ProductAsset:
+    """Decoded product image with its overlay alpha already applied."""
+
+    def __init__(self, rgba: np.ndarray):
+        self.rgb = np.ascontiguousarray(rgba[:, :, :3])
+        self.alpha = ALPHA_LUT[rgba[:, :, 3]][:, :, None]
+
+    @property
+    def nbytes(self) -> int:
+        return self.rgb.nbytes + self.alpha.nbytes
+
+
+def _asset_nbytes(value: Image.Image | ProductAsset) -> int:
+    if isinstance(value, ProductAsset):
+        return value.nbytes
+    return value.width * value.height * len(value.getbands())
+
+
+class AssetCache:
+    """
+    LRU of decoded (width=None) and pre-scaled product assets, bounded by
+    their total size in bytes.
+
+    Renders run in worker threads, so every access holds a lock.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._items: OrderedDict[tuple, tuple[Image.Image | ProductAsset, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Image.Image | ProductAsset | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key: tuple, value: Image.Image | ProductAsset):
+        size = _asset_nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self._items[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.current_bytes -= evicted
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+asset_cache = AssetCache(settings.overlay_asset_cache_max_bytes)
+
+
+def product_asset_key(product_image_data: bytes, product_id: str | None = None) -> str:
+    """Cache key for a product image; content-hashed so a new image is never served stale."""
+    digest = hashlib.sha1(product_image_data).hexdigest()
+    return f"{product_id}:{digest}" if product_id else digest
+
+
+def get_product_asset(product_image_data: bytes, product_key: str, width: int) -> ProductAsset:
+    """Return the product scaled to width, decoding and resizing only on a miss."""
+    asset = asset_cache.get((product_key, width))
+    if asset is not None:
+        return asset
+
+    source = asset_cache.get((product_key, None))
+    if source is None:
+        source = Image.open(io.BytesIO(product_image_data)).convert("RGBA")
+        asset_cache.set((product_key, None), source)
+
+    height = max(1, int(source.height * width / source.width))
+    resized = source.resize((width, height), Image.Resampling.LANCZOS)
+    asset = ProductAsset(np.asarray(resized))
+    asset_cache.set((product_key, width), asset)
+    return asset
+
+
+def composite(base: np.ndarray, asset: ProductAsset, x: int, y: int) -> np.ndarray:
+    """
+    Alpha-blend an asset onto a copy of base (H x W x 3 uint8) at (x, y).
+
+    Parts of the asset outside base are clipped.
+    """
+    result = base.copy()
+    base_h, base_w = base.shape[:2]
+    asset_h, asset_w = asset.alpha.shape[:2]
+
+    top, left = max(y, 0), max(x, 0)
+    bottom, right = min(y + asset_h, base_h), min(x + asset_w, base_w)
+    if top >= bottom or left >= right:
+        return result
+
+    src = asset.rgb[top - y:bottom - y, left - x:right - x].astype(np.uint16)
+    alpha = asset.alpha[top - y:bottom - y, left - x:right - x].astype(np.uint16)
+    dst = base[top:bottom, left:right].astype(np.uint16)
+
+    blended = (src * alpha + dst * (255 - alpha) + 127) // 255
+    result[top:bottom, left:right] = blended.astype(np.uint8)
+    return result
+
+
+def _decode_user_image(user_image_data: bytes | memoryview) -> np.ndarray:
+    img = Image.open(io.BytesIO(user_image_data))
+    if img.format == "JPEG":
+        img.draft("RGB", (settings.image_max_edge, settings.image_max_edge))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    return np.asarray(img)
+
+
+def _encode_jpeg(pixels: np.ndarray, quality: int = 85) -> bytes:
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+def size_width_ratios(sizes: list[str], recommended: str) -> dict[str, float]:
+    """
+    Product width ratio per candidate size.
+
+    The recommended size is drawn at OVERLAY_WIDTH_RATIO; each size step
+    away from it in the given (smallest-first) order adds or removes
+    SIZE_STEP_RATIO.
+    """
+    anchor = sizes.index(recommended)
+    return {
+        size: max(SIZE_STEP_RATIO, OVERLAY_WIDTH_RATIO + (index - anchor) * SIZE_STEP_RATIO)
+        for index, size in enumerate(sizes)
+    }
+
+
+def _composite_at(base: np.ndarray, product_image_data: bytes, product_key: str, ratio: float) -> np.ndarray:
+    """Composite the product at ratio of the photo width, centered, ~20% from the top."""
+    user_h, user_w = base.shape[:2]
+    width = max(1, int(user_w * ratio))
+    asset = get_product_asset(product_image_data, product_key, width)
+    return composite(base, asset, (user_w - width) // 2, int(user_h * OVERLAY_TOP_RATIO))
+
+
+def _encode_variants(pixels: np.ndarray, max_edges: dict[str, int | None]) -> dict[str, bytes]:
+    user_h, user_w = pixels.shape[:2]
+    variants = {}
+    for name, max_edge in max_edges.items():
+        if max_edge is None or max(user_w, user_h) <= max_edge:
+            variants[name] = _encode_jpeg(pixels)
+            continue
+        img = Image.fromarray(pixels)
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        variants[name] = _encode_jpeg(np.asarray(img), quality=80)
+    return variants
+
+
+def render_overlay(
+    user_image_data: bytes | memoryview,
+    product_image_data: bytes,
+    product_id: str | None = None,
+) -> bytes:
+    """Render the default single overlay."""
+    base = _decode_user_image(user_image_data)
+    product_key = product_asset_key(product_image_data, product_id)
+    return _encode_jpeg(_composite_at(base, product_image_data, product_key, OVERLAY_WIDTH_RATIO))
+
+
+def render_overlays(
+    user_image_data: bytes | memoryview,
+    product_image_data: bytes,
+    width_ratios: dict[str, float],
+    max_edges: dict[str, int | None],
+    product_id: str | None = None,
+) -> dict[str, dict[str, bytes]]:
+    """
+    Render one overlay per candidate size in one pass.
+
+    The user photo is decoded and the product hashed once; each candidate
+    is composited from the cached asset for its width and encoded at
+    every resolution.
+
+    Args:
+        user_image_data: User photo bytes
+        product_image_data: Product image bytes
+        width_ratios: Candidate size -> product width relative to the photo
+        max_edges: Variant name -> longest edge in pixels (None = full size)
+        product_id: Product id, part of the asset cache key
+
+    Returns:
+        Candidate size -> variant name -> JPEG bytes
+    """
+    base = _decode_user_image(user_image_data)
+    product_key = product_asset_key(product_image_data, product_id)
+    return {
+        size: _encode_variants(_composite_at(base, product_image_data, product_key, ratio), max_edges)
+        for size, ratio in width_ratios.items()
+    }
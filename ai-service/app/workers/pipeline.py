@@ -0,0 +1,139 @@
+"""
+Stage Pipeline Executor
+Runs async stages as a dependency graph, concurrently where possible
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+class StageFailed(Exception):
+    """Raised by a stage function to mark its result as unusable."""
+
+
+@dataclass
+class Stage:
+    """
+    A single pipeline stage.
+
+    Args:
+        name: Unique stage name, also the key of its result
+        func: Coroutine function called with dependency results as kwargs
+        deps: Names of stages whose results this stage needs
+        timeout: Max seconds for this stage (None = no limit)
+        required: If True, a failure aborts all stages still pending
+    """
+
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    deps: tuple[str, ...] = ()
+    timeout: Optional[float] = None
+    required: bool = True
+
+
+@dataclass
+class PipelineRun:
+    """Results, errors and timings of a pipeline execution."""
+
+    results: dict[str, Any] = field(default_factory=dict)
+    errors: dict[str, str] = field(default_factory=dict)
+    timings: dict[str, dict] = field(default_factory=dict)
+
+    @property
+    def failed(self) -> bool:
+        return bool(self.errors)
+
+
+StageCallback = Callable[[str, Any], Awaitable[None]]
+
+
+async def run_pipeline(
+    stages: list[Stage],
+    job_id: str | None = None,
+    on_stage_complete: StageCallback | None = None,
+) -> PipelineRun:
+    """
+    Execute stages as soon as their dependencies are available.
+
+    Independent stages run concurrently. A stage whose dependency failed
+    is skipped. When a required stage fails, every stage still running
+    or waiting is cancelled.
+
+    Args:
+        stages: Stages to run; dependencies must reference earlier names
+        job_id: Job identifier for logging
+        on_stage_complete: Optional callback awaited after each successful stage
+
+    Returns:
+        PipelineRun with per-stage results, errors and timings
+    """
+    run = PipelineRun()
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in names]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {missing}")
+
+    started = time.perf_counter()
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def execute(stage: Stage) -> Any:
+        inputs = {}
+        for dep in stage.deps:
+            if not await tasks[dep]:
+                run.timings[stage.name] = {"status": "skipped"}
+                return False
+            inputs[dep] = run.results[dep]
+
+        stage_start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(stage.func(**inputs), timeout=stage.timeout)
+        except asyncio.TimeoutError:
+            status, error = "timeout", f"Stage {stage.name} timed out after {stage.timeout}s"
+        except StageFailed as e:
+            status, error = "failed", str(e)
+        except Exception as e:
+            logger.error("Pipeline stage crashed", job_id=job_id, stage=stage.name, error=str(e))
+            status, error = "failed", str(e)
+        else:
+            run.results[stage.name] = result
+            run.timings[stage.name] = _timing("completed", started, stage_start)
+            if on_stage_complete:
+                await on_stage_complete(stage.name, result)
+            return True
+
+        run.errors[stage.name] = error
+        run.timings[stage.name] = _timing(status, started, stage_start)
+        logger.warning("Pipeline stage failed", job_id=job_id, stage=stage.name, status=status)
+
+        if stage.required:
+            for name, task in tasks.items():
+                if name != stage.name and not task.done():
+                    task.cancel()
+        return False
+
+    for stage in stages:
+        tasks[stage.name] = asyncio.create_task(execute(stage))
+
+    outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    for name, outcome in zip(tasks, outcomes):
+        if isinstance(outcome, asyncio.CancelledError):
+            run.timings.setdefault(name, {"status": "cancelled"})
+
+    run.timings["total"] = {"duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+    return run
+
+
+def _timing(status: str, pipeline_start: float, stage_start: float) -> dict:
+    now = time.perf_counter()
+    return {
+        "status": status,
+        "started_at_ms": round((stage_start - pipeline_start) * 1000, 1),
+        "duration_ms": round((now - stage_start) * 1000, 1),
+    }
@@ -0,0 +1,114 @@
+"""
+Image Preprocessing
+Normalizes uploaded photos before they are sent to Gemini Vision
+"""
+
+import asyncio
+import io
+from dataclasses import dataclass
+
+import structlog
+from PIL import Image, ImageOps
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+# Magic bytes of the formats accepted by the try-on endpoint
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+]
+
+
+@dataclass
+class PreparedImage:
+    """Image bytes ready for upload to the model."""
+
+    data: bytes
+    mime_type: str
+    width: int = 0
+    height: int = 0
+
+
+def sniff_image_mime(data: bytes | memoryview) -> str | None:
+    """Detect the image format from its leading magic bytes."""
+    head = bytes(data[:12])
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def prepare_image(
+    data: bytes | memoryview,
+    max_edge: int | None = None,
+    quality: int | None = None,
+) -> PreparedImage:
+    """
+    Orient, downscale and re-encode an image as a metadata-free JPEG.
+
+    Args:
+        data: Raw image bytes (JPEG, PNG or WebP)
+        max_edge: Longest edge in pixels after downscaling
+        quality: JPEG quality of the re-encoded image
+
+    Returns:
+        PreparedImage; the original bytes with their sniffed MIME type
+        if the image cannot be decoded
+    """
+    max_edge = max_edge or settings.image_max_edge
+    quality = quality or settings.image_jpeg_quality
+
+    try:
+        img = Image.open(io.BytesIO(data))
+
+        # Let libjpeg decode at a reduced scale instead of full resolution
+        if img.format == "JPEG":
+            img.draft("RGB", (max_edge, max_edge))
+
+        img = ImageOps.exif_transpose(img)
+
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        # Saving without exif/icc info strips all metadata
+        output = io.BytesIO()
+        img.save(output, format="JPEG", quality=quality, optimize=True)
+
+        return PreparedImage(
+            data=output.getvalue(),
+            mime_type="image/jpeg",
+            width=img.width,
+            height=img.height,
+        )
+
+    except Exception as e:
+        logger.warning("Image preprocessing failed, using original", error=str(e))
+        return PreparedImage(
+            data=bytes(data),
+            mime_type=sniff_image_mime(data) or "image/jpeg",
+        )
+
+
+async def preprocess_image(data: bytes | memoryview) -> PreparedImage:
+    """Run prepare_image off the event loop."""
+    prepared = await asyncio.to_thread(prepare_image, data)
+    logger.info(
+        "Image preprocessed",
+        original_bytes=len(data),
+        prepared_bytes=len(prepared.data),
+        mime_type=prepared.mime_type,
+    )
+    return prepared
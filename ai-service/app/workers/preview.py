@@ -0,0 +1,91 @@
+"""
+Try-on Previews
+Renders overlay previews and stores them in MinIO under content-hashed names
+"""
+
+import asyncio
+import hashlib
+
+import structlog
+
+from app.config import get_settings
+from app.services.storage import put_object_bytes
+from app.workers.overlay import render_overlays, size_width_ratios
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+PREVIEW_PREFIX = "previews"
+
+
+def preview_variants() -> dict[str, int | None]:
+    """Preview resolution name -> longest edge (None = full size)."""
+    return {"full": None, "thumb": settings.preview_thumb_edge}
+
+
+def candidate_sizes(sizes: list[str], recommended: str, spread: int | None = None) -> list[str]:
+    """
+    The recommended size and up to spread neighbours on each side.
+
+    Args:
+        sizes: Product sizes, smallest first
+        recommended: Size the fit prediction chose
+        spread: Neighbours per side (default settings.preview_size_spread)
+    """
+    spread = settings.preview_size_spread if spread is None else spread
+    if recommended not in sizes:
+        return [recommended]
+    index = sizes.index(recommended)
+    return sizes[max(0, index - spread):index + spread + 1]
+
+
+async def create_previews(
+    user_image_data: bytes | memoryview,
+    product_image_data: bytes,
+    sizes: list[str],
+    recommended: str,
+    product_id: str | None = None,
+) -> dict:
+    """
+    Render overlay previews of the candidate sizes and upload them.
+
+    All candidates are rendered in one pass (see render_overlays), each
+    in every resolution. Object names are the SHA-256 of the JPEG bytes,
+    which also serves as the strong ETag when the preview is served.
+
+    Args:
+        user_image_data: User photo bytes
+        product_image_data: Product image bytes
+        sizes: Product sizes, smallest first
+        recommended: Recommended size; rendered with its neighbours
+        product_id: Product id, part of the asset cache key
+
+    Returns:
+        {"size": recommended, "sizes": {size: {variant: {"object", "etag", "size"}}}}
+    """
+    candidates = candidate_sizes(sizes, recommended)
+    overlays = await asyncio.to_thread(
+        render_overlays,
+        user_image_data,
+        product_image_data,
+        size_width_ratios(candidates, recommended),
+        preview_variants(),
+        product_id,
+    )
+
+    previews = {}
+    uploads = []
+    for size, variants in overlays.items():
+        previews[size] = {}
+        for name, data in variants.items():
+            digest = hashlib.sha256(data).hexdigest()
+            previews[size][name] = {
+                "object": f"{PREVIEW_PREFIX}/{digest}.jpg",
+                "etag": digest,
+                "size": len(data),
+            }
+            uploads.append(put_object_bytes(previews[size][name]["object"], data, "image/jpeg"))
+    await asyncio.gather(*uploads)
+
+    logger.info("Try-on previews stored", product_id=product_id, sizes=list(previews))
+    return {"size": recommended, "sizes": previews}
@@ -0,0 +1,230 @@
+"""
+Per-product Size Charts
+Loads Product.sizeGuide from Postgres and keeps the compiled charts in memory
+"""
+
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+import structlog
+
+from app.config import get_settings
+from app.services.database import get_db_pool
+from app.workers.size_matrix import METRIC_INDEX, CompiledChart, compile_chart
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+SIZE_GUIDE_QUERY = "SELECT id, size_guide, updated_at FROM products WHERE id = ANY($1::text[])"
+
+# sizeGuide keys admins use for each scoring metric
+METRIC_ALIASES = {
+    "height": "height",
+    "chieu_cao": "height",
+    "weight": "weight",
+    "can_nang": "weight",
+    "chest": "chest",
+    "bust": "chest",
+    "vong_nguc": "chest",
+    "nguc": "chest",
+    "waist": "waist",
+    "vong_eo": "waist",
+    "eo": "waist",
+    "hips": "hips",
+    "hip": "hips",
+    "vong_mong": "hips",
+    "mong": "hips",
+    "shoulder": "shoulder",
+    "vai": "shoulder",
+}
+
+_RANGE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(?:-|–|~|to)\s*(\d+(?:\.\d+)?)")
+
+
+def parse_range(value) -> Optional[tuple[float, float]]:
+    """
+    Parse a sizeGuide range: "94-98", "94 - 98 cm", [94, 98] or {"min": 94, "max": 98}.
+
+    Single values have no range to score against and return None.
+    """
+    if isinstance(value, str):
+        match = _RANGE_PATTERN.match(value)
+        bounds = (match.group(1), match.group(2)) if match else None
+    elif isinstance(value, (list, tuple)) and len(value) == 2:
+        bounds = value
+    elif isinstance(value, dict) and "min" in value and "max" in value:
+        bounds = (value["min"], value["max"])
+    else:
+        bounds = None
+
+    if bounds is None:
+        return None
+    try:
+        min_val, max_val = float(bounds[0]), float(bounds[1])
+    except (TypeError, ValueError):
+        return None
+    if not 0 < min_val < max_val:
+        return None
+    return min_val, max_val
+
+
+def parse_size_guide(size_guide) -> Optional[dict]:
+    """
+    Convert a Product.sizeGuide JSON value into a SIZE_CHARTS-style chart.
+
+    Unknown metrics (length, sleeve, ...) are ignored.
+
+    Returns:
+        {size: {metric: (min, max)}} or None if nothing is usable
+    """
+    if isinstance(size_guide, str):
+        try:
+            size_guide = json.loads(size_guide)
+        except ValueError:
+            return None
+    if not isinstance(size_guide, dict):
+        return None
+
+    chart = {}
+    for size, specs in size_guide.items():
+        if not isinstance(specs, dict):
+            continue
+        ranges = {}
+        for key, value in specs.items():
+            metric = METRIC_ALIASES.get(_normalize_key(key))
+            parsed = parse_range(value)
+            if metric in METRIC_INDEX and parsed and metric not in ranges:
+                ranges[metric] = parsed
+        if ranges:
+            chart[str(size).strip().upper()] = ranges
+
+    return chart or None
+
+
+def _normalize_key(key) -> str:
+    """'Vòng ngực' -> 'vong_nguc'."""
+    key = unicodedata.normalize("NFKD", str(key).strip().lower().replace("đ", "d"))
+    key = "".join(char for char in key if not unicodedata.combining(char))
+    return re.sub(r"[\s-]+", "_", key)
+
+
+@dataclass
+class ChartEntry:
+    chart: Optional[CompiledChart]  # None = no usable sizeGuide, use the type chart
+    version: Optional[datetime]  # products.updated_at
+    expires_at: float
+
+
+class SizeChartProvider:
+    """
+    Size chart per product, backed by an in-process LRU.
+
+    Hits are a dict lookup. Misses are loaded in one query per call and
+    cached for size_chart_cache_ttl; product-update events evict entries
+    older than the event's version so edits apply immediately.
+    """
+
+    def __init__(self, type_charts: dict[str, CompiledChart], default_type: str = "ao_thun"):
+        self.type_charts = type_charts
+        self.default_type = default_type
+        self._entries: OrderedDict[str, ChartEntry] = OrderedDict()
+        self._generation = 0
+
+    def type_chart(self, product_type: str) -> CompiledChart:
+        return self.type_charts.get(product_type, self.type_charts[self.default_type])
+
+    async def get(self, product_id: str, product_type: str) -> CompiledChart:
+        """Compiled chart for a product, falling back to its type chart."""
+        charts = await self.get_many([(product_id, product_type)])
+        return charts[0]
+
+    async def get_many(self, products: list[tuple[str, str]]) -> list[CompiledChart]:
+        """Compiled charts for (product_id, product_type) pairs, in order."""
+        now = time.monotonic()
+        entries = {}
+        for product_id, _ in products:
+            entry = self._entries.get(product_id)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(product_id)
+                entries[product_id] = entry
+
+        missing = list(dict.fromkeys(pid for pid, _ in products if pid not in entries))
+        if missing:
+            entries.update(await self._load(missing))
+
+        return [
+            entries[product_id].chart or self.type_chart(product_type)
+            for product_id, product_type in products
+        ]
+
+    async def _load(self, product_ids: list[str]) -> dict[str, ChartEntry]:
+        generation = self._generation
+        now = time.monotonic()
+
+        try:
+            pool = await get_db_pool()
+            rows = await pool.fetch(SIZE_GUIDE_QUERY, product_ids, timeout=settings.size_chart_db_timeout)
+        except Exception as e:
+            logger.warning("Size guide query failed, using type charts", products=len(product_ids), error=str(e))
+            expires_at = now + settings.size_chart_error_ttl
+            loaded = {pid: ChartEntry(None, None, expires_at) for pid in product_ids}
+        else:
+            expires_at = now + settings.size_chart_cache_ttl
+            # Unknown products are cached too, as "use the type chart"
+            loaded = {pid: ChartEntry(None, None, expires_at) for pid in product_ids}
+            for row in rows:
+                chart = parse_size_guide(row["size_guide"])
+                loaded[row["id"]] = ChartEntry(
+                    compile_chart(chart) if chart else None,
+                    row["updated_at"],
+                    expires_at,
+                )
+
+        # An invalidation during the query may have made these rows stale
+        if generation == self._generation:
+            for product_id, entry in loaded.items():
+                self._store(product_id, entry)
+        return loaded
+
+    def _store(self, product_id: str, entry: ChartEntry):
+        self._entries[product_id] = entry
+        self._entries.move_to_end(product_id)
+        while len(self._entries) > settings.size_chart_cache_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, product_id: str, version: Optional[datetime] = None) -> bool:
+        """
+        Evict a product's chart.
+
+        With a version (the product's new updated_at), entries already at
+        that version or newer are kept, so replayed events are harmless.
+
+        Returns:
+            True if an entry was evicted
+        """
+        self._generation += 1
+        entry = self._entries.get(product_id)
+        if entry is None:
+            return False
+        if version is not None and entry.version is not None and _naive(entry.version) >= _naive(version):
+            return False
+        del self._entries[product_id]
+        return True
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _naive(value: datetime) -> datetime:
+    # Prisma stores timestamp without time zone (UTC); events carry an ISO string with Z
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
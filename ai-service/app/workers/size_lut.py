@@ -0,0 +1,198 @@
+"""
+Size Lookup Tables
+Precomputed top-3 sizes per 1 cm measurement cell, memory-mapped at startup
+
+Build (from ai-service/):
+    python -m app.workers.size_lut --output data/size_lut
+"""
+
+import argparse
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import structlog
+
+from app.workers.size_matrix import METRICS, CompiledChart, rank_sizes
+
+logger = structlog.get_logger()
+
+# Bump when the table layout or the confidence formula changes
+LUT_FORMAT_VERSION = 1
+
+# Measurement bounds accepted by SizeRecommendRequest (cm / kg)
+METRIC_BOUNDS = {
+    "height": (100, 250),
+    "weight": (30, 200),
+    "chest": (60, 150),
+    "waist": (50, 130),
+    "hips": (60, 150),
+    "shoulder": (30, 60),
+}
+
+TOP_K = 3
+NO_SIZE = 255  # size slot sentinel: fewer sizes than TOP_K, or no usable score
+
+
+def chart_hash(size_chart: dict) -> str:
+    """Identity of a chart's contents, including size and metric order (tie-breaks)."""
+    payload = json.dumps([LUT_FORMAT_VERSION, list(size_chart.items())])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+@dataclass
+class SizeTable:
+    """
+    Top-K sizes for every integer measurement cell of one chart.
+
+    data has shape (*metric_dims, 2 * TOP_K) uint8: size indices followed
+    by confidences in percent. Confidences are stored already rounded the
+    way rank_recommendation rounds them (top capped at 0.95, alternatives
+    at 0.90), so lookups match the live scorer exactly.
+    """
+
+    sizes: tuple[str, ...]
+    metrics: tuple[str, ...]
+    lows: tuple[int, ...]
+    data: np.ndarray
+
+    def lookup(self, measurements: dict) -> Optional[list[tuple[str, float]]]:
+        """
+        Ranked (size, confidence) pairs, best first.
+
+        None when a chart metric is missing, not a whole number or out of
+        bounds, or when no size scored above zero; the caller then uses
+        the live scorer.
+        """
+        index = []
+        for metric, low, dim in zip(self.metrics, self.lows, self.data.shape):
+            value = measurements.get(metric)
+            if value is None or value != int(value):
+                return None
+            offset = int(value) - low
+            if not 0 <= offset < dim:
+                return None
+            index.append(offset)
+
+        cell = self.data[tuple(index)].tolist()
+        if cell[0] == NO_SIZE:
+            return None
+        return [
+            (self.sizes[size], confidence / 100)
+            for size, confidence in zip(cell[:TOP_K], cell[TOP_K:])
+            if size != NO_SIZE
+        ]
+
+
+def build_table(chart: CompiledChart) -> SizeTable:
+    """Score every integer cell of the chart's metrics in bounds."""
+    metrics = chart.metrics
+    axes = [np.arange(METRIC_BOUNDS[m][0], METRIC_BOUNDS[m][1] + 1, dtype=np.float64) for m in metrics]
+    dims = tuple(len(axis) for axis in axes)
+
+    grid = np.full((int(np.prod(dims)), len(METRICS)), np.nan)
+    for metric, values in zip(metrics, np.meshgrid(*axes, indexing="ij")):
+        grid[:, METRICS.index(metric)] = values.ravel()
+
+    ranked = rank_sizes(chart, grid)
+    k = min(TOP_K, len(chart.sizes))
+
+    # Same expressions as rank_recommendation, rounded with Python's round()
+    caps = np.array([0.95] + [0.90] * (k - 1))
+    capped = np.minimum(ranked.scores[:, :k] / 100, caps)
+    to_percent = np.frompyfunc(lambda c: round(round(c, 2) * 100), 1, 1)
+
+    data = np.full((len(grid), 2 * TOP_K), NO_SIZE, dtype=np.uint8)
+    data[:, :k] = ranked.order[:, :k]
+    data[:, TOP_K:TOP_K + k] = to_percent(capped).astype(np.uint8)
+    # A zero top score means "no fit": recommend_size estimates from height/weight
+    data[ranked.scores[:, 0] == 0, 0] = NO_SIZE
+
+    return SizeTable(
+        sizes=chart.sizes,
+        metrics=metrics,
+        lows=tuple(METRIC_BOUNDS[m][0] for m in metrics),
+        data=data.reshape(*dims, 2 * TOP_K),
+    )
+
+
+def save_table(table: SizeTable, directory: Path, product_type: str, source_hash: str):
+    """Write <type>.npy and its <type>.json metadata."""
+    directory.mkdir(parents=True, exist_ok=True)
+    np.save(directory / f"{product_type}.npy", table.data)
+    (directory / f"{product_type}.json").write_text(json.dumps({
+        "chart_hash": source_hash,
+        "sizes": table.sizes,
+        "metrics": table.metrics,
+        "lows": table.lows,
+    }))
+
+
+class SizeTables:
+    """
+    Memory-mapped tables of the built-in type charts.
+
+    Tables are keyed by the CompiledChart they were built from, so
+    per-product charts (which have no table) always use the live scorer.
+    """
+
+    def __init__(self):
+        self._tables: dict[int, tuple[CompiledChart, SizeTable]] = {}
+
+    def load(self, directory: str, charts: dict[str, tuple[dict, CompiledChart]]):
+        """
+        Map the tables of every chart found in directory.
+
+        Args:
+            directory: Output directory of the build command
+            charts: product_type -> (source chart, compiled chart)
+        """
+        self._tables.clear()
+        for product_type, (size_chart, compiled) in charts.items():
+            meta_path = Path(directory) / f"{product_type}.json"
+            if not meta_path.exists():
+                continue
+            meta = json.loads(meta_path.read_text())
+            if meta["chart_hash"] != chart_hash(size_chart):
+                logger.warning("Size table is stale, ignoring", product_type=product_type)
+                continue
+
+            # Plain ndarray view of the mapping; np.memmap indexing is slower
+            data = np.load(Path(directory) / f"{product_type}.npy", mmap_mode="r").view(np.ndarray)
+            table = SizeTable(tuple(meta["sizes"]), tuple(meta["metrics"]), tuple(meta["lows"]), data)
+            self._tables[id(compiled)] = (compiled, table)
+
+        logger.info("Size tables loaded", directory=directory, tables=len(self._tables))
+
+    def get(self, chart: CompiledChart) -> Optional[SizeTable]:
+        entry = self._tables.get(id(chart))
+        return entry[1] if entry is not None and entry[0] is chart else None
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True, type=Path)
+    args = parser.parse_args()
+
+    # Imported here: size_rec itself imports this module
+    from app.workers.size_rec import COMPILED_CHARTS, SIZE_CHARTS
+
+    for product_type, size_chart in SIZE_CHARTS.items():
+        start = time.perf_counter()
+        table = build_table(COMPILED_CHARTS[product_type])
+        save_table(table, args.output, product_type, chart_hash(size_chart))
+        print(
+            f"{product_type}: {table.data.shape[:-1]} cells over {table.metrics}, "
+            f"{table.data.nbytes / 1e6:.1f} MB in {time.perf_counter() - start:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Vectorized Size Scoring
+Size charts compiled into dense arrays and scored with NumPy
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+# Column order of measurement matrices
+METRICS = ("height", "weight", "chest", "waist", "hips", "shoulder")
+METRIC_INDEX = {metric: i for i, metric in enumerate(METRICS)}
+
+
+@dataclass(frozen=True)
+class CompiledChart:
+    """
+    A size chart as (sizes x slots) arrays.
+
+    Slot k of a size holds the k-th metric of that size's ranges, so the
+    per-size metric order of the source chart is preserved and scores are
+    accumulated in exactly the same order as calculate_size_scores.
+    """
+
+    sizes: tuple[str, ...]
+    metric_idx: np.ndarray  # int, index into METRICS
+    mins: np.ndarray
+    maxs: np.ndarray
+    valid: np.ndarray  # bool, False for padding slots
+
+    @property
+    def metrics(self) -> tuple[str, ...]:
+        """Metrics used by at least one size, in column order."""
+        used = set(self.metric_idx[self.valid].tolist())
+        return tuple(metric for i, metric in enumerate(METRICS) if i in used)
+
+    def ranges(self) -> dict:
+        """The chart back as {size: {metric: (min, max)}}, in source order."""
+        return {
+            size: {
+                METRICS[self.metric_idx[s, k]]: (float(self.mins[s, k]), float(self.maxs[s, k]))
+                for k in range(self.valid.shape[1])
+                if self.valid[s, k]
+            }
+            for s, size in enumerate(self.sizes)
+        }
+
+
+@dataclass(frozen=True)
+class RankedSizes:
+    """Sizes ranked per row, best first."""
+
+    chart: CompiledChart
+    order: np.ndarray  # (N, S) size indices
+    scores: np.ndarray  # (N, S) scores in ranked order
+
+    def items(self, row: int) -> list[tuple[str, float]]:
+        """(size, score) pairs of one row, like sorted(scores.items()) in size_rec."""
+        return [
+            (self.chart.sizes[i], float(score))
+            for i, score in zip(self.order[row], self.scores[row])
+        ]
+
+    def confidences(self) -> np.ndarray:
+        """Confidence of every ranked size: top capped at 0.95, alternatives at 0.90."""
+        confidences = np.minimum(self.scores / 100, 0.90)
+        confidences[:, 0] = np.minimum(self.scores[:, 0] / 100, 0.95)
+        return confidences
+
+
+def compile_chart(size_chart: dict) -> CompiledChart:
+    """Compile a {size: {metric: (min, max)}} chart into arrays."""
+    sizes = tuple(size_chart)
+    slots = max((len(ranges) for ranges in size_chart.values()), default=0)
+
+    metric_idx = np.zeros((len(sizes), slots), dtype=np.intp)
+    mins = np.ones((len(sizes), slots))
+    maxs = np.full((len(sizes), slots), 2.0)
+    valid = np.zeros((len(sizes), slots), dtype=bool)
+
+    for s, size in enumerate(sizes):
+        for k, (metric, (min_val, max_val)) in enumerate(size_chart[size].items()):
+            metric_idx[s, k] = METRIC_INDEX[metric]
+            mins[s, k] = min_val
+            maxs[s, k] = max_val
+            valid[s, k] = True
+
+    return CompiledChart(sizes, metric_idx, mins, maxs, valid)
+
+
+def measurements_matrix(rows: list[dict]) -> np.ndarray:
+    """Build an (N, len(METRICS)) matrix from measurement dicts; None -> NaN."""
+    matrix = np.full((len(rows), len(METRICS)), np.nan)
+    for n, measurements in enumerate(rows):
+        for metric, value in measurements.items():
+            if value is not None and metric in METRIC_INDEX:
+                matrix[n, METRIC_INDEX[metric]] = value
+    return matrix
+
+
+def score_matrix(chart: CompiledChart, measurements: np.ndarray) -> np.ndarray:
+    """
+    Score every size for every row of an (N, len(METRICS)) matrix.
+
+    Gives bit-identical results to calculate_size_scores for each row.
+
+    Returns:
+        (N, S) scores
+    """
+    n_rows, n_sizes = len(measurements), len(chart.sizes)
+    total = np.zeros((n_rows, n_sizes))
+    matches = np.zeros((n_rows, n_sizes))
+
+    # NaN cells and padding slots compute garbage that np.where discards
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for k in range(chart.mins.shape[1]):
+            values = measurements[:, chart.metric_idx[:, k]]  # (N, S)
+            min_val, max_val = chart.mins[:, k], chart.maxs[:, k]
+            present = ~np.isnan(values) & chart.valid[:, k]
+
+            center = (min_val + max_val) / 2
+            inside = 100 * (1 - np.abs(values - center) / (max_val - min_val) * 0.5)
+            below = np.maximum(0, 60 - (min_val - values) / min_val * 100)
+            above = np.maximum(0, 60 - (values - max_val) / max_val * 100)
+
+            term = np.where(values < min_val, below, np.where(values > max_val, above, inside))
+            total += np.where(present, term, 0.0)
+            matches += present
+
+        return np.where(matches > 0, total / matches, 0.0)
+
+
+def rank_sizes(chart: CompiledChart, measurements: np.ndarray) -> RankedSizes:
+    """
+    Rank sizes by score for every row.
+
+    Ties keep chart order, matching Python's stable sorted(..., reverse=True).
+    """
+    scores = score_matrix(chart, measurements)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return RankedSizes(chart, order, np.take_along_axis(scores, order, axis=1))
@@ -3,20 +3,18 @@ Size Recommendation Service
 AI-powered size recommendation using measurements and Gemini
 """
 
+import asyncio
+
 import structlog
-from google import genai
-from google.genai import types
 from app.config import get_settings
+from app.workers.size_charts import SizeChartProvider
+from app.workers.size_lut import SizeTables
+from app.workers.size_matrix import CompiledChart, compile_chart, measurements_matrix, rank_sizes
+from app.workers.size_tips import generate_size_tips, generate_size_tips_within
 
 settings = get_settings()
 logger = structlog.get_logger()
 
-# Initialize Gemini client
-client = None
-if settings.gemini_api_key:
-    client = genai.Client(api_key=settings.gemini_api_key)
-
-
 # Size charts for different product types
 SIZE_CHARTS = {
     "ao_thun": {
@@ -42,6 +40,24 @@ SIZE_CHARTS = {
     },
 }
 
+# Charts compiled for the vectorized scorer
+COMPILED_CHARTS = {product_type: compile_chart(chart) for product_type, chart in SIZE_CHARTS.items()}
+
+# Per-product charts from Product.sizeGuide, falling back to COMPILED_CHARTS
+chart_provider = SizeChartProvider(COMPILED_CHARTS)
+
+# Precomputed lookup tables of COMPILED_CHARTS, see load_size_tables
+size_tables = SizeTables()
+
+
+def load_size_tables():
+    """Memory-map the lookup tables in settings.size_lut_dir, if configured."""
+    if settings.size_lut_dir:
+        size_tables.load(
+            settings.size_lut_dir,
+            {t: (SIZE_CHARTS[t], COMPILED_CHARTS[t]) for t in SIZE_CHARTS},
+        )
+
 
 async def recommend_size(
     product_id: str,
@@ -78,9 +94,6 @@ async def recommend_size(
     )
 
     try:
-        # Get size chart for product type
-        size_chart = SIZE_CHARTS.get(product_type, SIZE_CHARTS["ao_thun"])
-        
         # Calculate fit scores for each size
         measurements = {
             "height": height,
@@ -90,41 +103,14 @@ async def recommend_size(
             "hips": hips,
             "shoulder": shoulder,
         }
-        
-        scores = calculate_size_scores(size_chart, measurements)
-        
-        # Sort by score
-        sorted_sizes = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        
-        if not sorted_sizes or sorted_sizes[0][1] == 0:
-            # Not enough measurements, use basic estimation
-            recommended = estimate_from_basic(height, weight)
-            confidence = 0.5
-        else:
-            recommended = sorted_sizes[0][0]
-            confidence = min(sorted_sizes[0][1] / 100, 0.95)
-        
-        # Adjust for fit preference
-        if fit_preference == "slim" and recommended in ["M", "L", "XL"]:
-            # Could suggest going down a size
-            pass
-        elif fit_preference == "loose" and recommended in ["S", "M", "L"]:
-            # Could suggest going up a size
-            pass
-
-        # Generate alternatives
-        alternatives = []
-        for size, score in sorted_sizes[1:3]:
-            alt_confidence = min(score / 100, 0.90)
-            note = get_size_note(size, recommended)
-            alternatives.append({
-                "size": size,
-                "confidence": round(alt_confidence, 2),
-                "note": note,
-            })
+
+        chart = await chart_provider.get(product_id, product_type)
+        recommendation = rank_recommendation(chart, measurements, fit_preference)
+        recommended = recommendation["recommended_size"]
+        confidence = recommendation["confidence"]
 
         # Generate tips using Gemini
-        tips = await generate_size_tips(
+        tips = await get_tips(
             recommended_size=recommended,
             measurements=measurements,
             product_type=product_type,
@@ -139,10 +125,8 @@ async def recommend_size(
         )
 
         return {
-            "recommended_size": recommended,
-            "confidence": round(confidence, 2),
-            "alternatives": alternatives,
-            "tips": tips,
+            **recommendation,
+            **tips,
             "measurements_used": {k: v for k, v in measurements.items() if v is not None},
         }
 
@@ -151,8 +135,167 @@ async def recommend_size(
         raise
 
 
+async def get_tips(
+    recommended_size: str,
+    measurements: dict,
+    product_type: str,
+    fit_preference: str,
+) -> dict:
+    """
+    Tips for a recommendation, bounded by size_tips_deadline when set.
+
+    Returns:
+        {"tips", "tips_status", "tips_id"}; a "pending" status means the
+        tips are fallbacks and the enriched ones can be fetched by tips_id
+    """
+    if settings.size_tips_deadline > 0:
+        return await generate_size_tips_within(
+            recommended_size,
+            measurements,
+            product_type,
+            fit_preference,
+            deadline=settings.size_tips_deadline,
+        )
+
+    tips = await generate_size_tips(recommended_size, measurements, product_type, fit_preference)
+    return {"tips": tips, "tips_status": "completed", "tips_id": None}
+
+
+def rank_recommendation(chart: CompiledChart, measurements: dict, fit_preference: str = "regular") -> dict:
+    """
+    Score a compiled chart and build the recommendation (without tips).
+
+    Returns:
+        recommended_size, confidence and alternatives
+    """
+    # Precomputed (size, confidence) ranking for whole-cm measurements
+    table = size_tables.get(chart)
+    ranked = table.lookup(measurements) if table else None
+    if ranked:
+        recommended, confidence = ranked[0]
+        alternatives = [
+            {"size": size, "confidence": alt_confidence, "note": get_size_note(size, recommended)}
+            for size, alt_confidence in ranked[1:3]
+        ]
+        return {
+            "recommended_size": recommended,
+            "confidence": confidence,
+            "alternatives": alternatives,
+        }
+
+    # Sorted by score, best first
+    sorted_sizes = rank_sizes(chart, measurements_matrix([measurements])).items(0)
+
+    if not sorted_sizes or sorted_sizes[0][1] == 0:
+        # Not enough measurements, use basic estimation
+        recommended = estimate_from_basic(measurements.get("height"), measurements.get("weight"))
+        confidence = 0.5
+    else:
+        recommended = sorted_sizes[0][0]
+        confidence = min(sorted_sizes[0][1] / 100, 0.95)
+
+    # Adjust for fit preference
+    if fit_preference == "slim" and recommended in ["M", "L", "XL"]:
+        # Could suggest going down a size
+        pass
+    elif fit_preference == "loose" and recommended in ["S", "M", "L"]:
+        # Could suggest going up a size
+        pass
+
+    # Generate alternatives
+    alternatives = []
+    for size, score in sorted_sizes[1:3]:
+        alt_confidence = min(score / 100, 0.90)
+        note = get_size_note(size, recommended)
+        alternatives.append({
+            "size": size,
+            "confidence": round(alt_confidence, 2),
+            "note": note,
+        })
+
+    return {
+        "recommended_size": recommended,
+        "confidence": round(confidence, 2),
+        "alternatives": alternatives,
+    }
+
+
+async def recommend_sizes_batch(
+    products: list[dict],
+    measurements: dict,
+    fit_preference: str = "regular",
+    include_tips: bool = False,
+) -> list[dict]:
+    """
+    Recommend sizes for many products from one set of measurements.
+
+    Products sharing a chart (their own sizeGuide or their type's chart)
+    share one scoring pass. With include_tips, tips are generated once per
+    (product type, recommended size).
+
+    Args:
+        products: [{"product_id", "product_type"}, ...]
+        measurements: Body measurements (height, weight, chest, waist, hips, shoulder)
+        fit_preference: Preferred fit style
+        include_tips: Generate tips (deduplicated LLM calls)
+
+    Returns:
+        One recommendation per product, in request order
+    """
+    charts = await chart_provider.get_many([(p["product_id"], p["product_type"]) for p in products])
+
+    by_chart = {}
+    for chart in charts:
+        if id(chart) not in by_chart:
+            by_chart[id(chart)] = rank_recommendation(chart, measurements, fit_preference)
+
+    tips_by_key = {}
+    if include_tips:
+        tip_keys = list(dict.fromkeys(
+            (product["product_type"], by_chart[id(chart)]["recommended_size"])
+            for product, chart in zip(products, charts)
+        ))
+        tips = await asyncio.gather(*[
+            get_tips(
+                recommended_size=recommended_size,
+                measurements=measurements,
+                product_type=product_type,
+                fit_preference=fit_preference,
+            )
+            for product_type, recommended_size in tip_keys
+        ])
+        tips_by_key = dict(zip(tip_keys, tips))
+
+    measurements_used = {k: v for k, v in measurements.items() if v is not None}
+    results = []
+    for product, chart in zip(products, charts):
+        recommendation = by_chart[id(chart)]
+        results.append({
+            "product_id": product["product_id"],
+            "product_type": product["product_type"],
+            **recommendation,
+            **tips_by_key.get(
+                (product["product_type"], recommendation["recommended_size"]),
+                {"tips": [], "tips_status": "completed", "tips_id": None},
+            ),
+            "measurements_used": measurements_used,
+        })
+
+    logger.info(
+        "Batch size recommendation completed",
+        products=len(products),
+        charts=len(by_chart),
+        include_tips=include_tips,
+    )
+    return results
+
+
 def calculate_size_scores(size_chart: dict, measurements: dict) -> dict:
-    """Calculate fit score for each size based on measurements."""
+    """
+    Calculate fit score for each size based on measurements.
+
+    Reference implementation of size_matrix.score_matrix for a single user.
+    """
     scores = {}
     
     for size, ranges in size_chart.items():
@@ -256,49 +399,3 @@ def get_size_note(size: str, recommended: str) -> str:
             return "Có thể hơi rộng, phù hợp nếu thích mặc thoải mái"
     except ValueError:
         return ""
-
-
-async def generate_size_tips(
-    recommended_size: str,
-    measurements: dict,
-    product_type: str,
-    fit_preference: str,
-) -> list[str]:
-    """Generate personalized tips using Gemini."""
-    if not client:
-        return [
-            f"Size {recommended_size} được gợi ý dựa trên số đo của bạn",
-            "Nếu bạn thích mặc rộng hơn, hãy chọn size lớn hơn 1 bậc",
-        ]
-
-    try:
-        prompt = f"""Dựa vào thông tin sau, hãy đưa ra 2-3 lời khuyên ngắn gọn về việc chọn size:
-
-- Size được gợi ý: {recommended_size}
-- Loại sản phẩm: {product_type}
-- Sở thích fit: {fit_preference}
-- Chiều cao: {measurements.get('height', 'N/A')} cm
-- Cân nặng: {measurements.get('weight', 'N/A')} kg
-
-Trả lời bằng tiếng Việt, mỗi lời khuyên 1 dòng, không đánh số."""
-
-        response = await client.aio.models.generate_content(
-            model=settings.gemini_model,
-            contents=[types.Content(role="user", parts=[types.Part(text=prompt)])],
-            config=types.GenerateContentConfig(
-                temperature=0.5,
-                max_output_tokens=256,
-            ),
-        )
-
-        if response.text:
-            tips = [tip.strip() for tip in response.text.strip().split("\n") if tip.strip()]
-            return tips[:3]  # Max 3 tips
-
-    except Exception as e:
-        logger.warning("Failed to generate tips", error=str(e))
-
-    return [
-        f"Size {recommended_size} được gợi ý dựa trên số đo của bạn",
-        "Nếu bạn thích mặc rộng hơn, hãy chọn size lớn hơn 1 bậc",
-    ]
@@ -0,0 +1,270 @@
+"""
+Size Tips
+Gemini-written size tips, cached per bucket of the inputs they depend on
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Optional
+
+import structlog
+from google.genai import types
+
+from app.config import get_settings
+from app.services import llm
+from app.services.cache import TwoTierCache, get_redis
+from app.services.singleflight import SingleFlight
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+# Bump when TIPS_PROMPT changes so old tips are not served
+TIPS_PROMPT_VERSION = "v1"
+
+TIPS_PROMPT = """Dựa vào thông tin sau, hãy đưa ra 2-3 lời khuyên ngắn gọn về việc chọn size:
+
+- Size được gợi ý: {recommended_size}
+- Loại sản phẩm: {product_type}
+- Sở thích fit: {fit_preference}
+- Chiều cao: {height} cm
+- Cân nặng: {weight} kg
+
+Trả lời bằng tiếng Việt, mỗi lời khuyên 1 dòng, không đánh số."""
+
+tips_cache = TwoTierCache(
+    "ai:tips",
+    ttl=settings.size_tips_cache_ttl,
+    max_bytes=settings.size_tips_cache_max_bytes,
+)
+tips_flight = SingleFlight()
+
+# Tips still being generated after the deadline, kept referenced until done
+_background_tasks: set[asyncio.Task] = set()
+
+
+def bucket(value: float | None, width: int) -> str:
+    """Quantize a measurement: 172.4 with width 5 -> '170-175', None -> 'N/A'."""
+    if value is None:
+        return "N/A"
+    low = int(value // width) * width
+    return f"{low}-{low + width}"
+
+
+def tips_cache_key(
+    recommended_size: str,
+    product_type: str,
+    fit_preference: str,
+    height: float | None,
+    weight: float | None,
+) -> str:
+    """Cache key over exactly the inputs of TIPS_PROMPT."""
+    return ":".join([
+        settings.gemini_model,
+        TIPS_PROMPT_VERSION,
+        product_type,
+        fit_preference,
+        recommended_size,
+        bucket(height, settings.size_tips_height_bucket),
+        bucket(weight, settings.size_tips_weight_bucket),
+    ])
+
+
+def fallback_tips(recommended_size: str) -> list[str]:
+    """Static tips used when Gemini is unavailable."""
+    return [
+        f"Size {recommended_size} được gợi ý dựa trên số đo của bạn",
+        "Nếu bạn thích mặc rộng hơn, hãy chọn size lớn hơn 1 bậc",
+    ]
+
+
+async def generate_size_tips(
+    recommended_size: str,
+    measurements: dict,
+    product_type: str,
+    fit_preference: str,
+) -> list[str]:
+    """
+    Generate personalized tips using Gemini.
+
+    Tips are cached per (size, product type, fit preference, height bucket,
+    weight bucket); concurrent misses for one key share a single call.
+    """
+    tips = await get_cached_tips(recommended_size, measurements, product_type, fit_preference)
+    if tips is None and llm.client:
+        key = tips_cache_key(
+            recommended_size,
+            product_type,
+            fit_preference,
+            measurements.get("height"),
+            measurements.get("weight"),
+        )
+        tips = await tips_flight.do(
+            key,
+            lambda: _generate_and_cache(key, recommended_size, measurements, product_type, fit_preference),
+        )
+
+    return tips or fallback_tips(recommended_size)
+
+
+async def generate_size_tips_within(
+    recommended_size: str,
+    measurements: dict,
+    product_type: str,
+    fit_preference: str,
+    deadline: float,
+) -> dict:
+    """
+    Tips within a deadline (seconds).
+
+    When Gemini is slower than the deadline, fallback tips are returned
+    with tips_status "pending" and a tips_id. Generation continues in the
+    background and its outcome is stored under that id for
+    load_tips_status.
+
+    Returns:
+        {"tips", "tips_status": "completed" | "pending", "tips_id"}
+    """
+    tips = await get_cached_tips(recommended_size, measurements, product_type, fit_preference)
+    if tips is not None or not llm.client:
+        return {"tips": tips or fallback_tips(recommended_size), "tips_status": "completed", "tips_id": None}
+
+    key = tips_cache_key(
+        recommended_size,
+        product_type,
+        fit_preference,
+        measurements.get("height"),
+        measurements.get("weight"),
+    )
+    tips_id = tips_job_id(key)
+    task = asyncio.ensure_future(
+        _generate_tracked(tips_id, key, recommended_size, measurements, product_type, fit_preference)
+    )
+
+    try:
+        tips = await asyncio.wait_for(asyncio.shield(task), deadline)
+    except asyncio.TimeoutError:
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        await _save_tips_status(tips_id, {"status": "pending"}, only_new=True)
+        logger.info("Size tips deadline exceeded, enriching in background", tips_id=tips_id)
+        return {"tips": fallback_tips(recommended_size), "tips_status": "pending", "tips_id": tips_id}
+
+    return {"tips": tips or fallback_tips(recommended_size), "tips_status": "completed", "tips_id": None}
+
+
+def tips_job_id(key: str) -> str:
+    """Public id of a tips generation, derived from its cache key."""
+    return hashlib.sha256(key.encode()).hexdigest()[:24]
+
+
+def _tips_status_key(tips_id: str) -> str:
+    return f"ai:tips:job:{tips_id}"
+
+
+async def _generate_tracked(
+    tips_id: str,
+    key: str,
+    recommended_size: str,
+    measurements: dict,
+    product_type: str,
+    fit_preference: str,
+) -> Optional[list[str]]:
+    """Generate tips through the singleflight and record the outcome under tips_id."""
+    try:
+        tips = await tips_flight.do(
+            key,
+            lambda: _generate_and_cache(key, recommended_size, measurements, product_type, fit_preference),
+        )
+    except Exception as e:
+        logger.warning("Size tips generation failed", tips_id=tips_id, error=str(e))
+        tips = None
+
+    if tips:
+        status = {"status": "completed", "tips": tips}
+    else:
+        status = {"status": "failed", "tips": fallback_tips(recommended_size)}
+    await _save_tips_status(tips_id, status)
+    return tips
+
+
+async def _save_tips_status(tips_id: str, status: dict, only_new: bool = False):
+    """
+    Store a tips job record.
+
+    "pending" is written with only_new so it never overwrites a result the
+    background task stored first.
+    """
+    try:
+        r = await get_redis()
+        await r.set(
+            _tips_status_key(tips_id),
+            json.dumps(status, ensure_ascii=False),
+            ex=settings.size_tips_job_ttl,
+            nx=only_new,
+        )
+    except Exception as e:
+        logger.warning("Failed to store size tips status", tips_id=tips_id, error=str(e))
+
+
+async def load_tips_status(tips_id: str) -> Optional[dict]:
+    """Tips job record ({"status", "tips"?}), None if unknown or expired."""
+    r = await get_redis()
+    raw = await r.get(_tips_status_key(tips_id))
+    return json.loads(raw) if raw else None
+
+
+async def get_cached_tips(
+    recommended_size: str,
+    measurements: dict,
+    product_type: str,
+    fit_preference: str,
+) -> Optional[list[str]]:
+    """Cached tips for these inputs, None on a miss."""
+    key = tips_cache_key(
+        recommended_size,
+        product_type,
+        fit_preference,
+        measurements.get("height"),
+        measurements.get("weight"),
+    )
+    return await tips_cache.get(key)
+
+
+async def _generate_and_cache(
+    key: str,
+    recommended_size: str,
+    measurements: dict,
+    product_type: str,
+    fit_preference: str,
+) -> Optional[list[str]]:
+    """Call Gemini for tips and cache them; None if the call failed."""
+    # Describe the bucket, not the exact values, since every user in it shares the tips
+    prompt = TIPS_PROMPT.format(
+        recommended_size=recommended_size,
+        product_type=product_type,
+        fit_preference=fit_preference,
+        height=bucket(measurements.get("height"), settings.size_tips_height_bucket),
+        weight=bucket(measurements.get("weight"), settings.size_tips_weight_bucket),
+    )
+
+    try:
+        response = await llm.generate(
+            settings.gemini_model,
+            [types.Content(role="user", parts=[types.Part(text=prompt)])],
+            types.GenerateContentConfig(
+                temperature=0.5,
+                max_output_tokens=256,
+            ),
+        )
+    except Exception as e:
+        logger.warning("Failed to generate tips", error=str(e))
+        return None
+
+    if not response.text:
+        return None
+
+    tips = [tip.strip() for tip in response.text.strip().split("\n") if tip.strip()][:3]  # Max 3 tips
+    if tips:
+        await tips_cache.set(key, tips)
+    return tips or None
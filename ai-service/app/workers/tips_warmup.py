@@ -0,0 +1,98 @@
+"""
+Size Tips Warm-up
+Pre-generates tips for the common height/weight bucket grid
+
+Usage (from ai-service/, with GEMINI_API_KEY and REDIS_URL set):
+    python -m app.workers.tips_warmup
+    python -m app.workers.tips_warmup --product-types ao_thun,quan --dry-run
+"""
+
+import argparse
+import asyncio
+
+import structlog
+
+from app.config import get_settings
+from app.services import llm
+from app.workers.size_rec import SIZE_CHARTS, estimate_from_basic
+from app.workers.size_tips import get_cached_tips, generate_size_tips
+
+settings = get_settings()
+logger = structlog.get_logger()
+
+# Bucket grid covering most shoppers (lower bounds, cm / kg)
+WARM_HEIGHTS = range(150, 195, settings.size_tips_height_bucket)
+WARM_WEIGHTS = range(45, 100, settings.size_tips_weight_bucket)
+FIT_PREFERENCES = ("slim", "regular", "loose")
+
+# Sizes recommended around a height/weight estimate
+SIZE_NEIGHBOURS = 1
+
+
+def warm_grid(product_types: list[str]) -> list[tuple[str, dict, str, str]]:
+    """
+    (recommended_size, measurements, product_type, fit_preference) combinations to warm.
+
+    Only sizes within SIZE_NEIGHBOURS of the height/weight estimate are
+    included; a 180 cm, 90 kg shopper is never recommended an S.
+    """
+    grid = []
+    for product_type in product_types:
+        sizes = list(SIZE_CHARTS[product_type])
+        for height in WARM_HEIGHTS:
+            for weight in WARM_WEIGHTS:
+                # Bucket midpoints, so the key matches every value in the bucket
+                measurements = {
+                    "height": height + settings.size_tips_height_bucket / 2,
+                    "weight": weight + settings.size_tips_weight_bucket / 2,
+                }
+                estimate = estimate_from_basic(measurements["height"], measurements["weight"])
+                idx = sizes.index(estimate) if estimate in sizes else len(sizes) // 2
+                for size in sizes[max(idx - SIZE_NEIGHBOURS, 0):idx + SIZE_NEIGHBOURS + 1]:
+                    for fit_preference in FIT_PREFERENCES:
+                        grid.append((size, measurements, product_type, fit_preference))
+    return grid
+
+
+async def warm_size_tips(product_types: list[str] | None = None, dry_run: bool = False) -> dict:
+    """
+    Generate and cache tips for every grid combination not cached yet.
+
+    Returns:
+        Counts of grid entries, already cached and sent to Gemini
+    """
+    grid = warm_grid(product_types or list(SIZE_CHARTS))
+    semaphore = asyncio.Semaphore(settings.size_tips_warm_concurrency)
+    stats = {"grid": len(grid), "cached": 0, "requested": 0}
+
+    async def warm(size: str, measurements: dict, product_type: str, fit_preference: str):
+        if await get_cached_tips(size, measurements, product_type, fit_preference) is not None:
+            stats["cached"] += 1
+            return
+        if dry_run:
+            return
+        async with semaphore:
+            await generate_size_tips(size, measurements, product_type, fit_preference)
+            stats["requested"] += 1
+
+    await asyncio.gather(*[warm(*entry) for entry in grid])
+
+    logger.info("Size tips warm-up completed", **stats)
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--product-types", help="Comma-separated product types (default: all)")
+    parser.add_argument("--dry-run", action="store_true", help="Only count missing entries")
+    args = parser.parse_args()
+
+    if not llm.client and not args.dry_run:
+        raise SystemExit("GEMINI_API_KEY is not configured")
+
+    product_types = args.product_types.split(",") if args.product_types else None
+    print(await warm_size_tips(product_types, dry_run=args.dry_run))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -8,27 +8,40 @@ This module uses Gemini's vision capabilities to:
 4. Generate detailed fit description
 """
 
+import asyncio
 import structlog
 import json
-import base64
+import hashlib
 import tempfile
 import os
-from typing import Optional
-from PIL import Image
-import io
+from typing import Awaitable, Callable, Optional
+from urllib.parse import quote
 
-from google import genai
 from google.genai import types
 
 from app.config import get_settings
+from app.services import llm
+from app.services.cache import TwoTierCache, get_redis
+from app.services.jobs import save_job
+from app.services.product_images import load_product_image
+from app.workers.body_cache import find_body_analysis, hash_image, store_body_analysis
+from app.workers.fit_engine import predict_fit_local
+from app.workers.json_stream import JsonStringFieldStream
+from app.workers.overlay import render_overlay
+from app.workers.pipeline import Stage, StageFailed, run_pipeline
+from app.workers.preview import create_previews
+from app.workers.preprocess import PreparedImage, preprocess_image
+from app.workers.size_rec import chart_provider
 
 settings = get_settings()
 logger = structlog.get_logger()
 
-# Initialize Gemini client
-client = None
-if settings.gemini_api_key:
-    client = genai.Client(api_key=settings.gemini_api_key)
+# Garment analyses keyed by image hash, prompt version and model
+garment_cache = TwoTierCache(
+    "ai:garment",
+    ttl=settings.garment_cache_ttl,
+    max_bytes=settings.garment_cache_max_bytes,
+)
 
 
 # ==================== Prompts ====================
@@ -63,23 +76,36 @@ Thông tin sản phẩm:
 - Chất liệu: {material}
 
 Trả về JSON:
-{
+{{
     "recommended_size": "S" | "M" | "L" | "XL" | etc,
     "fit_confidence": 0.0-1.0,
     "fit_style": "ôm body" | "vừa vặn" | "rộng rãi",
     "description": "Mô tả chi tiết 2-3 câu về cách sản phẩm sẽ fit trên người dùng bằng tiếng Việt",
-    "fit_areas": {
+    "fit_areas": {{
         "shoulder": "vừa" | "hơi chật" | "hơi rộng",
         "chest": "vừa" | "hơi chật" | "hơi rộng",
         "length": "vừa" | "hơi ngắn" | "hơi dài"
-    },
+    }},
     "styling_tips": ["tip 1", "tip 2", "tip 3"],
     "warnings": ["cảnh báo nếu có"]
-}
+}}
 
 CHỈ trả về JSON, không có text khác.
 """
 
+FIT_DESCRIPTION_PROMPT = """
+Viết mô tả 2-3 câu bằng tiếng Việt về cách sản phẩm sẽ fit trên người dùng.
+
+Thông tin vóc dáng:
+{body_analysis}
+
+Sản phẩm: {product_name} ({product_type}, chất liệu {material})
+Size được gợi ý: {recommended_size} ({fit_style})
+Độ vừa từng phần: {fit_areas}
+
+CHỈ trả về đoạn mô tả, không có tiêu đề hay định dạng khác.
+"""
+
 GARMENT_ANALYSIS_PROMPT = """
 Phân tích hình ảnh sản phẩm quần áo này và trả về JSON:
 
@@ -95,58 +121,120 @@ Phân tích hình ảnh sản phẩm quần áo này và trả về JSON:
 CHỈ trả về JSON, không có text khác.
 """
 
+FUSED_TRYON_PROMPT = """
+Bạn là chuyên gia thời trang. Ảnh thứ nhất là người dùng, ảnh thứ hai là sản phẩm.
+Hãy phân tích vóc dáng người dùng, phân tích sản phẩm và dự đoán cách sản phẩm sẽ fit.
+
+Thông tin sản phẩm:
+- Loại: {product_type}
+- Tên: {product_name}
+- Size có sẵn: {available_sizes}
+- Chất liệu: {material}
+
+Các trường mô tả (notes, description, styling_tips, warnings) viết bằng tiếng Việt.
+"""
+
+# Bump when GARMENT_ANALYSIS_PROMPT changes so cached analyses are not reused
+GARMENT_PROMPT_VERSION = "v1"
+
+
+def _string_schema(enum: list[str] | None = None) -> types.Schema:
+    return types.Schema(type=types.Type.STRING, enum=enum)
+
+
+def _list_schema() -> types.Schema:
+    return types.Schema(type=types.Type.ARRAY, items=_string_schema())
+
+
+def _object_schema(properties: dict[str, types.Schema]) -> types.Schema:
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties=properties,
+        required=list(properties),
+        property_ordering=list(properties),
+    )
+
+
+def fused_response_schema(available_sizes: list[str]) -> types.Schema:
+    """Structured-output schema combining body, garment and fit results."""
+    fit_area = ["vừa", "hơi chật", "hơi rộng"]
+    return _object_schema({
+        "body_analysis": _object_schema({
+            "body_type": _string_schema(["slim", "average", "athletic", "curvy", "plus_size"]),
+            "estimated_height_range": _string_schema(
+                ["short (< 160cm)", "average (160-175cm)", "tall (> 175cm)"]
+            ),
+            "shoulder_width": _string_schema(["narrow", "medium", "broad"]),
+            "body_proportions": _object_schema({
+                "upper_body": _string_schema(["shorter", "proportional", "longer"]),
+                "waist_definition": _string_schema(["defined", "moderate", "straight"]),
+            }),
+            "notes": _string_schema(),
+        }),
+        "garment_analysis": _object_schema({
+            "garment_type": _string_schema(),
+            "style": _string_schema(["casual", "formal", "sporty", "streetwear"]),
+            "fit_type": _string_schema(["slim fit", "regular fit", "relaxed fit", "oversized"]),
+            "notable_features": _list_schema(),
+            "recommended_body_types": _list_schema(),
+            "colors": _list_schema(),
+        }),
+        "fit_prediction": _object_schema({
+            "recommended_size": _string_schema(available_sizes),
+            "fit_confidence": types.Schema(type=types.Type.NUMBER, minimum=0.0, maximum=1.0),
+            "fit_style": _string_schema(["ôm body", "vừa vặn", "rộng rãi"]),
+            "description": _string_schema(),
+            "fit_areas": _object_schema({
+                "shoulder": _string_schema(fit_area),
+                "chest": _string_schema(fit_area),
+                "length": _string_schema(["vừa", "hơi ngắn", "hơi dài"]),
+            }),
+            "styling_tips": _list_schema(),
+            "warnings": _list_schema(),
+        }),
+    })
+
 
 # ==================== Core Functions ====================
 
 
-async def analyze_body_from_image(image_data: bytes) -> dict:
+async def analyze_body_from_image(image_data: bytes, mime_type: str = "image/jpeg") -> dict:
     """
     Use Gemini Vision to analyze body type from user photo.
     
     Args:
-        image_data: Raw image bytes
+        image_data: Image bytes, ideally from preprocess_image
+        mime_type: MIME type of image_data
         
     Returns:
         dict with body analysis
     """
-    if not client:
+    if not llm.client:
         return {"error": "Gemini client not configured"}
     
     try:
-        # Convert to base64
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
-        
-        response = await client.aio.models.generate_content(
-            model=settings.gemini_vision_model,
-            contents=[
+        response = await llm.generate(
+            settings.gemini_vision_model,
+            [
                 types.Content(
                     parts=[
                         types.Part(text=BODY_ANALYSIS_PROMPT),
                         types.Part(
                             inline_data=types.Blob(
-                                mime_type="image/jpeg",
+                                mime_type=mime_type,
                                 data=image_data
                             )
                         )
                     ]
                 )
             ],
-            config=types.GenerateContentConfig(
+            types.GenerateContentConfig(
                 temperature=0.3,
                 max_output_tokens=1024,
             )
         )
         
-        result_text = response.text.strip()
-        
-        # Clean JSON from markdown code blocks if present
-        if result_text.startswith("```"):
-            result_text = result_text.split("```")[1]
-            if result_text.startswith("json"):
-                result_text = result_text[4:]
-        result_text = result_text.strip()
-        
-        return json.loads(result_text)
+        return llm.extract_json(response.text)
         
     except json.JSONDecodeError as e:
         logger.error("Failed to parse body analysis JSON", error=str(e))
@@ -161,57 +249,112 @@ async def analyze_body_from_image(image_data: bytes) -> dict:
         return {"error": str(e)}
 
 
-async def analyze_garment(image_data: bytes) -> dict:
+async def analyze_garment(image_data: bytes, product_id: str | None = None) -> dict:
     """
     Use Gemini Vision to analyze garment characteristics.
+    
+    Results are cached by image content, so the same product photo is only
+    sent to Gemini once per TTL. When product_id is given, the cache entry
+    is indexed under the product for invalidation.
     """
-    if not client:
+    if not llm.client:
         return {"error": "Gemini client not configured"}
+    if not image_data:
+        return {"error": "No product image"}
+    
+    cache_key = garment_cache_key(image_data)
+    cached = await garment_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Garment analysis cache hit", product_id=product_id)
+        return cached
     
     try:
-        response = await client.aio.models.generate_content(
-            model=settings.gemini_vision_model,
-            contents=[
+        prepared = await preprocess_image(image_data)
+        
+        response = await llm.generate(
+            settings.gemini_vision_model,
+            [
                 types.Content(
                     parts=[
                         types.Part(text=GARMENT_ANALYSIS_PROMPT),
                         types.Part(
                             inline_data=types.Blob(
-                                mime_type="image/jpeg",
-                                data=image_data
+                                mime_type=prepared.mime_type,
+                                data=prepared.data
                             )
                         )
                     ]
                 )
             ],
-            config=types.GenerateContentConfig(
+            types.GenerateContentConfig(
                 temperature=0.3,
                 max_output_tokens=1024,
             )
         )
         
-        result_text = response.text.strip()
-        if result_text.startswith("```"):
-            result_text = result_text.split("```")[1]
-            if result_text.startswith("json"):
-                result_text = result_text[4:]
-        result_text = result_text.strip()
-        
-        return json.loads(result_text)
+        garment_analysis = llm.extract_json(response.text)
         
     except Exception as e:
         logger.error("Garment analysis failed", error=str(e))
         return {"error": str(e)}
+    
+    await garment_cache.set(cache_key, garment_analysis)
+    if product_id:
+        await _index_garment_cache_key(product_id, cache_key)
+    
+    return garment_analysis
+
+
+def garment_cache_key(image_data: bytes) -> str:
+    """Build the content-addressed cache key for a product image."""
+    digest = hashlib.sha256(image_data).hexdigest()
+    return f"{settings.gemini_vision_model}:{GARMENT_PROMPT_VERSION}:{digest}"
+
+
+async def _index_garment_cache_key(product_id: str, cache_key: str):
+    """Remember which cache entries belong to a product."""
+    index_key = f"ai:garment:product:{product_id}"
+    try:
+        r = await get_redis()
+        await r.sadd(index_key, cache_key)
+        await r.expire(index_key, settings.garment_cache_ttl)
+    except Exception as e:
+        logger.warning("Failed to index garment cache key", product_id=product_id, error=str(e))
+
+
+async def invalidate_garment_cache(product_id: str) -> int:
+    """
+    Drop cached garment analyses of a product, e.g. after its image was replaced.
+    
+    Returns:
+        Number of cache entries removed
+    """
+    index_key = f"ai:garment:product:{product_id}"
+    r = await get_redis()
+    cache_keys = [key.decode() for key in await r.smembers(index_key)]
+    
+    await garment_cache.delete(*cache_keys)
+    await r.delete(index_key)
+    
+    logger.info("Garment cache invalidated", product_id=product_id, entries=len(cache_keys))
+    return len(cache_keys)
 
 
 async def predict_fit(
     body_analysis: dict,
     product_info: dict,
+    on_description: Callable[[str], Awaitable[None]] | None = None,
 ) -> dict:
     """
     Use Gemini to predict how a garment will fit based on body analysis.
+    
+    Args:
+        body_analysis: Result of analyze_body_from_image
+        product_info: Product metadata (name, type, sizes, etc.)
+        on_description: If given, the response is streamed and this callback
+            receives the "description" text as it is generated
     """
-    if not client:
+    if not llm.client:
         return {"error": "Gemini client not configured"}
     
     try:
@@ -222,24 +365,26 @@ async def predict_fit(
             available_sizes=", ".join(product_info.get("sizes", ["S", "M", "L", "XL"])),
             material=product_info.get("material", "cotton"),
         )
-        
-        response = await client.aio.models.generate_content(
-            model=settings.gemini_model,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.3,
-                max_output_tokens=1024,
-            )
+        config = types.GenerateContentConfig(
+            temperature=0.3,
+            max_output_tokens=1024,
         )
         
-        result_text = response.text.strip()
-        if result_text.startswith("```"):
-            result_text = result_text.split("```")[1]
-            if result_text.startswith("json"):
-                result_text = result_text[4:]
-        result_text = result_text.strip()
+        if on_description:
+            parser = JsonStringFieldStream("description")
+            chunks = []
+            async for chunk in llm.generate_stream(settings.gemini_model, prompt, config):
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    delta = parser.feed(chunk.text)
+                    if delta:
+                        await on_description(delta)
+            result_text = "".join(chunks)
+        else:
+            response = await llm.generate(settings.gemini_model, prompt, config)
+            result_text = response.text
         
-        return json.loads(result_text)
+        return llm.extract_json(result_text)
         
     except Exception as e:
         logger.error("Fit prediction failed", error=str(e))
@@ -251,53 +396,126 @@ async def predict_fit(
         }
 
 
-async def create_simple_overlay(
-    user_image_data: bytes,
-    product_image_data: bytes,
-    body_analysis: dict,
-) -> Optional[bytes]:
+async def analyze_tryon_fused(
+    user_image: PreparedImage,
+    product_image: PreparedImage,
+    product_info: dict,
+) -> dict:
     """
-    Create a simple visual overlay of the product on the user.
-    This is NOT AI-generated, just basic image composition.
+    Analyze body, garment and fit in a single Gemini call.
+    
+    Both images are sent once, and structured output guarantees the
+    combined JSON shape.
+    
+    Returns:
+        dict with body_analysis, garment_analysis and fit_prediction
     """
+    if not llm.client:
+        return {"error": "Gemini client not configured"}
+    
+    available_sizes = product_info.get("sizes") or ["S", "M", "L", "XL"]
     try:
-        # Open images
-        user_img = Image.open(io.BytesIO(user_image_data)).convert("RGBA")
-        product_img = Image.open(io.BytesIO(product_image_data)).convert("RGBA")
+        prompt = FUSED_TRYON_PROMPT.format(
+            product_type=product_info.get("type", "áo"),
+            product_name=product_info.get("name", "Sản phẩm"),
+            available_sizes=", ".join(available_sizes),
+            material=product_info.get("material", "cotton"),
+        )
         
-        # Get dimensions
-        user_w, user_h = user_img.size
-        prod_w, prod_h = product_img.size
+        response = await llm.generate(
+            settings.gemini_vision_model,
+            [
+                types.Content(
+                    parts=[
+                        types.Part(text=prompt),
+                        types.Part(
+                            inline_data=types.Blob(
+                                mime_type=user_image.mime_type,
+                                data=user_image.data
+                            )
+                        ),
+                        types.Part(
+                            inline_data=types.Blob(
+                                mime_type=product_image.mime_type,
+                                data=product_image.data
+                            )
+                        ),
+                    ]
+                )
+            ],
+            types.GenerateContentConfig(
+                temperature=0.3,
+                max_output_tokens=2048,
+                response_mime_type="application/json",
+                response_schema=fused_response_schema(available_sizes),
+            )
+        )
         
-        # Calculate product placement (center-top of user image)
-        # Scale product to ~40% of user image width
-        scale = (user_w * 0.4) / prod_w
-        new_prod_w = int(prod_w * scale)
-        new_prod_h = int(prod_h * scale)
+        return llm.extract_json(response.text)
         
-        product_resized = product_img.resize(
-            (new_prod_w, new_prod_h),
-            Image.Resampling.LANCZOS
+    except Exception as e:
+        logger.error("Fused try-on analysis failed", error=str(e))
+        return {"error": str(e)}
+
+
+async def describe_fit(
+    body_analysis: dict,
+    product_info: dict,
+    fit_prediction: dict,
+    on_description: Callable[[str], Awaitable[None]] | None = None,
+) -> str | None:
+    """
+    Use Gemini only for the prose description of a locally predicted fit.
+    
+    Returns:
+        The description, or None if Gemini is unavailable or failed
+    """
+    if not llm.client:
+        return None
+    
+    try:
+        prompt = FIT_DESCRIPTION_PROMPT.format(
+            body_analysis=json.dumps(body_analysis, ensure_ascii=False),
+            product_name=product_info.get("name", "Sản phẩm"),
+            product_type=product_info.get("type", "áo"),
+            material=product_info.get("material", "cotton"),
+            recommended_size=fit_prediction["recommended_size"],
+            fit_style=fit_prediction["fit_style"],
+            fit_areas=json.dumps(fit_prediction["fit_areas"], ensure_ascii=False),
+        )
+        config = types.GenerateContentConfig(
+            temperature=0.5,
+            max_output_tokens=256,
         )
         
-        # Position: centered horizontally, ~20% from top
-        x = (user_w - new_prod_w) // 2
-        y = int(user_h * 0.2)
+        chunks = []
+        async for chunk in llm.generate_stream(settings.gemini_model, prompt, config):
+            if chunk.text:
+                chunks.append(chunk.text)
+                if on_description:
+                    await on_description(chunk.text)
         
-        # Create composite
-        result = user_img.copy()
+        return "".join(chunks).strip() or None
         
-        # Add semi-transparent product overlay
-        product_resized.putalpha(
-            product_resized.getchannel('A').point(lambda x: int(x * 0.7))
+    except Exception as e:
+        logger.warning("Fit description failed", error=str(e))
+        return None
+
+
+async def create_simple_overlay(
+    user_image_data: bytes | memoryview,
+    product_image_data: bytes,
+    body_analysis: dict,
+    product_id: str | None = None,
+) -> Optional[bytes]:
+    """
+    Create a simple visual overlay of the product on the user.
+    This is NOT AI-generated, just basic image composition.
+    """
+    try:
+        return await asyncio.to_thread(
+            render_overlay, user_image_data, product_image_data, product_id
         )
-        result.paste(product_resized, (x, y), product_resized)
-        
-        # Convert to bytes
-        output = io.BytesIO()
-        result.convert("RGB").save(output, format="JPEG", quality=85)
-        return output.getvalue()
-        
     except Exception as e:
         logger.error("Overlay creation failed", error=str(e))
         return None
@@ -306,11 +524,54 @@ async def create_simple_overlay(
 # ==================== Main Process Function ====================
 
 
+def preview_links(job_id: str, previews: dict) -> dict:
+    """Preview URL of the recommended size and of every rendered size."""
+    url = f"/ai/try-on/{job_id}/preview"
+    return {
+        "overlay_url": url,
+        "overlay_urls": {size: f"{url}?size={quote(size)}" for size in previews.get("sizes", {})},
+    }
+
+
+TryOnEventCallback = Callable[[str, dict], Awaitable[None]]
+
+
+class DescriptionStream:
+    """
+    Forwards fit description deltas as fit_description events.
+
+    Remembers whether any delta went out, so a fallback description can
+    first tell the client to discard them ({"reset": true}).
+    """
+
+    def __init__(self, on_event: TryOnEventCallback):
+        self.on_event = on_event
+        self.sent = False
+
+    async def __call__(self, delta: str):
+        self.sent = True
+        await self.on_event("fit_description", {"delta": delta})
+
+    async def replace(self, description: str):
+        """Send description as the whole text, dropping earlier deltas."""
+        if self.sent:
+            await self.on_event("fit_description", {"reset": True})
+        await self(description)
+
+# Pipeline stages whose results are forwarded to on_event
+STREAMED_STAGES = ("body_analysis", "garment_analysis", "fit_prediction", "previews")
+
+# Result sections returned by the fused single-call mode
+FUSED_SECTIONS = ("body_analysis", "garment_analysis", "fit_prediction")
+
+
 async def process_tryon(
     job_id: str,
-    user_image_data: bytes,
+    user_image_data: bytes | memoryview,
     product_image_data: bytes,
     product_info: dict,
+    session_id: str | None = None,
+    on_event: TryOnEventCallback | None = None,
 ) -> dict:
     """
     Process a virtual try-on request using Gemini Vision.
@@ -320,44 +581,151 @@ async def process_tryon(
         user_image_data: Raw bytes of user photo
         product_image_data: Raw bytes of product image
         product_info: Product metadata (name, type, sizes, etc.)
+        session_id: User/session scope for reusing body analyses of similar photos
+        on_event: Optional callback receiving progress events as stages complete
+            (body_analysis, garment_analysis, fit_description, fit_prediction, previews)
         
     Returns:
         dict with analysis results and predictions
     """
     logger.info("Processing try-on with Gemini Vision", job_id=job_id)
     
-    try:
-        # Step 1: Analyze user's body
-        logger.info("Analyzing body...", job_id=job_id)
-        body_analysis = await analyze_body_from_image(user_image_data)
+    async def preprocess_stage() -> PreparedImage:
+        return await preprocess_image(user_image_data)
+    
+    async def body_stage(user_image: PreparedImage) -> dict:
+        # Repeat try-ons with the same selfie skip the vision call
+        image_hash = await hash_image(user_image.data) if session_id else None
+        if image_hash is not None:
+            cached = await find_body_analysis(session_id, image_hash)
+            if cached:
+                return cached
         
+        body_analysis = await analyze_body_from_image(user_image.data, user_image.mime_type)
         if "error" in body_analysis:
-            return {
-                "status": "failed",
-                "error": body_analysis["error"],
-            }
+            raise StageFailed(body_analysis["error"])
         
-        # Step 2: Analyze garment (optional, for better prediction)
-        logger.info("Analyzing garment...", job_id=job_id)
-        garment_analysis = await analyze_garment(product_image_data)
+        if image_hash is not None:
+            await store_body_analysis(session_id, image_hash, body_analysis)
+        return body_analysis
+    
+    async def garment_stage() -> dict:
+        # Optional, for better prediction
+        return await analyze_garment(product_image_data, product_info.get("id"))
+    
+    async def fit_stage(body_analysis: dict) -> dict:
+        description_stream = DescriptionStream(on_event) if on_event else None
         
-        # Step 3: Predict fit
-        logger.info("Predicting fit...", job_id=job_id)
-        fit_prediction = await predict_fit(body_analysis, product_info)
+        if settings.tryon_fit_mode == "llm":
+            return await predict_fit(body_analysis, product_info, description_stream)
         
-        # Step 4: Create simple visual overlay (optional)
-        # overlay_data = await create_simple_overlay(
-        #     user_image_data, product_image_data, body_analysis
-        # )
+        # Size and fit areas are scored locally; the LLM only writes optional prose
+        # The product's own sizeGuide when it has one; it may measure any subset of metrics
+        size_chart = await chart_provider.get(product_info.get("id"), product_info.get("type", "ao_thun"))
+        fit_prediction = predict_fit_local(body_analysis, product_info, size_chart.ranges())
+        description = None
+        if settings.tryon_fit_prose:
+            description = await describe_fit(body_analysis, product_info, fit_prediction, description_stream)
+        if description:
+            fit_prediction["description"] = description
+        elif description_stream:
+            # Replaces any half-written LLM prose with the local description
+            await description_stream.replace(fit_prediction["description"])
+        return fit_prediction
+    
+    async def on_stage_complete(name: str, result):
+        if name == "garment_analysis" and "error" in result:
+            return
+        if name == "previews":
+            result = preview_links(job_id, result)
+        if name in STREAMED_STAGES:
+            await on_event(name, result)
+    
+    async def preview_stage(
+        user_image: PreparedImage,
+        fit_prediction: dict | None = None,
+        fused_analysis: dict | None = None,
+    ) -> dict:
+        # Simple visual overlays of the recommended size and its neighbours, NOT AI-generated
+        fit = fit_prediction or fused_analysis["fit_prediction"]
+        return await create_previews(
+            user_image.data,
+            product_image_data,
+            product_info.get("sizes") or [],
+            fit["recommended_size"],
+            product_info.get("id"),
+        )
+    
+    async def product_image_stage() -> PreparedImage:
+        return await preprocess_image(product_image_data)
+    
+    async def fused_stage(user_image: PreparedImage, product_image: PreparedImage) -> dict:
+        fused = await analyze_tryon_fused(user_image, product_image, product_info)
+        if "error" in fused:
+            raise StageFailed(fused["error"])
+        if on_event:
+            for name in FUSED_SECTIONS:
+                await on_event(name, fused[name])
+        return fused
+    
+    timeout = settings.tryon_stage_timeout
+    fused = settings.tryon_mode == "fused" and bool(product_image_data)
+    if settings.tryon_mode == "fused" and not fused:
+        # The fused prompt needs both photos
+        logger.info("No product image, running staged try-on", job_id=job_id)
+    if fused:
+        # One multimodal call returns all three sections
+        stages = [
+            Stage("user_image", preprocess_stage, timeout=timeout),
+            Stage("product_image", product_image_stage, timeout=timeout),
+            Stage("fused_analysis", fused_stage, deps=("user_image", "product_image"), timeout=timeout),
+        ]
+    else:
+        # Body and garment analysis are independent; fit starts as soon as body is done
+        stages = [
+            Stage("user_image", preprocess_stage, timeout=timeout),
+            Stage("body_analysis", body_stage, deps=("user_image",), timeout=timeout),
+            Stage("fit_prediction", fit_stage, deps=("body_analysis",), timeout=timeout),
+        ]
+        if product_image_data:
+            stages.append(Stage("garment_analysis", garment_stage, timeout=timeout, required=False))
+    if product_image_data:
+        fit_source = "fused_analysis" if fused else "fit_prediction"
+        stages.append(
+            Stage("previews", preview_stage, deps=("user_image", fit_source), timeout=timeout, required=False)
+        )
+    
+    try:
+        run = await run_pipeline(
+            stages,
+            job_id=job_id,
+            on_stage_complete=on_stage_complete if on_event else None,
+        )
+        
+        for name, error in run.errors.items():
+            if next(stage for stage in stages if stage.name == name).required:
+                return {
+                    "status": "failed",
+                    "error": error,
+                    "timings": run.timings,
+                }
+        
+        if fused:
+            run.results.update({name: run.results["fused_analysis"][name] for name in FUSED_SECTIONS})
         
-        logger.info("Try-on analysis completed", job_id=job_id)
+        garment_analysis = run.results.get("garment_analysis")
+        previews = run.results.get("previews")
+        logger.info("Try-on analysis completed", job_id=job_id, timings=run.timings)
         
         return {
             "status": "completed",
-            "body_analysis": body_analysis,
-            "garment_analysis": garment_analysis if "error" not in garment_analysis else None,
-            "fit_prediction": fit_prediction,
-            # "overlay_url": f"/ai/try-on/{job_id}/preview" if overlay_data else None,
+            "body_analysis": run.results["body_analysis"],
+            "garment_analysis": garment_analysis if garment_analysis and "error" not in garment_analysis else None,
+            "fit_prediction": run.results["fit_prediction"],
+            "mode": "fused" if fused else "staged",
+            "timings": run.timings,
+            "previews": previews,
+            **(preview_links(job_id, previews) if previews else {"overlay_url": None, "overlay_urls": {}}),
         }
         
     except Exception as e:
@@ -368,6 +736,54 @@ async def process_tryon(
         }
 
 
+async def run_tryon_job(
+    job_data: dict,
+    user_image_data: bytes | memoryview,
+    product_info: dict,
+    product_image_data: bytes | None = None,
+    on_event: TryOnEventCallback | None = None,
+) -> dict:
+    """
+    Run process_tryon for a job and keep its ai:job record up to date.
+    
+    Shared by the synchronous endpoint and the RabbitMQ consumers. Unless
+    product_image_data is given, the product's main image is loaded; a
+    product without one is analyzed without garment analysis or previews.
+    
+    Returns:
+        The final job record, with the try-on result under "result"
+    """
+    r = await get_redis()
+    job_id = job_data["job_id"]
+    
+    job_data["status"] = "processing"
+    await save_job(r, job_data)
+    
+    if product_image_data is None:
+        product_image_data = await load_product_image(product_info.get("id"))
+    
+    try:
+        result = await process_tryon(
+            job_id=job_id,
+            user_image_data=user_image_data,
+            product_image_data=product_image_data,
+            product_info=product_info,
+            session_id=job_data.get("session_id"),
+            on_event=on_event,
+        )
+    except Exception as e:
+        job_data["status"] = "failed"
+        job_data["error"] = str(e)
+        await save_job(r, job_data)
+        raise
+    
+    job_data["status"] = result.get("status", "completed")
+    job_data["result"] = result
+    await save_job(r, job_data)
+    
+    return job_data
+
+
 # ==================== Legacy function (for compatibility) ====================
 
 
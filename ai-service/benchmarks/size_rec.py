@@ -0,0 +1,379 @@
+"""
+Size Recommendation Benchmark
+Throughput, latency and exact-parity checks of the size scoring path
+
+Synthetic shoppers are drawn from a correlated height/BMI model and
+scored against every product type. Gemini tips and the product database
+are stubbed, so only local work is measured. Every accelerated path is
+compared against its reference implementation and must match exactly:
+
+    scorer   size_matrix.score_matrix / rank_sizes vs calculate_size_scores
+    tables   size_lut tables vs the live scorer (rank_recommendation)
+    helpers  output digests of estimate_from_basic and get_size_note
+
+Usage (from ai-service/):
+    python -m benchmarks.size_rec --population 20000 --output results.json
+    python -m benchmarks.size_rec --baseline results.json   # fail if reference outputs changed
+    python -m benchmarks.size_rec --tables data/size_lut --exhaustive
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import structlog
+
+from app.config import get_settings
+from app.workers import size_rec
+from app.workers.size_charts import ChartEntry, SizeChartProvider
+from app.workers.size_lut import METRIC_BOUNDS, SizeTables, build_table, chart_hash, save_table
+from app.workers.size_matrix import measurements_matrix, rank_sizes
+
+settings = get_settings()
+
+# Share of shoppers that enter whole numbers (the table path)
+WHOLE_NUMBER_SHARE = 0.7
+# Chance that each girth measurement is left empty
+MISSING_SHARE = 0.2
+
+BATCH_PRODUCTS = 24  # products per batch request (a listing page)
+
+
+# ==================== Synthetic Population ====================
+
+
+def make_population(size: int, seed: int) -> list[dict]:
+    """
+    Shoppers with correlated measurements.
+
+    Height ~ N(165, 8) cm and BMI ~ N(22.5, 3); girths follow height and
+    BMI around a 168 cm / BMI 22 reference body, plus individual noise.
+    """
+    rng = random.Random(seed)
+    population = []
+
+    for _ in range(size):
+        height = rng.gauss(165, 8)
+        bmi = rng.gauss(22.5, 3)
+        dh, db = height - 168, bmi - 22
+        person = {
+            "height": height,
+            "weight": bmi * (height / 100) ** 2,
+            "chest": 94 + 0.30 * dh + 1.8 * db + rng.gauss(0, 3),
+            "waist": 78 + 0.25 * dh + 2.5 * db + rng.gauss(0, 3),
+            "hips": 95 + 0.30 * dh + 1.8 * db + rng.gauss(0, 3),
+            "shoulder": 45 + 0.15 * dh + 0.3 * db + rng.gauss(0, 1.2),
+        }
+
+        whole = rng.random() < WHOLE_NUMBER_SHARE
+        for metric, value in person.items():
+            low, high = METRIC_BOUNDS[metric]
+            value = min(max(value, low), high)
+            person[metric] = float(round(value)) if whole else round(value, 1)
+        for metric in ("chest", "waist", "hips", "shoulder"):
+            if rng.random() < MISSING_SHARE:
+                person[metric] = None
+
+        population.append(person)
+
+    return population
+
+
+# ==================== Stubs ====================
+
+
+class LocalChartProvider(SizeChartProvider):
+    """Chart provider with no database: every product uses its type chart."""
+
+    async def _load(self, product_ids: list[str]) -> dict[str, ChartEntry]:
+        expires_at = time.monotonic() + settings.size_chart_cache_ttl
+        loaded = {pid: ChartEntry(None, None, expires_at) for pid in product_ids}
+        for product_id, entry in loaded.items():
+            self._store(product_id, entry)
+        return loaded
+
+
+async def stub_tips(recommended_size: str, measurements: dict, product_type: str, fit_preference: str) -> list[str]:
+    return [f"Size {recommended_size}"]
+
+
+def install_stubs():
+    settings.size_tips_deadline = 0
+    size_rec.generate_size_tips = stub_tips
+    size_rec.chart_provider = LocalChartProvider(size_rec.COMPILED_CHARTS)
+
+
+# ==================== Helpers ====================
+
+
+def latency_stats(latencies_us: list[float], wall_s: float, items: int) -> dict:
+    latencies_us = sorted(latencies_us)
+    return {
+        "calls": len(latencies_us),
+        "throughput_per_s": round(items / wall_s, 1),
+        "mean_us": round(statistics.mean(latencies_us), 2),
+        "p50_us": round(latencies_us[len(latencies_us) // 2], 2),
+        "p99_us": round(latencies_us[int(len(latencies_us) * 0.99)], 2),
+    }
+
+
+def digest(values) -> str:
+    return hashlib.sha256(json.dumps(values, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+# ==================== Scorer ====================
+
+
+def bench_scorer(population: list[dict]) -> dict:
+    """Reference per-user scoring vs one vectorized pass over the population."""
+    matrix = measurements_matrix(population)
+    results = {}
+
+    for product_type, size_chart in size_rec.SIZE_CHARTS.items():
+        chart = size_rec.COMPILED_CHARTS[product_type]
+
+        start = time.perf_counter()
+        reference = [size_rec.calculate_size_scores(size_chart, person) for person in population]
+        reference_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ranked = rank_sizes(chart, matrix)
+        vectorized_s = time.perf_counter() - start
+
+        mismatches = 0
+        for row, scores in enumerate(reference):
+            expected = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+            if ranked.items(row) != expected:
+                mismatches += 1
+
+        results[product_type] = {
+            "users": len(population),
+            "mismatches": mismatches,
+            "reference_digest": digest([sorted(s.items(), key=lambda x: x[1], reverse=True) for s in reference]),
+            "reference_users_per_s": round(len(population) / reference_s, 1),
+            "vectorized_users_per_s": round(len(population) / vectorized_s, 1),
+            "speedup": round(reference_s / vectorized_s, 1),
+        }
+
+    return results
+
+
+# ==================== Lookup Tables ====================
+
+
+def build_tables(directory: Path):
+    for product_type, size_chart in size_rec.SIZE_CHARTS.items():
+        table = build_table(size_rec.COMPILED_CHARTS[product_type])
+        save_table(table, directory, product_type, chart_hash(size_chart))
+
+
+def table_cells(table, samples: int | None, rng: random.Random):
+    """Integer measurement dicts over the table's metrics: all cells, or a random sample."""
+    if samples is None:
+        for index in np.ndindex(*table.data.shape[:-1]):
+            yield {m: low + i for m, low, i in zip(table.metrics, table.lows, index)}
+        return
+    for _ in range(samples):
+        yield {m: rng.randint(*METRIC_BOUNDS[m]) for m in table.metrics}
+
+
+def check_tables(tables: SizeTables, samples: int | None, seed: int) -> dict:
+    """Compare rank_recommendation with and without tables for every checked cell."""
+    rng = random.Random(seed)
+    results = {}
+
+    for product_type, chart in size_rec.COMPILED_CHARTS.items():
+        table = tables.get(chart)
+        if table is None:
+            results[product_type] = {"error": "no table"}
+            continue
+
+        checked, mismatches, examples = 0, 0, []
+        for measurements in table_cells(table, samples, rng):
+            size_rec.size_tables = tables
+            from_table = size_rec.rank_recommendation(chart, measurements)
+            size_rec.size_tables = SizeTables()
+            live = size_rec.rank_recommendation(chart, measurements)
+
+            checked += 1
+            if from_table != live:
+                mismatches += 1
+                if len(examples) < 5:
+                    examples.append({"measurements": measurements, "table": from_table, "live": live})
+
+        results[product_type] = {"checked": checked, "mismatches": mismatches, "examples": examples}
+
+    return results
+
+
+# ==================== Request Paths ====================
+
+
+async def bench_single(population: list[dict], tables: SizeTables) -> dict:
+    """recommend_size per shopper, with and without lookup tables."""
+    results = {}
+
+    for mode, mode_tables in (("tables", tables), ("live", SizeTables())):
+        size_rec.size_tables = mode_tables
+        per_type = {}
+        for product_type in size_rec.SIZE_CHARTS:
+            latencies = []
+            wall = time.perf_counter()
+            for i, person in enumerate(population):
+                start = time.perf_counter()
+                await size_rec.recommend_size(f"bench-{i % 500}", product_type, **person)
+                latencies.append((time.perf_counter() - start) * 1e6)
+            per_type[product_type] = latency_stats(latencies, time.perf_counter() - wall, len(population))
+        results[mode] = per_type
+
+    return results
+
+
+async def bench_batch(population: list[dict], tables: SizeTables, seed: int) -> dict:
+    """recommend_sizes_batch with BATCH_PRODUCTS mixed-type products per shopper."""
+    rng = random.Random(seed)
+    product_types = list(size_rec.SIZE_CHARTS)
+    results = {}
+
+    for mode, mode_tables in (("tables", tables), ("live", SizeTables())):
+        size_rec.size_tables = mode_tables
+        latencies = []
+        wall = time.perf_counter()
+        for person in population:
+            products = [
+                {"product_id": f"bench-{rng.randrange(500)}", "product_type": rng.choice(product_types)}
+                for _ in range(BATCH_PRODUCTS)
+            ]
+            start = time.perf_counter()
+            await size_rec.recommend_sizes_batch(products, person, include_tips=True)
+            latencies.append((time.perf_counter() - start) * 1e6)
+        stats = latency_stats(latencies, time.perf_counter() - wall, len(population) * BATCH_PRODUCTS)
+        stats["products_per_call"] = BATCH_PRODUCTS
+        results[mode] = stats
+
+    return results
+
+
+# ==================== Helper Functions ====================
+
+
+def bench_helpers(population: list[dict]) -> dict:
+    """Output digests and timings of estimate_from_basic and get_size_note."""
+    start = time.perf_counter()
+    estimates = [size_rec.estimate_from_basic(p["height"], p["weight"]) for p in population]
+    estimate_s = time.perf_counter() - start
+
+    sizes = ["XS", "S", "M", "L", "XL", "XXL", "3XL"]
+    pairs = [(a, b) for a in sizes for b in sizes] * max(1, len(population) // 49)
+    start = time.perf_counter()
+    notes = [size_rec.get_size_note(a, b) for a, b in pairs]
+    note_s = time.perf_counter() - start
+
+    return {
+        "estimate_from_basic": {
+            "digest": digest(estimates),
+            "calls_per_s": round(len(population) / estimate_s, 1),
+        },
+        "get_size_note": {
+            "digest": digest(notes[:49]),
+            "calls_per_s": round(len(pairs) / note_s, 1),
+        },
+    }
+
+
+# ==================== Main ====================
+
+
+def reference_digests(results: dict) -> dict:
+    digests = {f"scorer.{t}": r["reference_digest"] for t, r in results["scorer"].items()}
+    digests.update({f"helpers.{name}": r["digest"] for name, r in results["helpers"].items()})
+    return digests
+
+
+def compare_baseline(results: dict, baseline_path: Path) -> list[str]:
+    """Reference outputs that differ from a previous run with the same population arguments."""
+    baseline = json.loads(baseline_path.read_text())
+    if baseline["config"] != results["config"]:
+        return ["config differs from baseline; rerun with the baseline's --population/--seed"]
+    current = reference_digests(results)
+    return [
+        f"{name}: {digest_value} != baseline {baseline['digests'].get(name)}"
+        for name, digest_value in current.items()
+        if baseline["digests"].get(name) != digest_value
+    ]
+
+
+async def run(args) -> dict:
+    population = make_population(args.population, args.seed)
+    install_stubs()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.tables or Path(tmp)
+        if not args.tables:
+            build_tables(directory)
+        tables = SizeTables()
+        tables.load(str(directory), {t: (size_rec.SIZE_CHARTS[t], size_rec.COMPILED_CHARTS[t]) for t in size_rec.SIZE_CHARTS})
+
+        requests = population[:args.requests]
+        results = {
+            "config": {"population": args.population, "seed": args.seed},
+            "environment": {"python": platform.python_version(), "numpy": np.__version__},
+            "scorer": bench_scorer(population),
+            "tables": check_tables(tables, None if args.exhaustive else args.samples, args.seed),
+            "single": await bench_single(requests, tables),
+            "batch": await bench_batch(requests[:max(1, args.requests // 10)], tables, args.seed),
+            "helpers": bench_helpers(population),
+        }
+
+    results["digests"] = reference_digests(results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--population", type=int, default=20_000, help="Synthetic shoppers")
+    parser.add_argument("--requests", type=int, default=2_000, help="Shoppers sent through the request paths")
+    parser.add_argument("--tables", type=Path, help="Prebuilt table directory (default: build into a temp dir)")
+    parser.add_argument("--samples", type=int, default=100_000, help="Random table cells checked per product type")
+    parser.add_argument("--exhaustive", action="store_true", help="Check every table cell (slow)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", type=Path, help="Previous results; fail if reference outputs changed")
+    parser.add_argument("--output", type=Path, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    # Per-request info logs would dominate the timings
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    results = asyncio.run(run(args))
+
+    failures = [f"scorer.{t}: {r['mismatches']} mismatches" for t, r in results["scorer"].items() if r["mismatches"]]
+    failures += [
+        f"tables.{t}: {r.get('error') or str(r['mismatches']) + ' mismatches'}"
+        for t, r in results["tables"].items()
+        if r.get("error") or r["mismatches"]
+    ]
+    if args.baseline:
+        failures += compare_baseline(results, args.baseline)
+    results["failures"] = failures
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Try-on Mode Benchmark
+Compares staged and fused try-on on the same inputs against the real Gemini API
+
+Usage (from ai-service/, with GEMINI_API_KEY set):
+    python -m benchmarks.tryon_modes --user-image me.jpg --product-image shirt.jpg --runs 5
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from app.config import get_settings
+from app.services import llm
+from app.workers import tryon
+
+settings = get_settings()
+
+
+class CallCounter:
+    """Counts Gemini requests made through the shared client."""
+
+    def __init__(self, models):
+        self.calls = 0
+        self._generate = models.generate_content
+        self._stream = models.generate_content_stream
+        models.generate_content = self.generate_content
+        models.generate_content_stream = self.generate_content_stream
+
+    async def generate_content(self, **kwargs):
+        self.calls += 1
+        return await self._generate(**kwargs)
+
+    async def generate_content_stream(self, **kwargs):
+        self.calls += 1
+        return await self._stream(**kwargs)
+
+
+async def run_mode(mode: str, user_image: bytes, product_image: bytes, product_info: dict, runs: int) -> dict:
+    settings.tryon_mode = mode
+    counter = CallCounter(llm.client.aio.models)
+    latencies, failures = [], 0
+    stage_timings: dict[str, list[float]] = {}
+
+    for i in range(runs):
+        # Fresh garment image bytes each run so the garment cache does not skew staged mode
+        product_bytes = product_image + str(i).encode()
+        start = time.perf_counter()
+        result = await tryon.process_tryon(f"bench_{mode}_{i}", user_image, product_bytes, product_info)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        if result["status"] != "completed":
+            failures += 1
+        for stage, timing in result.get("timings", {}).items():
+            if "duration_ms" in timing:
+                stage_timings.setdefault(stage, []).append(timing["duration_ms"])
+
+    return {
+        "mode": mode,
+        "runs": runs,
+        "failures": failures,
+        "llm_calls_per_run": counter.calls / runs,
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies), 1),
+            "p50": round(statistics.median(latencies), 1),
+            "max": round(max(latencies), 1),
+        },
+        "stage_p50_ms": {stage: round(statistics.median(values), 1) for stage, values in stage_timings.items()},
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-image", required=True, type=Path)
+    parser.add_argument("--product-image", required=True, type=Path)
+    parser.add_argument("--product-type", default="ao_thun")
+    parser.add_argument("--sizes", default="S,M,L,XL")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    if not llm.client:
+        sys.exit("GEMINI_API_KEY is not configured")
+
+    user_image = args.user_image.read_bytes()
+    product_image = args.product_image.read_bytes()
+    product_info = {
+        "id": "benchmark",
+        "name": "Sản phẩm",
+        "type": args.product_type,
+        "sizes": args.sizes.split(","),
+        "material": "cotton",
+    }
+
+    # Overlay previews are not part of the comparison
+    tryon.create_previews = _no_previews
+
+    results = {
+        "model": settings.gemini_vision_model,
+        "fit_mode": settings.tryon_fit_mode,
+        "modes": [
+            await run_mode(mode, user_image, product_image, product_info, args.runs)
+            for mode in ("staged", "fused")
+        ],
+    }
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
+
+
+async def _no_previews(*args, **kwargs) -> dict:
+    return {}
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
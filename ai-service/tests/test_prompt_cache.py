@@ -0,0 +1,174 @@
+import asyncio
+import json
+import time
+
+import pytest
+import requests
+from google.genai import errors
+
+from app.services.prompt_cache import (
+    CacheHandle,
+    LocalCacheProvider,
+    PromptCache,
+    PromptCacheProvider,
+    is_cache_rejection,
+)
+
+MODEL = "gemini-test"
+PROMPT = "Bạn là Fashion AI"
+
+
+class FailingProvider(LocalCacheProvider):
+    """Refuses to create caches, like Gemini for a prefix below its minimum size."""
+
+    def __init__(self):
+        super().__init__()
+        self.attempts = 0
+
+    async def create(self, model, system_instruction, contents, ttl):
+        self.attempts += 1
+        raise RuntimeError("Cached content is too small")
+
+
+def api_error(code: int, message: str) -> errors.APIError:
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({"error": {"code": code, "message": message}}).encode()
+    return errors.APIError(code, response)
+
+
+async def drain(cache: PromptCache):
+    while cache._background:
+        await asyncio.gather(*cache._background)
+
+
+def test_creates_handle_on_first_use_and_hits_after():
+    async def run():
+        provider = LocalCacheProvider()
+        cache = PromptCache(provider, ttl=3600, refresh_margin=300, retry_after=600)
+
+        first = await cache.get(MODEL, PROMPT)
+        second = await cache.get(MODEL, PROMPT)
+        return provider, cache, first, second
+
+    provider, cache, first, second = asyncio.run(run())
+    assert first is second
+    assert provider.created == [first.name]
+    assert cache.stats.creates == 1
+    assert cache.stats.hits == 1
+
+
+def test_concurrent_first_use_creates_once():
+    async def run():
+        provider = LocalCacheProvider()
+        cache = PromptCache(provider, ttl=3600, refresh_margin=300, retry_after=600)
+        handles = await asyncio.gather(*[cache.get(MODEL, PROMPT) for _ in range(5)])
+        return provider, handles
+
+    provider, handles = asyncio.run(run())
+    assert len(provider.created) == 1
+    assert all(handle is handles[0] for handle in handles)
+
+
+def test_refreshes_in_background_within_margin():
+    async def run():
+        provider = LocalCacheProvider()
+        # Every handle is already inside the refresh margin
+        cache = PromptCache(provider, ttl=60, refresh_margin=120, retry_after=600)
+
+        created = await cache.get(MODEL, PROMPT)
+        hit = await cache.get(MODEL, PROMPT)
+        await drain(cache)
+        return provider, cache, created, hit
+
+    provider, cache, created, hit = asyncio.run(run())
+    assert hit is created  # The old handle is served while refreshing
+    assert provider.refreshed == [created.name]
+    assert cache.stats.refreshes == 1
+
+
+def test_recreates_after_expiry():
+    async def run():
+        provider = LocalCacheProvider()
+        cache = PromptCache(provider, ttl=3600, refresh_margin=300, retry_after=600)
+
+        expired = await cache.get(MODEL, PROMPT)
+        expired.expires_at = time.monotonic() - 1
+        fresh = await cache.get(MODEL, PROMPT)
+        return provider, expired, fresh
+
+    provider, expired, fresh = asyncio.run(run())
+    assert fresh.name != expired.name
+    assert provider.created == [expired.name, fresh.name]
+
+
+def test_invalidated_handle_is_recreated():
+    async def run():
+        provider = LocalCacheProvider()
+        cache = PromptCache(provider, ttl=3600, refresh_margin=300, retry_after=600)
+
+        rejected = await cache.get(MODEL, PROMPT)
+        cache.invalidate(rejected)
+        return rejected, await cache.get(MODEL, PROMPT)
+
+    rejected, fresh = asyncio.run(run())
+    assert fresh.name != rejected.name
+
+
+def test_waits_retry_after_when_provider_refuses():
+    async def run():
+        provider = FailingProvider()
+        cache = PromptCache(provider, ttl=3600, refresh_margin=300, retry_after=600)
+
+        first = await cache.get(MODEL, PROMPT)
+        second = await cache.get(MODEL, PROMPT)
+        return provider, cache, first, second
+
+    provider, cache, first, second = asyncio.run(run())
+    assert first is None and second is None
+    assert provider.attempts == 1
+    assert cache.stats.failures == 1
+    assert cache.stats.bypassed == 1
+
+
+def test_retries_creation_once_retry_after_passed():
+    async def run():
+        provider = FailingProvider()
+        cache = PromptCache(provider, ttl=3600, refresh_margin=300, retry_after=0)
+
+        await cache.get(MODEL, PROMPT)
+        await cache.get(MODEL, PROMPT)
+        return provider
+
+    assert asyncio.run(run()).attempts == 2
+
+
+def test_without_provider_prompt_is_sent_inline():
+    cache = PromptCache(None)
+    assert asyncio.run(cache.get(MODEL, PROMPT)) is None
+    assert cache.stats.bypassed == 1
+
+
+def test_provider_must_implement_create_and_refresh():
+    class Incomplete(PromptCacheProvider):
+        async def create(self, model, system_instruction, contents, ttl):
+            return CacheHandle(name="x", expires_at=0)
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@pytest.mark.parametrize(
+    "error, rejected",
+    [
+        (api_error(404, "Not found"), True),
+        (api_error(403, "CachedContent not found (or permission denied)"), True),
+        (api_error(400, "Invalid cached_content name"), True),
+        (api_error(400, "Request contains an invalid argument."), False),
+        (api_error(429, "Resource has been exhausted"), False),
+        (api_error(503, "The model is overloaded"), False),
+        (asyncio.TimeoutError(), False),
+    ],
+)
+def test_only_cache_errors_are_rejections(error, rejected):
+    assert is_cache_rejection(error) is rejected